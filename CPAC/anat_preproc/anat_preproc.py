@@ -734,10 +734,15 @@ def unet_brain_connector(wf, cfg, strat_pool, pipe_num, opt):
     rescale_dim: 256
     """
     from CPAC.unet.function import predict_volumes
-    unet_mask = pe.Node(util.Function(input_names=['model_path', 'cimg_in'],
+    num_threads = cfg.pipeline_setup['system_config'][
+        'max_cores_per_participant']
+    unet_mask = pe.Node(util.Function(input_names=['model_path', 'cimg_in',
+                                                   'num_threads'],
                                       output_names=['out_path'],
                                       function=predict_volumes),
-                        name=f'unet_mask_{pipe_num}')
+                        name=f'unet_mask_{pipe_num}',
+                        n_procs=num_threads)
+    unet_mask.inputs.num_threads = num_threads
 
     node, out = strat_pool.get_data('unet-model')
     wf.connect(node, out, unet_mask, 'model_path')
@@ -8,7 +8,7 @@ from scipy.stats import t
 from numpy import inf
 
 from CPAC.cwas.mdmr import mdmr
-from CPAC.utils import correlation
+from CPAC.utils.utils import zscore
 
 from CPAC.pipeline.cpac_ga_model_generator import (create_merge_mask,
                                                    create_merged_copefile)
@@ -47,23 +47,140 @@ def calc_mdmrs(D, regressor, cols, permutations):
     return F_set, p_set
 
 
-def calc_subdists(subjects_data, voxel_range):
+def normalize_subjects(subject_files, mask_indices, out_file=None,
+                       dtype=np.float64):
+    """
+    Z-scores the masked timeseries of each subject once, scaled so that the
+    dot product of two voxels' timeseries is their Pearson correlation
+
+    Parameters
+    ----------
+    subject_files : list of strings
+        A length `N` list of file paths of the nifti files of subjects
+    mask_indices : tuple of ndarrays
+        Indices of the voxels to keep, as returned by `np.where(mask)`
+    out_file : string, optional
+        Path of a .npy file to memory-map the normalized data to, so only
+        one subject is held in memory at a time
+    dtype : numpy dtype
+        Data type of the normalized data
+
+    Returns
+    -------
+    subjects_data : ndarray
+        (subjects, voxels, timepoints) array of normalized timeseries
+
+    """
+    subjects_data = None
+    for si, subject_file in enumerate(subject_files):
+        data = nb.load(subject_file).get_fdata()[mask_indices]
+        if subjects_data is None:
+            shape = (len(subject_files),) + data.shape
+            if out_file:
+                subjects_data = np.lib.format.open_memmap(
+                    out_file, mode='w+', dtype=dtype, shape=shape)
+            else:
+                subjects_data = np.empty(shape, dtype=dtype)
+        subjects_data[si] = zscore(data, 1) / np.sqrt(data.shape[1])
+    return subjects_data
+
+
+def calc_subdists(subjects_data, voxel_range, z_scored=False, out_file=None,
+                  block_size=64, chunk_size=None):
+    """
+    Computes the distance between every pair of subjects' connectivity
+    profiles for a range of seed voxels
+
+    Seeds are processed in blocks of `block_size`: the connectivity
+    profiles of a block are computed with one matrix product per subject
+    over chunks of `chunk_size` voxels, and only the subject-by-subject
+    cross products of the profiles are kept in memory.
+
+    Parameters
+    ----------
+    subjects_data : ndarray
+        (subjects, voxels, timepoints) array of masked timeseries, possibly
+        memory-mapped
+    voxel_range : ndarray
+        Indexes of the seed voxels
+    z_scored : boolean
+        Whether `subjects_data` is already normalized by
+        `normalize_subjects`
+    out_file : string, optional
+        Path of a .npy file to memory-map the distance matrices to
+    block_size : integer
+        Number of seeds processed at once
+    chunk_size : integer, optional
+        Number of voxels per connectivity profile chunk; by default chosen
+        so that a chunk of profiles takes about 1 GB
+
+    Returns
+    -------
+    D : ndarray
+        (seeds, subjects, subjects) array of distances
+
+    """
+    if not z_scored:
+        subjects_data = zscore(subjects_data, 2) / \
+            np.sqrt(subjects_data.shape[2])
+
+    voxel_range = np.asarray(voxel_range, dtype=int)
     subjects, voxels, _ = subjects_data.shape
-    D = np.zeros((len(voxel_range), subjects, subjects))
-    for i, v in enumerate(voxel_range):
-        profiles = np.zeros((subjects, voxels))
-        for si in range(subjects):
-            profiles[si] = correlation(subjects_data[si, v], subjects_data[si])
-        profiles = np.clip(np.nan_to_num(profiles), -0.9999, 0.9999)
-        profiles = np.arctanh(np.delete(profiles, v, 1))
-        D[i] = correlation(profiles, profiles)
-
-    D = np.sqrt(2.0 * (1.0 - D))
+    if chunk_size is None:
+        chunk_size = max(1, 2 ** 27 // (block_size * subjects))
+
+    shape = (len(voxel_range), subjects, subjects)
+    if out_file:
+        D = np.lib.format.open_memmap(out_file, mode='w+', dtype=np.float64,
+                                      shape=shape)
+    else:
+        D = np.zeros(shape)
+
+    for start in range(0, len(voxel_range), block_size):
+        seeds = voxel_range[start:start + block_size]
+        seeds_data = [subjects_data[si, seeds] for si in range(subjects)]
+
+        cross = np.zeros((len(seeds), subjects, subjects))
+        total = np.zeros((len(seeds), subjects))
+        seed_profile = np.zeros((len(seeds), subjects))
+
+        for vstart in range(0, voxels, chunk_size):
+            vstop = min(vstart + chunk_size, voxels)
+            profiles = np.empty((len(seeds), subjects, vstop - vstart))
+            for si in range(subjects):
+                profiles[:, si] = np.dot(seeds_data[si],
+                                         subjects_data[si, vstart:vstop].T)
+            np.clip(profiles, -0.9999, 0.9999, out=profiles)
+            np.arctanh(profiles, out=profiles)
+
+            cross += np.matmul(profiles, profiles.transpose(0, 2, 1))
+            total += profiles.sum(axis=2)
+
+            in_chunk = np.where((seeds >= vstart) & (seeds < vstop))[0]
+            seed_profile[in_chunk] = \
+                profiles[in_chunk, :, seeds[in_chunk] - vstart]
+
+        # leave each seed out of its own profile before correlating them
+        cross -= seed_profile[:, :, np.newaxis] * \
+            seed_profile[:, np.newaxis, :]
+        mean = (total - seed_profile) / (voxels - 1)
+        cov = cross / (voxels - 1) - \
+            mean[:, :, np.newaxis] * mean[:, np.newaxis, :]
+        std = np.sqrt(np.clip(np.diagonal(cov, axis1=1, axis2=2), 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = cov / (std[:, :, np.newaxis] * std[:, np.newaxis, :])
+        r = np.clip(np.nan_to_num(r, posinf=0.0, neginf=0.0), -1.0, 1.0)
+
+        D[start:start + len(seeds)] = np.sqrt(2.0 * (1.0 - r))
+
+    if out_file:
+        D.flush()
     return D
 
 
-def calc_cwas(subjects_data, regressor, regressor_selected_cols, permutations, voxel_range):
-    D = calc_subdists(subjects_data, voxel_range)
+def calc_cwas(subjects_data, regressor, regressor_selected_cols, permutations,
+              voxel_range, **subdist_kwargs):
+    D = calc_subdists(subjects_data, voxel_range, **subdist_kwargs)
     F_set, p_set = calc_mdmrs(
         D, regressor, regressor_selected_cols, permutations)
     return F_set, p_set
@@ -165,14 +282,22 @@ def nifti_cwas(subjects, mask_file, regressor_file, participant_column,
         raise ValueError('Number of subjects does not match regressor size')
     mask = nb.load(mask_file).get_fdata().astype('bool')
     mask_indices = np.where(mask)
-    subjects_data = np.array([
-        nb.load(subject_file).get_fdata().astype('float64')[mask_indices]
-        for subject_file in subject_files
-    ])
 
-    F_set, p_set = calc_cwas(subjects_data, regressor, regressor_selected_cols,
-                             permutations, voxel_range)
     cwd = os.getcwd()
+    data_file = os.path.join(cwd, 'subjects_data.npy')
+    dists_file = os.path.join(cwd, 'subject_distances.npy')
+    subjects_data = normalize_subjects(subject_files, mask_indices,
+                                       out_file=data_file)
+
+    F_set, p_set = calc_cwas(subjects_data, regressor, regressor_selected_cols,
+                             permutations, voxel_range, z_scored=True,
+                             out_file=dists_file)
+
+    # the memory-mapped intermediates are not outputs of this node
+    del subjects_data
+    for intermediate in (data_file, dists_file):
+        os.remove(intermediate)
+
     F_file = os.path.join(cwd, 'pseudo_F.npy')
     p_file = os.path.join(cwd, 'significance_p.npy')
 
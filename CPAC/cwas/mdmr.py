@@ -69,7 +69,42 @@ def ftest_fast(Hs, IHs, Gs, df_among, df_resid, **ssq_kwrds):
     F = (SS_among / df_among) / (SS_resid / df_resid)
     return F
 
-def mdmr(D, X, columns, permutations):
+def gen_residual_basis(Qj, Xc):
+    R = Xc - np.matmul(Qj, np.matmul(Qj.T, Xc))
+    Q, _ = np.linalg.qr(R)
+    return Q
+
+def ftest_batched(x, cols, perms, Gs, df_among, df_resid, batch_size=100):
+    """
+    Pseudo-F statistics for batches of permutations of the columns of
+    interest, without forming the (nobs**2, nperms) hat matrices.
+
+    The nuisance columns are factorized once. For each permutation, the
+    hat matrix of the columns of interest is the projection onto the
+    permuted columns after regressing out the nuisance columns, so the
+    among-group and residual sums of squares only need the traces of the
+    shared nuisance projection and of that per-permutation projection.
+
+    Yields the (batch, voxels) pseudo-F values of each batch, in the order
+    of `perms`.
+    """
+    nobs = x.shape[0]
+    other_cols = [i for i in range(x.shape[1]) if i not in cols]
+    Qj, _ = np.linalg.qr(x[:, other_cols])
+
+    SS_total = Gs[::nobs + 1].sum(axis=0)
+    SS_nuisance = calc_ssq_fast(Qj.dot(Qj.T).flatten(), Gs)
+
+    for start in range(0, perms.shape[0], batch_size):
+        Xc = x[perms[start:start + batch_size]][:, :, cols]
+        Q = gen_residual_basis(Qj, Xc)
+        H2s = np.matmul(Q, Q.transpose(0, 2, 1)).reshape(-1, nobs ** 2)
+
+        SS_among = calc_ssq_fast(H2s, Gs, transpose=False)
+        SS_resid = SS_total - SS_nuisance - SS_among
+        yield (SS_among / df_among) / (SS_resid / df_resid)
+
+def mdmr(D, X, columns, permutations, batch_size=100, reference=False):
 
     check_rank(X)
     
@@ -91,19 +126,31 @@ def mdmr(D, X, columns, permutations):
     permutation_indexes[0, :] = range(subjects)
     for i in range(1, permutations):
         permutation_indexes[i,:] = np.random.permutation(subjects)
-    
-    H2perms = gen_h2_perms(X1, columns, permutation_indexes)
-    IHperms = gen_ih_perms(X1, columns, permutation_indexes)
 
     df_among = len(columns)
     df_resid = subjects - regressors
 
-    F_perms = ftest_fast(H2perms, IHperms, Gs, df_among, df_resid)
+    if reference:
+        H2perms = gen_h2_perms(X1, columns, permutation_indexes)
+        IHperms = gen_ih_perms(X1, columns, permutation_indexes)
 
-    p_vals = (F_perms[1:, :] >= F_perms[0, :]) \
-                .sum(axis=0) \
-                .astype('float')
-    p_vals /= permutations
+        F_perms = ftest_fast(H2perms, IHperms, Gs, df_among, df_resid)
+
+        p_vals = (F_perms[1:, :] >= F_perms[0, :]) \
+                    .sum(axis=0) \
+                    .astype('float')
+        p_vals /= permutations
 
-    return F_perms[0, :], p_vals
+        return F_perms[0, :], p_vals
+
+    F_set = None
+    p_vals = np.zeros(voxels)
+    for F_batch in ftest_batched(X1, columns, permutation_indexes, Gs,
+                                 df_among, df_resid, batch_size):
+        if F_set is None:
+            F_set = F_batch[0, :]
+            F_batch = F_batch[1:, :]
+        p_vals += (F_batch >= F_set).sum(axis=0)
+    p_vals /= permutations
 
+    return F_set, p_vals
@@ -323,3 +323,29 @@ def test_distances():
     ffile = op.join(sdir, "iq_meanFD+age+sex.mdmr", "fperms_FSIQ.desc")
     fperms = np.array(robjects.r("as.matrix(attach.big.matrix('%s'))" % ffile))
     n = np.sqrt(dmats.shape[0])
+
+
+def test_calc_subdists(tmpdir):
+    """blocked distances match correlating one seed's profiles at a time"""
+    import numpy as np
+    from CPAC.cwas.cwas import calc_subdists
+    from CPAC.utils import correlation
+
+    rng = np.random.default_rng(0)
+    subjects_data = rng.standard_normal((6, 120, 40))
+    voxel_range = np.arange(10, 60)
+
+    ref_dmats = np.zeros((len(voxel_range), 6, 6))
+    for i, v in enumerate(voxel_range):
+        profiles = np.array([correlation(sdata[v], sdata)
+                             for sdata in subjects_data])
+        profiles = np.arctanh(np.delete(np.clip(profiles, -0.9999, 0.9999),
+                                        v, 1))
+        ref_dmats[i] = np.sqrt(2.0 * (1.0 - correlation(profiles, profiles)))
+
+    dmats = calc_subdists(subjects_data, voxel_range, block_size=16,
+                          chunk_size=25,
+                          out_file=str(tmpdir.join('dmats.npy')))
+
+    assert np.allclose(dmats, ref_dmats, atol=1e-6)
+    assert np.allclose(np.load(str(tmpdir.join('dmats.npy'))), dmats)
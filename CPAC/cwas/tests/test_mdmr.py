@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from CPAC.cwas.mdmr import mdmr
+
+
+@pytest.mark.parametrize('columns', [[1], [1, 3]])
+def test_mdmr_batched_matches_reference(columns):
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((30, 3))
+    points = rng.standard_normal((12, 30, 4))
+    D = np.sqrt(((points[:, :, np.newaxis] -
+                  points[:, np.newaxis]) ** 2).sum(axis=-1))
+
+    np.random.seed(0)
+    F_ref, p_ref = mdmr(D, X, np.array(columns), 200, reference=True)
+    np.random.seed(0)
+    F_set, p_set = mdmr(D, X, np.array(columns), 200, batch_size=32)
+
+    assert np.allclose(F_set, F_ref)
+    assert np.allclose(p_set, p_ref)
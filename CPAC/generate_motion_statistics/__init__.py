@@ -21,7 +21,9 @@ from .generate_motion_statistics import (motion_power_statistics,
                                         gen_motion_parameters,
                                         gen_power_parameters,
                                         calculate_DVARS,
-                                        ImageTo1D)
+                                        calculate_motion_statistics,
+                                        ImageTo1D,
+                                        power_parameters)
 from .utils import affine_file_from_params_file, affine_from_params
 
 __all__ = [
@@ -30,8 +32,10 @@ __all__ = [
     'calculate_DVARS',
     'calculate_FD_P',
     'calculate_FD_J',
+    'calculate_motion_statistics',
     'gen_motion_parameters',
     'gen_power_parameters',
     'ImageTo1D',
-    'motion_power_statistics'
+    'motion_power_statistics',
+    'power_parameters'
 ]
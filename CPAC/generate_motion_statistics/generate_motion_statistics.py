@@ -435,22 +435,18 @@ def calculate_FD_J(in_file: str, calc_from: LITERAL['affine', 'rms'],
         # The default radius (as in FSL) of a sphere represents the brain
         rmax = 80.0
 
-        T_rb_prev = pm[0].reshape(4, 4)
+        # relative transform of every volume to the one before it, all at
+        # once
+        T_rb = pm.reshape(-1, 4, 4)
+        M = T_rb[1:] @ np.linalg.inv(T_rb[:-1]) - np.eye(4)
+        A = M[:, 0:3, 0:3]
+        b = M[:, 0:3, 3:4] + A @ center
 
         fd = np.zeros(pm.shape[0])
-
-        for i in range(1, pm.shape[0]):
-            T_rb = pm[i].reshape(4, 4)
-
-            M = np.dot(T_rb, np.linalg.inv(T_rb_prev)) - np.eye(4)
-            A = M[0:3, 0:3]
-            b = M[0:3, 3:4] + A @ center
-
-            fd[i] = np.sqrt(
-                (rmax * rmax / 5) * np.trace(np.dot(A.T, A)) + np.dot(b.T, b)
-            )
-
-            T_rb_prev = T_rb
+        fd[1:] = np.sqrt(
+            (rmax * rmax / 5) * np.square(A).sum(axis=(1, 2)) +
+            np.square(b).sum(axis=(1, 2))
+        )
 
     elif calc_from == 'rms':
         rel_rms = np.loadtxt(in_file)
@@ -612,15 +608,40 @@ def gen_power_parameters(fdp=None, fdj=None, dvars=None,
     """
     import numpy as np
 
+    fdp_data = np.loadtxt(fdp) if fdp else None
+    fdj_data = np.loadtxt(fdj) if fdj else None
+    dvars_data = np.loadtxt(dvars) if dvars else None
+
+    return write_power_parameters(power_parameters(
+        fdp_data, fdj_data, dvars_data, motion_correct_tool))
+
+
+def power_parameters(fdp_data=None, fdj_data=None, dvars_data=None,
+                     motion_correct_tool='3dvolreg'):
+    """
+    Method to calculate Power parameters for scrubbing from arrays
+
+    Parameters
+    ----------
+    fdp_data : ~numpy.ndarray
+        framewise displacement (FD as per power et al., 2012)
+    fdj_data : ~numpy.ndarray
+        framewise displacement (FD as per jenkinson et al., 2002)
+    dvars_data : ~numpy.ndarray
+        DVARS
+
+    Returns
+    -------
+    info : list
+        contains information about power parameters
+    """
     meanFD_Power = []
     meanDVARS = []
     meanFD_Jenkinson = []
     rmsFDJ = []
     FDJquartile = []
 
-    if fdp:
-        fdp_data = np.loadtxt(fdp)
-        dvars_data = np.loadtxt(dvars)
+    if fdp_data is not None:
 
         # Mean (across time/frames) of the absolute values
         # for Framewise Displacement (FD)
@@ -630,8 +651,7 @@ def gen_power_parameters(fdp=None, fdj=None, dvars=None,
         meanDVARS = np.mean(dvars_data)
 
         if motion_correct_tool == '3dvolreg':
-            if fdj:
-                fdj_data = np.loadtxt(fdj)
+            if fdj_data is not None:
 
                 # Mean FD Jenkinson
                 meanFD_Jenkinson = np.mean(fdj_data)
@@ -656,6 +676,25 @@ def gen_power_parameters(fdp=None, fdj=None, dvars=None,
                 ('MeanFD_Power', meanFD_Power),
                 ('MeanDVARS', meanDVARS)]
 
+    return info
+
+
+def write_power_parameters(info):
+    """
+    Method to write Power parameters to a file
+
+    Parameters
+    ----------
+    info : list
+        output of ``power_parameters``
+
+    Returns
+    -------
+    out_file : string (csv file)
+        path to csv file containing all the pow parameters
+    info : text
+        contains information about power parameters
+    """
     out_file = os.path.join(os.getcwd(), 'pow_params.txt')
     with open(out_file, 'a') as f:
         f.write(','.join(t for t, v in info))
@@ -714,16 +753,22 @@ class ImageTo1D(AFNICommand):
     output_spec = ImageTo1DOutputSpec
 
 
-def calculate_DVARS(func_brain, mask):
+def calculate_DVARS(func_brain, mask, chunk_size=64):
     """
     Method to calculate DVARS as per power's method
 
+    The mask is applied before differencing, and the functional data are
+    read through a memory-mapped image in blocks of ``chunk_size``
+    timepoints.
+
     Parameters
     ----------
     func_brain : string (nifti file)
         path to motion correct functional data
     mask : string (nifti file)
         path to brain only mask for functional data
+    chunk_size : int, optional
+        number of timepoints read at a time
 
     Returns
     -------
@@ -734,17 +779,29 @@ def calculate_DVARS(func_brain, mask):
     """
     import numpy as np
     import nibabel as nb
-    rest_data = nb.load(func_brain).get_fdata().astype(np.float32)
+    rest_img = nb.load(func_brain, mmap=True, keep_file_open=True)
     mask_data = nb.load(mask).get_fdata().astype('bool')
-
-    # square of relative intensity value for each voxel across every timepoint
-    data = np.square(np.diff(rest_data, axis=3))
-
-    # applying mask, getting the data in the brain only
-    data = data[mask_data]
-
-    # square root and mean across all timepoints inside mask
-    dvars = np.sqrt(np.mean(data, axis=0))
+    timepoints = rest_img.shape[3]
+    num_voxels = mask_data.sum()
+
+    dvars = np.zeros(timepoints - 1)
+    previous = None
+    for start in range(0, timepoints, chunk_size):
+        stop = min(start + chunk_size, timepoints)
+        # applying mask, getting the data in the brain only
+        data = np.asanyarray(rest_img.dataobj[..., start:stop]
+                             )[mask_data].astype(np.float32)
+        if previous is not None:
+            data = np.column_stack([previous, data])
+        previous = data[:, -1]
+        # mean across voxels inside mask of the square of relative
+        # intensity value for each timepoint
+        first = start - 1 if start else 0
+        dvars[first:stop - 1] = np.square(np.diff(data, axis=1)).sum(
+            axis=0, dtype=np.float64) / num_voxels
+
+    # square root
+    dvars = np.sqrt(dvars)
 
     out_file = os.path.join(os.getcwd(), 'DVARS.txt')
     np.savetxt(out_file, dvars)
@@ -754,6 +811,55 @@ def calculate_DVARS(func_brain, mask):
     return out_file, dvars
 
 
+def calculate_motion_statistics(movement_parameters, fdj_in_file, func_brain,
+                                mask, calc_from='affine', center=None,
+                                motion_correct_tool='3dvolreg',
+                                chunk_size=64):
+    """
+    Method to calculate DVARS, framewise displacement as per Power et al.,
+    2012 and as per Jenkinson et al., 2002, and the Power parameters in one
+    call, reading each input once
+
+    Parameters
+    ----------
+    movement_parameters : string
+        movement parameters vector file path
+    fdj_in_file : string
+        matrix transformations from volume alignment file path if
+        calc_from is 'affine', or FDRMS (*_rel.rms) output if
+        calc_from is 'rms'
+    func_brain : string (nifti file)
+        path to motion correct functional data
+    mask : string (nifti file)
+        path to brain only mask for functional data
+    calc_from : string
+        one of {'affine', 'rms'}
+    center : ~numpy.ndarray, optional
+        optional volume center for the from-affine calculation
+    motion_correct_tool : string
+        one of {'3dvolreg', 'mcflirt'}
+    chunk_size : int, optional
+        number of timepoints read at a time for DVARS
+
+    Returns
+    -------
+    dvars : tuple
+        (DVARS file path, DVARS array)
+    fdp : tuple
+        (FD-P file path, FD-P array)
+    fdj : tuple
+        (FD-J file path, FD-J array)
+    power : tuple
+        (Power parameters file path, Power parameters info)
+    """
+    dvars = calculate_DVARS(func_brain, mask, chunk_size)
+    fdp = calculate_FD_P(movement_parameters)
+    fdj = calculate_FD_J(fdj_in_file, calc_from, center)
+    power = write_power_parameters(power_parameters(
+        fdp[1], fdj[1], dvars[1], motion_correct_tool))
+    return dvars, fdp, fdj, power
+
+
 def get_allmotion(fdj, fdp, maxdisp, motion, power, relsdisp=None, dvars=None):
     """
     Method to append all the motion and power parameters into 2 files
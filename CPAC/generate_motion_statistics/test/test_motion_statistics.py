@@ -0,0 +1,66 @@
+import os
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+from CPAC.generate_motion_statistics import affine_from_params, \
+                                            calculate_DVARS, \
+                                            calculate_FD_J, \
+                                            calculate_motion_statistics
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100])
+def test_calculate_DVARS(tmpdir, chunk_size):
+    os.chdir(tmpdir)
+    rng = np.random.default_rng(10)
+    img_data = rng.uniform(-3000, 3000, (10, 11, 12, 40)).astype(np.float32)
+    mask_data = rng.random((10, 11, 12)) > 0.3
+    nb.Nifti1Image(img_data, np.eye(4)).to_filename('dvars_data.nii.gz')
+    nb.Nifti1Image(mask_data.astype(np.float32), np.eye(4)).to_filename(
+        'dvars_mask.nii.gz')
+
+    out_file, dvars = calculate_DVARS('dvars_data.nii.gz',
+                                      'dvars_mask.nii.gz', chunk_size)
+
+    expected = np.sqrt(np.mean(np.square(np.diff(
+        img_data[mask_data].astype(np.float64), axis=1)), axis=0))
+    np.testing.assert_allclose(np.loadtxt(out_file), expected, rtol=1e-5)
+    np.testing.assert_allclose(dvars, np.insert(expected, 0, 0), rtol=1e-5)
+
+
+def test_calculate_motion_statistics(tmpdir):
+    os.chdir(tmpdir)
+    rng = np.random.default_rng(10)
+    img_data = rng.uniform(-3000, 3000, (6, 5, 4, 30)).astype(np.float32)
+    nb.Nifti1Image(img_data, np.eye(4)).to_filename('func.nii.gz')
+    nb.Nifti1Image(np.ones((6, 5, 4), dtype=np.float32),
+                   np.eye(4)).to_filename('mask.nii.gz')
+    params = rng.normal(0, 0.01, (30, 6))
+    np.savetxt('movement_parameters.1D', params)
+    affines = affine_from_params(params)
+    np.savetxt('affines.1D', affines[:, :3].reshape(30, 12))
+
+    center = np.array([10., 20., 30.]).reshape((3, 1))
+    dvars, fdp, fdj, power = calculate_motion_statistics(
+        'movement_parameters.1D', 'affines.1D', 'func.nii.gz',
+        'mask.nii.gz', center=center)
+
+    # FD-J one volume at a time
+    expected_fdj = [0]
+    for previous, current in zip(affines[:-1], affines[1:]):
+        M = current @ np.linalg.inv(previous) - np.eye(4)
+        A = M[:3, :3]
+        b = M[:3, 3:] + A @ center
+        expected_fdj.append(np.sqrt(80 * 80 / 5 * np.trace(A.T @ A) +
+                                    (b.T @ b).item()))
+    np.testing.assert_allclose(fdj[1], expected_fdj, atol=1e-12)
+    np.testing.assert_allclose(calculate_FD_J(
+        'affines.1D', 'affine', center)[1], expected_fdj, atol=1e-12)
+
+    assert len(dvars[1]) == len(fdp[1]) == len(fdj[1]) == 30
+    info = dict(power[1])
+    assert info['MeanFD_Power'] == pytest.approx(np.mean(fdp[1]))
+    assert info['MeanFD_Jenkinson'] == pytest.approx(np.mean(expected_fdj))
+    assert info['MeanDVARS'] == pytest.approx(np.mean(dvars[1]))
+    assert os.path.exists(power[0])
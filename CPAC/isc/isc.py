@@ -1,29 +1,29 @@
 import numpy as np
 
-from CPAC.utils import correlation
+from .utils import loo_normalize, p_from_null, phase_randomize
 
-from .utils import p_from_null, phase_randomize
 
+def loo_isc(D, dtype=np.float64):
+    """
+    Correlation of each subject's timeseries with the leave-one-out mean
+    of the other subjects, for every voxel at once.
 
-def isc(D, std=None, collapse_subj=True):
+    Returns an (n_subj, n_vox) array.
+    """
+    Z, ZL = loo_normalize(D, dtype)
+    return np.einsum('vts,vts->sv', Z, ZL)
+
+
+def isc(D, std=None, collapse_subj=True, dtype=np.float64):
 
     assert D.ndim == 3
 
     n_vox, _, n_subj = D.shape
-    n_subj_loo = n_subj - 1
 
-    group_sum = np.add.reduce(D, axis=2)
+    ISC = loo_isc(D, dtype)
 
     if collapse_subj:
-        ISC = np.zeros(n_vox)
-        for loo_subj in range(n_subj):
-            loo_subj_ts = D[:, :, loo_subj]
-            ISC += correlation(
-                loo_subj_ts,
-                (group_sum - loo_subj_ts) / n_subj_loo,
-                match_rows=True
-            )
-        ISC /= n_subj
+        ISC = ISC.mean(axis=0)
 
         if std:
             ISC_avg = ISC.mean()
@@ -33,15 +33,6 @@ def isc(D, std=None, collapse_subj=True):
             masked = np.array([True] * n_vox)
 
     else:
-        ISC = np.zeros((n_subj, n_vox))
-        for loo_subj in range(n_subj):
-            loo_subj_ts = D[:, :, loo_subj]
-            ISC[loo_subj] = correlation(
-                loo_subj_ts,
-                (group_sum - loo_subj_ts) / n_subj_loo,
-                match_rows=True
-            )
-        
         masked = np.array([True] * n_vox)
 
     return ISC, masked
@@ -59,38 +50,23 @@ def isc_permutation(permutation, D, masked, collapse_subj=True, random_state=0):
 
     print("Permutation", permutation)
 
-    min_null = 1
-    max_null = -1
+    D = phase_randomize(D[masked], random_state)
 
-    D = D[masked]
+    min_null, max_null = isc_null(D, collapse_subj)
 
-    n_vox, _, n_subj = D.shape
-    n_subj_loo = n_subj - 1
-    D = phase_randomize(D, random_state)
-
-    if collapse_subj:
-        ISC_null = np.zeros(n_vox)
+    return permutation, min_null, max_null
 
-    group_sum = np.add.reduce(D, axis=2)
 
-    for loo_subj in range(n_subj):
-        loo_subj_ts = D[:, :, loo_subj]
-        ISC_subj = \
-            correlation(
-                loo_subj_ts,
-                (group_sum - loo_subj_ts) / n_subj_loo,
-                match_rows=True
-            )
+def isc_null(D, collapse_subj=True, dtype=np.float64):
 
-        if collapse_subj:
-            ISC_null += ISC_subj
-        else:
-            max_null = max(np.max(ISC_subj), max_null)
-            min_null = min(np.min(ISC_subj), min_null)
+    ISC_null = loo_isc(D, dtype)
 
     if collapse_subj:
-        ISC_null /= n_subj
+        ISC_null = ISC_null.mean(axis=0)
         max_null = np.max(ISC_null)
         min_null = np.min(ISC_null)
+    else:
+        max_null = max(np.max(ISC_null), -1)
+        min_null = min(np.min(ISC_null), 1)
 
-    return permutation, min_null, max_null
+    return min_null, max_null
@@ -1,45 +1,46 @@
 import numpy as np
-from CPAC.utils import correlation
 
-from .utils import p_from_null, phase_randomize
+from .utils import loo_normalize, p_from_null, phase_randomize
 
 
-def isfc(D, std=None, collapse_subj=True):
+def loo_isfc(D, collapse_subj=True, dtype=np.float64):
+    """
+    Correlation of each subject's timeseries with the leave-one-out mean
+    of the other subjects, between every pair of voxels, symmetrized.
+
+    Returns an (n_vox, n_vox) array averaged over subjects if
+    `collapse_subj`, otherwise an (n_vox, n_vox, n_subj) array.
+    """
+    n_subj = D.shape[2]
+    Z, ZL = loo_normalize(D, dtype)
+
+    if collapse_subj:
+        ISFC = np.einsum('vts,wts->vw', Z, ZL, optimize=True) / n_subj
+        ISFC = np.clip(ISFC, -1.0, 1.0)
+        return (ISFC + ISFC.T) / 2
+
+    ISFC = np.matmul(Z.transpose(2, 0, 1), ZL.transpose(2, 1, 0))
+    ISFC = np.clip(ISFC, -1.0, 1.0)
+    ISFC = (ISFC + ISFC.transpose(0, 2, 1)) / 2
+    return np.moveaxis(ISFC, 0, -1)
+
+
+def isfc(D, std=None, collapse_subj=True, dtype=np.float64):
 
     assert D.ndim == 3
 
     n_vox, _, n_subj = D.shape
-    n_subj_loo = n_subj - 1
 
-    group_sum = np.add.reduce(D, axis=2)
     masked = None
 
-    if collapse_subj:
-        ISFC = np.zeros((n_vox, n_vox))
-        for loo_subj in range(n_subj):
-            loo_subj_ts = D[:, :, loo_subj]
-            ISFC += correlation(
-                loo_subj_ts,
-                (group_sum - loo_subj_ts) / n_subj_loo,
-                symmetric=True
-            )
-        ISFC /= n_subj
+    ISFC = loo_isfc(D, collapse_subj, dtype)
 
+    if collapse_subj:
         if std:
             ISFC_avg = ISFC.mean()
             ISFC_std = ISFC.std()
             masked = (ISFC <= ISFC_avg + ISFC_std) | (ISFC >= ISFC_avg - ISFC_std)
 
-    else:
-        ISFC = np.zeros((n_vox, n_vox, n_subj))
-        for loo_subj in range(n_subj):
-            loo_subj_ts = D[:, :, loo_subj]
-            ISFC[:, :, loo_subj] = correlation(
-                loo_subj_ts,
-                (group_sum - loo_subj_ts) / n_subj_loo,
-                symmetric=True
-            )
-
     if masked is not None:
         masked = np.all(masked, axis=1)
     else:
@@ -60,39 +61,22 @@ def isfc_permutation(permutation, D, masked, collapse_subj=True, random_state=0)
 
     print("Permutation", permutation)
 
-    min_null = 1
-    max_null = -1
+    D = phase_randomize(D[masked], random_state)
 
-    D = D[masked]
+    min_null, max_null = isfc_null(D, collapse_subj)
 
-    n_vox, _, n_subj = D.shape
-    n_subj_loo = n_subj - 1
+    return permutation, min_null, max_null
 
-    D = phase_randomize(D, random_state)
+
+def isfc_null(D, collapse_subj=True, dtype=np.float64):
+
+    ISFC_null = loo_isfc(D, collapse_subj, dtype)
 
     if collapse_subj:
-        ISFC_null = np.zeros((n_vox, n_vox))
-
-    group_sum = np.add.reduce(D, axis=2)
-
-    for loo_subj in range(n_subj):
-        loo_subj_ts = D[:, :, loo_subj]
-        ISFC_subj = \
-            correlation(
-                loo_subj_ts,
-                (group_sum - loo_subj_ts) / n_subj_loo,
-                symmetric=True
-            )
-
-        if collapse_subj:
-            ISFC_null += ISFC_subj
-        else:
-            max_null = max(np.max(ISFC_subj), max_null)
-            min_null = min(np.min(ISFC_subj), min_null)
-    
-    if collapse_subj:
-        ISFC_null /= n_subj
         max_null = np.max(ISFC_null)
         min_null = np.min(ISFC_null)
+    else:
+        max_null = max(np.max(ISFC_null), -1)
+        min_null = min(np.min(ISFC_null), 1)
 
-    return permutation, min_null, max_null
+    return min_null, max_null
@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from CPAC.utils import check_random_state
+
+from .isc import isc_null
+from .isfc import isfc_null
+from .utils import phase_randomize_fft
+
+_null_functions = {
+    'isc': isc_null,
+    'isfc': isfc_null,
+}
+
+# per-process view of the memory-mapped FFT of the data, set by
+# `_load_fft` so each worker maps the file once rather than once per task
+_fft = {}
+
+
+def _load_fft(fft_file, n_timepoints):
+    _fft['F'] = np.load(fft_file, mmap_mode='r')
+    _fft['n_timepoints'] = n_timepoints
+
+
+def _permutation_null(statistic, collapse_subj, seed):
+    D = phase_randomize_fft(_fft['F'], _fft['n_timepoints'], seed)
+    return _null_functions[statistic](D, collapse_subj)
+
+
+def save_data_fft(D_file, masked, fft_file, chunk_size=4096):
+    """
+    Computes the real FFT along the time axis of the masked voxel x time x
+    subject data once, writing it to a memory-mapped .npy file in chunks of
+    voxels.
+    """
+    D = np.load(D_file, mmap_mode='r')
+    voxels = np.flatnonzero(masked)
+    n_timepoints, n_subj = D.shape[1:]
+
+    F = np.lib.format.open_memmap(
+        fft_file, mode='w+', dtype=np.complex128,
+        shape=(len(voxels), n_timepoints // 2 + 1, n_subj))
+    for start in range(0, len(voxels), chunk_size):
+        chunk = voxels[start:start + chunk_size]
+        F[start:start + len(chunk)] = np.fft.rfft(D[chunk], axis=1)
+    F.flush()
+
+    return n_timepoints
+
+
+def permutation_nulls(D_file, masked, permutations, statistic='isc',
+                      collapse_subj=True, random_state=0, n_procs=1,
+                      fft_file=None):
+    """
+    Computes the null distribution of the minimum and maximum ISC or ISFC
+    over phase-randomized permutations of the data.
+
+    The FFT of the data is computed once and memory-mapped, and each
+    permutation only applies random phase shifts to it, in a pool of
+    `n_procs` processes sharing that file. Only the minimum and maximum of
+    each permutation are kept.
+
+    Parameters
+    ----------
+    D_file : string
+        .npy file of the voxel x time x subject data
+    masked : ndarray
+        Boolean mask of the voxels to include
+    permutations : integer
+        Number of permutations
+    statistic : string
+        'isc' or 'isfc'
+    collapse_subj : boolean
+        Whether to average the leave-one-out correlations over subjects
+    random_state : None | int | instance of RandomState
+        Seeds the per-permutation random states
+    n_procs : integer
+        Number of processes to run permutations in
+    fft_file : string, optional
+        Path of the .npy file to write the FFT of the data to
+
+    Returns
+    -------
+    min_null : list
+        Minimum statistic of each permutation
+    max_null : list
+        Maximum statistic of each permutation
+    """
+    if statistic not in _null_functions:
+        raise ValueError("Unknown statistic '{0}', expected one of "
+                         "{1}".format(statistic, list(_null_functions)))
+
+    if not fft_file:
+        fft_file = os.path.abspath('./data_fft.npy')
+
+    n_timepoints = save_data_fft(D_file, masked, fft_file)
+
+    # seeds are drawn up front so the null does not depend on n_procs
+    seeds = check_random_state(random_state).randint(
+        np.iinfo(np.int32).max, size=permutations)
+    tasks = ([statistic] * permutations, [collapse_subj] * permutations,
+             seeds)
+
+    if n_procs > 1:
+        with ProcessPoolExecutor(max_workers=n_procs,
+                                 initializer=_load_fft,
+                                 initargs=(fft_file, n_timepoints)) as pool:
+            chunksize = max(1, permutations // (n_procs * 4))
+            nulls = list(pool.map(_permutation_null, *tasks,
+                                  chunksize=chunksize))
+    else:
+        _load_fft(fft_file, n_timepoints)
+        nulls = list(map(_permutation_null, *tasks))
+        _fft.clear()
+
+    min_null, max_null = zip(*nulls) if nulls else ((), ())
+
+    return list(min_null), list(max_null)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from CPAC.isc.isc import isc
+from CPAC.isc.isfc import isfc
+from CPAC.utils import correlation
+
+
+@pytest.fixture
+def D():
+    random_state = np.random.RandomState(0)
+    D = random_state.normal(size=(8, 40, 5))
+    D += random_state.normal(size=(8, 40, 1))
+    D[2] = 1.0
+    return D
+
+
+def loo_means(D):
+    n_subj = D.shape[2]
+    group_sum = D.sum(axis=2)
+    for loo_subj in range(n_subj):
+        yield (D[:, :, loo_subj],
+               (group_sum - D[:, :, loo_subj]) / (n_subj - 1))
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_isc(D, dtype):
+    ref = np.array([correlation(subj_ts, loo_ts, match_rows=True)
+                    for subj_ts, loo_ts in loo_means(D)])
+
+    ISC, masked = isc(D, collapse_subj=False, dtype=dtype)
+    assert np.allclose(ISC, ref, atol=1e-6)
+    assert masked.all()
+
+    ISC, masked = isc(D, std=1, collapse_subj=True, dtype=dtype)
+    assert np.allclose(ISC, ref.mean(axis=0), atol=1e-6)
+    assert masked.shape == (8,)
+
+
+def test_isfc(D):
+    ref = np.array([correlation(subj_ts, loo_ts, symmetric=True)
+                    for subj_ts, loo_ts in loo_means(D)])
+
+    ISFC, _ = isfc(D, collapse_subj=False)
+    assert np.allclose(ISFC, np.moveaxis(ref, 0, -1))
+
+    ISFC, _ = isfc(D, collapse_subj=True)
+    assert np.allclose(ISFC, ref.mean(axis=0))
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from CPAC.isc.isc import isc_permutation
+from CPAC.isc.isfc import isfc_permutation
+from CPAC.isc.permutation import permutation_nulls
+from CPAC.isc.utils import phase_randomize, phase_randomize_fft
+
+
+@pytest.mark.parametrize('n_timepoints', [20, 21])
+def test_phase_randomize_fft(n_timepoints):
+    D = np.random.RandomState(0).uniform(size=(5, n_timepoints, 4))
+    F = np.fft.rfft(D, axis=1)
+    assert np.allclose(phase_randomize_fft(F, n_timepoints, 42),
+                       phase_randomize(D, 42))
+
+
+@pytest.mark.parametrize('statistic, permutation',
+                         [('isc', isc_permutation),
+                          ('isfc', isfc_permutation)])
+@pytest.mark.parametrize('collapse_subj', [True, False])
+def test_permutation_nulls(tmpdir, statistic, permutation, collapse_subj):
+    D = np.random.RandomState(0).uniform(size=(6, 30, 5))
+    masked = np.array([True, True, False, True, True, True])
+    D_file = str(tmpdir.join('data.npy'))
+    np.save(D_file, D)
+
+    nulls = {
+        n_procs: permutation_nulls(D_file, masked, 8, statistic,
+                                   collapse_subj, random_state=3,
+                                   n_procs=n_procs,
+                                   fft_file=str(tmpdir.join('fft.npy')))
+        for n_procs in (1, 2)
+    }
+    assert np.allclose(nulls[1], nulls[2])
+
+    seeds = np.random.RandomState(3).randint(np.iinfo(np.int32).max,
+                                             size=8)
+    _, min_null, max_null = zip(*[
+        permutation(i, D, masked, collapse_subj, seed)
+        for i, seed in enumerate(seeds)
+    ])
+    assert np.allclose(nulls[1], (min_null, max_null))
@@ -10,6 +10,30 @@ def ecdf(x):
     return lambda q: yp[np.searchsorted(xp, q, side="right")]
 
 
+def loo_normalize(D, dtype=np.float64):
+    """
+    Normalizes each subject's timeseries and the leave-one-out mean of the
+    other subjects in one pass over a voxel x time x subject array.
+
+    Both are centered and scaled to unit norm over time, so the dot product
+    of a subject's timeseries with its leave-one-out mean is their Pearson
+    correlation. Timeseries with no variance are set to 0.
+    """
+    D = np.asarray(D, dtype=dtype)
+
+    Z = D - D.mean(axis=1, keepdims=True)
+    # the leave-one-out sum has the same correlations as the mean
+    ZL = Z.sum(axis=2, keepdims=True) - Z
+
+    for X in (Z, ZL):
+        norm = np.sqrt(np.einsum('vts,vts->vs', X, X))[:, np.newaxis, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            X /= norm
+        np.copyto(X, 0.0, where=~np.isfinite(X))
+
+    return Z, ZL
+
+
 def phase_randomize(D, random_state=0):
     random_state = check_random_state(random_state)
 
@@ -30,6 +54,25 @@ def phase_randomize(D, random_state=0):
     return np.real(ifft(F, axis=1))
 
 
+def phase_randomize_fft(F, n_timepoints, random_state=0):
+    """
+    Phase-randomize data from its precomputed real FFT along the time axis.
+
+    Draws the same phase shifts as `phase_randomize`, so for the same
+    random state ``phase_randomize_fft(np.fft.rfft(D, axis=1), D.shape[1])``
+    matches ``phase_randomize(D)``.
+    """
+    random_state = check_random_state(random_state)
+
+    n_freq = (n_timepoints - 1) // 2
+    shift = random_state.rand(F.shape[0], n_freq, F.shape[2]) * 2 * np.pi
+
+    F = np.array(F)
+    F[:, 1:n_freq + 1, :] *= np.exp(1j * shift)
+
+    return np.fft.irfft(F, n=n_timepoints, axis=1)
+
+
 def p_from_null(X, 
                 max_null, min_null,
                 two_sided=False):
@@ -132,10 +132,66 @@ def template_convergence(mat_file, mat_type='matrix',
     return abs(distance) <= convergence_threshold
 
 
+SLAB_MB = 256
+"""Memory for the slab of every input image averaged at once, in MB"""
+
+
+def average_images(input_list, output_path, avg_method='median',
+                   slab_mb=SLAB_MB):
+    """
+    Average 3D images voxelwise into one image, one slab of slices at a
+    time, so only a slab of each input is in memory at once
+
+    Compressed inputs are kept open and read in order, so each is
+    decompressed once; uncompressed inputs are memory-mapped.
+    WARNING---the function assumes that all the images have the same header,
+    the output image will have the same header as the first image of the list
+
+    Parameters
+    ----------
+    input_list : list of str or Nifti1Image
+        images of the same shape
+    output_path : str
+        path to save the float32 average to
+    avg_method : str
+        function names from numpy library such as 'median', 'mean', 'std' ...
+    slab_mb : float
+        memory in MB for the slab of all of the inputs, as float32
+
+    Returns
+    -------
+    output_path : str
+    """
+    images = [nib.load(img, keep_file_open=True) if
+              isinstance(img, six.string_types) else nifti_image_input(img)
+              for img in input_list]
+    shape = images[0].shape
+    for img, path in zip(images, input_list):
+        if img.shape != shape:
+            raise ValueError(f'ERROR average_images: {path} {img.shape} '
+                             f'does not match {input_list[0]} {shape}')
+    average = getattr(np, avg_method)
+    slice_bytes = 4 * len(images) * int(np.prod(shape[:-1]))
+    slab = max(1, int(slab_mb * 1024 ** 2 // slice_bytes))
+    avg_data = np.empty(shape, dtype=np.float32)
+    stack = np.empty((len(images),) + shape[:-1] + (min(slab, shape[-1]),),
+                     dtype=np.float32)
+    # the last axis is slowest on disk, so slabs along it are read in order
+    for start in range(0, shape[-1], slab):
+        stop = min(start + slab, shape[-1])
+        slab_stack = stack[..., :stop - start]
+        for i, img in enumerate(images):
+            slab_stack[i] = img.dataobj[..., start:stop]
+        avg_data[..., start:stop] = average(slab_stack, 0)
+    nib.save(nib.Nifti1Image(avg_data, images[0].affine), output_path)
+    return output_path
+
+
 def create_temporary_template(input_brain_list, input_skull_list, 
                               output_brain_path, output_skull_path, avg_method='median'):
     """
-    Average all the 3D images of the list into one 3D image
+    Average all the 3D images of the list into one 3D image, see
+    :py:func:`average_images`
     WARNING---the function assumes that all the images have the same header,
     the output image will have the same header as the first image of the list
 
@@ -167,17 +223,8 @@ def create_temporary_template(input_brain_list, input_skull_list,
         return input_brain_list[0], input_skull_list[0] 
 
     # ALIGN CENTERS
-    avg_brain_data = getattr(np, avg_method)(
-        np.asarray([nifti_image_input(img).get_fdata() for img in input_brain_list]), 0)
-
-    avg_skull_data = getattr(np, avg_method)(
-        np.asarray([nifti_image_input(img).get_fdata() for img in input_skull_list]), 0)
-
-    nii_brain = nib.Nifti1Image(avg_brain_data, nifti_image_input(input_brain_list[0]).affine)
-    nii_skull = nib.Nifti1Image(avg_skull_data, nifti_image_input(input_skull_list[0]).affine)
-
-    nib.save(nii_brain, output_brain_path)
-    nib.save(nii_skull, output_skull_path)
+    average_images(input_brain_list, output_brain_path, avg_method)
+    average_images(input_skull_list, output_skull_path, avg_method)
 
     return output_brain_path, output_skull_path
 
@@ -366,8 +413,9 @@ def template_creation_flirt(input_brain_list, input_skull_list, init_reg=None, a
         else:
             raise ValueError("init_reg must be a list of FLIRT nipype nodes files")
     else:
-        output_brain_list = input_brain_list
-        output_skull_list = input_skull_list
+        output_brain_list = list(input_brain_list)
+        output_skull_list = list(input_skull_list)
+        convergence_list = [False] * len(input_brain_list)
         converged = False
 
     temporary_brain_template = os.path.join(os.getcwd(), 'temporary_brain_template.nii.gz')
@@ -385,20 +433,25 @@ def template_creation_flirt(input_brain_list, input_skull_list, init_reg=None, a
                                                 output_skull_path=temporary_skull_template,
                                                 avg_method=avg_method)
         
-        reg_list_node = register_img_list(input_brain_list=output_brain_list,
+        # sessions whose transforms have converged keep their registration
+        # to the previous template instead of being registered again
+        pending = [index for index, session_converged in
+                   enumerate(convergence_list) if not session_converged]
+        reg_list_node = register_img_list(input_brain_list=[output_brain_list[index] for index in pending],
                                           ref_img=temporary_brain_template,
                                           dof=dof,
                                           interp=interp,
                                           cost=cost,
-                                          unique_id_list=unique_id_list)
+                                          unique_id_list=None if unique_id_list is None else
+                                          [unique_id_list[index] for index in pending])
 
         mat_list = [node.inputs.out_matrix_file for node in reg_list_node]
 
         # TODO clean code, refactor variables 
         if len(warp_list) == 0:
-            warp_list = mat_list
+            warp_list = list(mat_list)
 
-        for index, mat in enumerate(mat_list):
+        for index, mat, node in zip(pending, mat_list, reg_list_node):
             cmd = "flirt -in %s -ref %s -applyxfm -init %s -dof %s -interp %s -cost %s -out %s" % (output_skull_list[index], 
                     temporary_skull_template, mat, dof, interp, cost, 
                     os.path.join(os.getcwd(), os.path.basename(output_skull_list[index])))
@@ -412,11 +465,11 @@ def template_creation_flirt(input_brain_list, input_skull_list, init_reg=None, a
 
             warp_list[index] = warp_list_filenames[index]
 
-        output_brain_list = [node.inputs.out_file for node in reg_list_node]
+            output_brain_list[index] = node.inputs.out_file
 
-        # test if every transformation matrix has reached the convergence
-        convergence_list = [template_convergence(
-            mat, mat_type, convergence_threshold) for mat in mat_list]
+            # test if the transformation matrix has reached the convergence
+            convergence_list[index] = template_convergence(
+                mat, mat_type, convergence_threshold)
         converged = all(convergence_list)
 
     if isinstance(thread_pool, int):
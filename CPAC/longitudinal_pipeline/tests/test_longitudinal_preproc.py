@@ -0,0 +1,106 @@
+"""Tests for longitudinal template creation"""
+import os
+from types import SimpleNamespace
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from CPAC.longitudinal_pipeline import longitudinal_preproc
+from CPAC.longitudinal_pipeline.longitudinal_preproc import average_images, \
+    template_creation_flirt
+
+
+@pytest.mark.parametrize('avg_method', ['median', 'mean'])
+@pytest.mark.parametrize('ext', ['nii', 'nii.gz'])
+def test_average_images(avg_method, ext, tmp_path):
+    """Averaging slab by slab matches averaging whole images"""
+    rng = np.random.default_rng(0)
+    affine = np.diag([0.8, 0.8, 0.8, 1])
+    data = rng.normal(100, 20, (5, 9, 10, 11))
+    images = []
+    for i, session in enumerate(data):
+        images.append(str(tmp_path / f'ses-{i}_T1w.{ext}'))
+        nib.save(nib.Nifti1Image(session, affine), images[-1])
+    # 4 slices of 5 images per slab
+    slab_mb = 4 * 5 * 9 * 10 * 4 / 1024 ** 2
+    output = average_images(images, str(tmp_path / 'template.nii.gz'),
+                            avg_method, slab_mb=slab_mb)
+    template = nib.load(output)
+    assert template.get_data_dtype() == np.float32
+    np.testing.assert_allclose(template.affine, affine)
+    np.testing.assert_allclose(template.get_fdata(),
+                               getattr(np, avg_method)(data, 0), rtol=1e-5)
+
+    nib.save(nib.Nifti1Image(data[0, :8], affine),
+             str(tmp_path / f'mismatched.{ext}'))
+    with pytest.raises(ValueError, match='does not match'):
+        average_images(images + [str(tmp_path / f'mismatched.{ext}')],
+                       str(tmp_path / 'template.nii.gz'))
+
+
+def test_template_creation_skips_converged(monkeypatch, tmp_path):
+    """Sessions are only registered again until their transforms converge,
+    and every list is returned in session order"""
+    monkeypatch.chdir(tmp_path)
+    # the iteration each session's transform converges in
+    converges_in = {'ses-0': 1, 'ses-1': 3, 'ses-2': 2}
+    registrations = []
+    templates = []
+
+    def session(path):
+        return os.path.basename(path).split('_')[0]
+
+    def register_img_list(input_brain_list, ref_img, dof, interp, cost,
+                          unique_id_list=None):
+        # pylint: disable=unused-argument
+        registrations.append((list(input_brain_list), unique_id_list))
+        return [SimpleNamespace(inputs=SimpleNamespace(
+            out_file=f'{session(brain)}_reg{len(registrations)}.nii.gz',
+            out_matrix_file=f'{session(brain)}_reg{len(registrations)}.mat'))
+                for brain in input_brain_list]
+
+    def template_convergence(mat, mat_type, convergence_threshold):
+        # pylint: disable=unused-argument
+        iteration = int(os.path.splitext(mat)[0].rsplit('reg', 1)[1])
+        return iteration >= converges_in[session(mat)]
+
+    def create_temporary_template(input_brain_list, input_skull_list,
+                                  output_brain_path, output_skull_path,
+                                  avg_method):
+        # pylint: disable=unused-argument
+        templates.append([os.path.basename(brain) for
+                          brain in input_brain_list])
+        return output_brain_path, output_skull_path
+
+    for name, mock in [('register_img_list', register_img_list),
+                       ('template_convergence', template_convergence),
+                       ('create_temporary_template',
+                        create_temporary_template)]:
+        monkeypatch.setattr(longitudinal_preproc, name, mock)
+    monkeypatch.setattr(os, 'system', lambda cmd: 0)
+
+    brains = [f'/data/ses-{i}_T1w_brain.nii.gz' for i in range(3)]
+    skulls = [f'/data/ses-{i}_T1w.nii.gz' for i in range(3)]
+    unique_ids = [f'sub-1_ses-{i}' for i in range(3)]
+    _, _, output_brains, output_skulls, warps = template_creation_flirt(
+        brains, skulls, unique_id_list=unique_ids)
+
+    # converged sessions are not registered again until the final
+    # registration of the original images to the template
+    assert registrations == [
+        (brains, unique_ids),
+        (['ses-1_reg1.nii.gz', 'ses-2_reg1.nii.gz'], unique_ids[1:]),
+        (['ses-1_reg2.nii.gz'], unique_ids[1:2]),
+        (brains, unique_ids)]
+    # converged sessions keep their last registration in later templates
+    assert templates == [
+        ['ses-0_T1w_brain.nii.gz', 'ses-1_T1w_brain.nii.gz',
+         'ses-2_T1w_brain.nii.gz'],
+        ['ses-0_reg1.nii.gz', 'ses-1_reg1.nii.gz', 'ses-2_reg1.nii.gz'],
+        ['ses-0_reg1.nii.gz', 'ses-1_reg2.nii.gz', 'ses-2_reg2.nii.gz']]
+    assert output_brains == ['ses-0_reg1.nii.gz', 'ses-1_reg3.nii.gz',
+                             'ses-2_reg2.nii.gz']
+    assert output_skulls == [str(tmp_path / os.path.basename(skull)) for
+                             skull in skulls]
+    assert warps == ['ses-0_reg4.mat', 'ses-1_reg4.mat', 'ses-2_reg4.mat']
@@ -3,7 +3,7 @@ import nipype.interfaces.utility as util
 
 
 
-def median_angle_correct(target_angle_deg, realigned_file):
+def median_angle_correct(target_angle_deg, realigned_file, params_file=None):
     """
     Performs median angle correction on fMRI data.  Median angle correction algorithm
     based on [1]_.
@@ -14,6 +14,10 @@ def median_angle_correct(target_angle_deg, realigned_file):
         Target median angle to adjust the time-series data.
     realigned_file : string
         Path of a realigned nifti file.
+    params_file : string, optional
+        Path of the median angle parameters of `realigned_file` (.npz file)
+        from `calc_median_angle_params`, reused instead of recomputing the
+        principal components.
     
     Returns
     -------
@@ -31,7 +35,8 @@ def median_angle_correct(target_angle_deg, realigned_file):
     import numpy as np
     import nibabel as nb
     import os
-    from scipy.stats.stats import pearsonr
+    from CPAC.median_angle.median_angle import load_median_angle_params, \
+                                               normalized_timeseries
 
     def shiftCols(pc, A, dtheta):
         pcxA = np.dot(pc, A)
@@ -51,23 +56,12 @@ def median_angle_correct(target_angle_deg, realigned_file):
             header=nii.header, affine=nii.affine)
         img_whole_y.to_filename(fname)
 
-    nii = nb.load(realigned_file)
-    data = nii.get_fdata().astype(np.float64)
-
-    mask = (data != 0).sum(-1) != 0
-
-    Y = data[mask].T
-
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
-    Yn = Yc / np.tile(np.sqrt((Yc * Yc).sum(0)), (Yc.shape[0], 1))
-    U, S, Vh = np.linalg.svd(Yn, full_matrices=False)
+    nii, data, mask, Yc, Yn = normalized_timeseries(realigned_file)
+    params = load_median_angle_params(realigned_file, params_file,
+                                      (Yc, Yn))
 
-    G = Yc.mean(1)
-    #Correlation of Global and U
-    corr_gu = pearsonr(G, U[:, 0])
-    PC1 = U[:, 0] if corr_gu[0] >= 0 else -U[:, 0]
-
-    median_angle = np.median(np.arccos(np.dot(PC1.T, Yn)))
+    PC1 = params['PC1']
+    median_angle = params['median_angle']
     angle_shift = (np.pi / 180) * target_angle_deg - median_angle
     if(angle_shift > 0):
         #Shifting all vectors
@@ -79,7 +73,7 @@ def median_angle_correct(target_angle_deg, realigned_file):
     corrected_file = os.path.join(os.getcwd(), 'median_angle_corrected.nii.gz')
     angles_file = os.path.join(os.getcwd(), 'angles_U5_Yn.npy')
 
-    angles_U5_Yn = np.arccos(np.dot(U[:, 0:5].T, Yn))
+    angles_U5_Yn = np.arccos(np.dot(params['U'].T, Yn))
     np.save(angles_file, angles_U5_Yn)
 
     data = np.zeros_like(data)
@@ -88,47 +82,155 @@ def median_angle_correct(target_angle_deg, realigned_file):
 
     return corrected_file, angles_file
 
-def calc_median_angle_params(subject):
+
+def normalized_timeseries(realigned_file):
     """
-    Calculates median angle parameters of a subject
+    Loads the timeseries of the non-zero voxels of a scan, centered and
+    normalized to unit length
     
     Parameters
     ----------
-    subject : string
-        Path of a subject's nifti file.
+    realigned_file : string
+        Path of a realigned nifti file.
     
     Returns
     -------
-    mean_bold : float
-        Mean bold amplitude of a subject. 
-    median_angle : float
-        Median angle of a subject.
+    nii : nibabel.Nifti1Image
+        Loaded image.
+    data : numpy.ndarray
+        Image data.
+    mask : numpy.ndarray
+        Voxels with any non-zero value.
+    Yc : numpy.ndarray
+        Centered time x voxel timeseries.
+    Yn : numpy.ndarray
+        Normalized time x voxel timeseries.
     """
     import numpy as np
     import nibabel as nb
-    
-    data = nb.load(subject).get_fdata().astype('float64')
-    mask = (data != 0).sum(-1) != 0
-    
+
+    nii = nb.load(realigned_file)
+    data = nii.get_fdata()
+    mask = (data != 0).any(-1)
+
     Y = data[mask].T
+    Yc = Y - Y.mean(0)
+    Yn = Yc / np.sqrt((Yc * Yc).sum(0))
+
+    return nii, data, mask, Yc, Yn
+
+
+def load_median_angle_params(subject, params_file=None, timeseries=None,
+                             num_components=5):
+    """
+    Loads the median angle parameters of a scan from its cache, or
+    computes them and writes the cache.
+
+    Only the `num_components` leading principal components of the
+    normalized timeseries are computed (see
+    `CPAC.nuisance.utils.compcor.compcor_components`). PC1 is signed to
+    correlate positively with the global signal of the centered
+    timeseries, as the correction has always signed it, and
+    'target_median_angle' is the median angle with PC1 signed by the
+    global signal of the variance-normalized timeseries, as the target
+    angle has always signed it.
     
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
-    Yn = Yc/np.tile(np.sqrt((Yc*Yc).sum(0)), (Yc.shape[0], 1))
-    U,S,Vh = np.linalg.svd(Yn, full_matrices=False)
+    Parameters
+    ----------
+    subject : string
+        Path of a subject's nifti file.
+    params_file : string, optional
+        Path of a cache (.npz file) written by this function for
+        `subject`. Ignored if it does not exist or was written for
+        another file.
+    timeseries : tuple, optional
+        (Yc, Yn) from `normalized_timeseries`, if already loaded.
+    num_components : integer, optional
+        Number of principal components to keep.
     
-    glb = (Yn/np.tile(Yn.std(0), (Y.shape[0], 1))).mean(1)
+    Returns
+    -------
+    params : dict
+        'subject', 'mean_bold', 'median_angle' and 'target_median_angle'
+        (radians), 'PC1', 'U' (leading principal components) and
+        'params_file' (path of the cache).
+    """
+    import os
+    import numpy as np
+    from CPAC.median_angle.median_angle import normalized_timeseries
+    from CPAC.nuisance.utils.compcor import compcor_components
+
+    subject = os.path.abspath(subject)
+    if params_file and os.path.exists(params_file):
+        with np.load(params_file) as cache:
+            params = {key: cache[key] for key in cache.files}
+        if str(params['subject']) == subject and \
+                'target_median_angle' in params:
+            params['params_file'] = params_file
+            return params
+
+    if timeseries is None:
+        Yc, Yn = normalized_timeseries(subject)[3:]
+    else:
+        Yc, Yn = timeseries
 
-    from scipy.stats.stats import pearsonr
-    corr = pearsonr(U[:,0],glb) 
+    U = compcor_components(Yn, num_components)[0]
 
-    PC1 = U[:,0] if corr[0] >= 0 else -U[:,0]
+    G = Yc.mean(1)
+    #Correlation of Global and U
+    PC1 = U[:, 0] if np.corrcoef(G, U[:, 0])[0, 1] >= 0 else -U[:, 0]
     median_angle = np.median(np.arccos(np.dot(PC1.T, Yn)))
-    median_angle *= 180.0/np.pi
-    Yp = Yc
-    mean_bold = Yp.std(0).mean()
 
+    # the target angle has always signed PC1 by the global signal of the
+    # variance-normalized timeseries instead
+    glb = (Yn / Yn.std(0)).mean(1)
+    target_PC1 = U[:, 0] if np.corrcoef(glb, U[:, 0])[0, 1] >= 0 else -U[:, 0]
+    if np.array_equal(target_PC1, PC1):
+        target_median_angle = median_angle
+    else:
+        target_median_angle = np.median(np.arccos(np.dot(target_PC1.T, Yn)))
+
+    params = {'subject': subject,
+              'mean_bold': Yc.std(0).mean(),
+              'median_angle': median_angle,
+              'target_median_angle': target_median_angle,
+              'PC1': PC1,
+              'U': U}
+    params_file = os.path.join(os.getcwd(), 'median_angle_params.npz')
+    np.savez(params_file, **params)
+    params['params_file'] = params_file
+
+    return params
+
+
+def calc_median_angle_params(subject, params_file=None):
+    """
+    Calculates median angle parameters of a subject
+    
+    Parameters
+    ----------
+    subject : string
+        Path of a subject's nifti file.
+    params_file : string, optional
+        Path of cached median angle parameters of `subject` (.npz file).
     
-    return mean_bold, median_angle
+    Returns
+    -------
+    mean_bold : float
+        Mean bold amplitude of a subject. 
+    median_angle : float
+        Median angle of a subject.
+    params_file : string
+        Path of the median angle parameters of `subject` (.npz file), to
+        be reused by `median_angle_correct`.
+    """
+    import numpy as np
+    from CPAC.median_angle.median_angle import load_median_angle_params
+
+    params = load_median_angle_params(subject, params_file)
+    median_angle = float(params['target_median_angle']) * 180.0 / np.pi
+
+    return float(params['mean_bold']), median_angle, params['params_file']
 
 def calc_target_angle(mean_bolds, median_angles):
     """
@@ -186,6 +288,9 @@ def create_median_angle_correction(name='median_angle_correction'):
             Realigned nifti file of a subject
         inputspec.target_angle : integer
             Target angle in degrees to correct the median angle to
+        inputspec.params_file : string (.npz file), optional
+            Median angle parameters of the subject from the target angle
+            workflow, reused instead of recomputing them
             
     Workflow Outputs::
     
@@ -222,14 +327,16 @@ def create_median_angle_correction(name='median_angle_correction'):
     median_angle_correction = pe.Workflow(name=name)
     
     inputspec = pe.Node(util.IdentityInterface(fields=['subject',
-                                                       'target_angle']),
+                                                       'target_angle',
+                                                       'params_file']),
                         name='inputspec')
     outputspec = pe.Node(util.IdentityInterface(fields=['subject',
                                                         'pc_angles']),
                          name='outputspec')
     
     mac = pe.Node(util.Function(input_names=['target_angle_deg',
-                                             'realigned_file'],
+                                             'realigned_file',
+                                             'params_file'],
                                 output_names=['corrected_file',
                                               'angles_file'],
                                 function=median_angle_correct),
@@ -239,6 +346,8 @@ def create_median_angle_correction(name='median_angle_correction'):
                                     mac, 'realigned_file')
     median_angle_correction.connect(inputspec, 'target_angle',
                                     mac, 'target_angle_deg')
+    median_angle_correction.connect(inputspec, 'params_file',
+                                    mac, 'params_file')
     median_angle_correction.connect(mac, 'corrected_file',
                                     outputspec, 'subject')
     median_angle_correction.connect(mac, 'angles_file',
@@ -272,6 +381,9 @@ def create_target_angle(name='target_angle'):
     
         outputspec.target_angle : float
             Target angle over the provided group of subjects.
+        outputspec.params_files : list (.npz files)
+            Median angle parameters of each subject, to pass to the
+            median angle correction workflow.
             
     Target Angle procedure:
     
@@ -303,12 +415,14 @@ def create_target_angle(name='target_angle'):
     
     inputspec = pe.Node(util.IdentityInterface(fields=['subjects']),
                         name='inputspec')
-    outputspec = pe.Node(util.IdentityInterface(fields=['target_angle']),
+    outputspec = pe.Node(util.IdentityInterface(fields=['target_angle',
+                                                        'params_files']),
                          name='outputspec')
     
     cmap = pe.MapNode(util.Function(input_names=['subject'],
                                     output_names=['mean_bold',
-                                                  'median_angle'],
+                                                  'median_angle',
+                                                  'params_file'],
                                     function=calc_median_angle_params),
                       name='median_angle_params',
                       iterfield=['subject'])
@@ -327,5 +441,7 @@ def create_target_angle(name='target_angle'):
                          cta, 'median_angles')
     target_angle.connect(cta, 'target_angle',
                          outputspec, 'target_angle')
+    target_angle.connect(cmap, 'params_file',
+                         outputspec, 'params_files')
     
     return target_angle
@@ -0,0 +1,150 @@
+"""Tests for median angle correction"""
+import os
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+from CPAC.median_angle.median_angle import calc_median_angle_params, \
+                                           create_target_angle, \
+                                           load_median_angle_params, \
+                                           median_angle_correct
+from CPAC.nuisance.utils import compcor
+
+
+def _baseline(target_angle_deg, realigned_file):
+    """Median angle parameters and correction with a full SVD, as
+    calc_median_angle_params and median_angle_correct computed them
+    before their parameters were shared"""
+    data = nb.load(realigned_file).get_fdata()
+    mask = (data != 0).sum(-1) != 0
+    Y = data[mask].T
+    Yc = Y - Y.mean(0)
+    Yn = Yc / np.sqrt((Yc * Yc).sum(0))
+    U = np.linalg.svd(Yn, full_matrices=False)[0]
+
+    glb = (Yn / Yn.std(0)).mean(1)
+    PC1 = U[:, 0] if np.corrcoef(U[:, 0], glb)[0, 1] >= 0 else -U[:, 0]
+    target_median_angle = np.median(np.arccos(PC1 @ Yn)) * 180.0 / np.pi
+
+    G = Yc.mean(1)
+    PC1 = U[:, 0] if np.corrcoef(G, U[:, 0])[0, 1] >= 0 else -U[:, 0]
+    angle_shift = np.pi / 180 * target_angle_deg - np.median(
+        np.arccos(PC1 @ Yn))
+    Ynf = Yn
+    if angle_shift > 0:
+        x = Yn - np.outer(PC1, PC1 @ Yn)
+        x /= np.sqrt((x * x).sum(0))
+        theta_new = np.arccos(PC1 @ Yn) + angle_shift
+        Ynf = np.outer(PC1, np.cos(theta_new)) + np.sin(theta_new) * x
+    corrected = np.zeros_like(data)
+    corrected[mask] = Ynf.T
+    return (Yc.std(0).mean(), target_median_angle, corrected,
+            np.arccos(U[:, :5].T @ Yn))
+
+
+@pytest.fixture(name='scans')
+def fixture_scans(tmp_path):
+    """Synthetic scans with a global signal and some empty voxels"""
+    rng = np.random.default_rng(0)
+    scans = []
+    for i in range(4):
+        global_signal = rng.standard_normal(40)
+        data = 100 + rng.standard_normal((6, 6, 5, 40)) + \
+            rng.uniform(0.2, 2, (6, 6, 5, 1)) * global_signal * (i + 1) / 2
+        data[0] = 0
+        scans.append(str(tmp_path / f'sub-{i}_bold.nii.gz'))
+        nb.Nifti1Image(data, np.eye(4)).to_filename(scans[-1])
+    return scans
+
+
+def _count_components(monkeypatch):
+    """Count how many times principal components are computed"""
+    calls = []
+    compcor_components = compcor.compcor_components
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return compcor_components(*args, **kwargs)
+
+    monkeypatch.setattr(compcor, 'compcor_components', counted)
+    return calls
+
+
+def test_params_cache(monkeypatch, scans, tmp_path):
+    """Cached parameters are reused only for the scan they were computed
+    from"""
+    calls = _count_components(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    params = load_median_angle_params(scans[0])
+    assert len(calls) == 1
+    cached = load_median_angle_params(scans[0], params['params_file'])
+    assert len(calls) == 1
+    for key in ('mean_bold', 'median_angle', 'target_median_angle', 'PC1',
+                'U'):
+        np.testing.assert_array_equal(cached[key], params[key])
+
+    load_median_angle_params(scans[1], params['params_file'])
+    assert len(calls) == 2
+
+
+def test_target_angle_to_correction(monkeypatch, scans, tmp_path):
+    """The correction reuses the parameters from the target angle
+    workflow, and both match the computations before they were shared"""
+    wf = create_target_angle()
+    wf.base_dir = str(tmp_path / 'work')
+    wf.inputs.inputspec.subjects = scans
+    results = {node.name.rstrip('_'): node.result.outputs for
+               node in wf.run().nodes()}
+    params_files = results['median_angle_params'].params_file
+    target_angle = results['target_angle'].target_angle
+    assert len(params_files) == len(scans)
+
+    baselines = [_baseline(target_angle, scan) for scan in scans]
+    np.testing.assert_allclose(results['median_angle_params'].mean_bold,
+                               [baseline[0] for baseline in baselines])
+    np.testing.assert_allclose(results['median_angle_params'].median_angle,
+                               [baseline[1] for baseline in baselines])
+
+    calls = _count_components(monkeypatch)
+    for scan, params_file, baseline in zip(scans, params_files, baselines):
+        out_dir = tmp_path / os.path.basename(scan).split('.')[0]
+        out_dir.mkdir()
+        monkeypatch.chdir(out_dir)
+        corrected_file, angles_file = median_angle_correct(
+            target_angle, scan, params_file)
+        np.testing.assert_allclose(nb.load(corrected_file).get_fdata(),
+                                   baseline[2], atol=1e-8)
+        # principal components are only defined up to their sign
+        np.testing.assert_allclose(np.abs(np.cos(np.load(angles_file))),
+                                   np.abs(np.cos(baseline[3])), atol=1e-8)
+    assert not calls
+
+
+def test_target_sign_convention(monkeypatch, tmp_path):
+    """The target angle signs PC1 by the global signal of the
+    variance-normalized timeseries, even where the correction's global
+    signal of the centered timeseries has the opposite sign"""
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(1)
+    signal = rng.standard_normal(40)
+    # a few large voxels dominate the centered global signal, and many
+    # small, anticorrelated voxels the variance-normalized one
+    data = 100 + 0.3 * rng.standard_normal((10, 10, 1, 40))
+    data[:2, 0, 0] += 200 * signal
+    data[:, 1:, 0] -= signal
+    scan = str(tmp_path / 'sub-1_bold.nii.gz')
+    nb.Nifti1Image(data, np.eye(4)).to_filename(scan)
+
+    params = load_median_angle_params(scan)
+    assert params['target_median_angle'] == pytest.approx(
+        np.pi - params['median_angle'])
+    mean_bold, target_median_angle, _ = calc_median_angle_params(
+        scan, params['params_file'])
+    baseline = _baseline(0, scan)
+    assert mean_bold == pytest.approx(baseline[0])
+    assert target_median_angle == pytest.approx(baseline[1])
+    corrected_file = median_angle_correct(90, scan,
+                                          params['params_file'])[0]
+    np.testing.assert_allclose(nb.load(corrected_file).get_fdata(),
+                               _baseline(90, scan)[2], atol=1e-8)
@@ -0,0 +1,324 @@
+# Copyright (C) 2023  C-PAC Developers
+
+# This file is part of C-PAC.
+
+# C-PAC is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# C-PAC is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public
+# License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
+"""In-process degree centrality, an alternative to AFNI's
+3dDegreeCentrality
+
+The masked timeseries are detrended and normalized once, and the
+voxel-by-voxel correlation matrix is computed one tile of rows at a time,
+only for the upper triangle, with each tile's binarized and weighted
+degree accumulated into both its rows and its columns. The full matrix is
+never stored. For sparsity thresholds, the correlation threshold is found
+from a histogram of every unique correlation streamed over the same
+tiles.
+"""
+import os
+from typing import Optional
+
+import nibabel as nib
+import numpy as np
+
+from CPAC.pipeline.schema import valid_options
+from CPAC.utils.docs import docstring_parameter
+from CPAC.utils.monitoring.custom_logging import getLogger
+from CPAC.utils.typing import ITERABLE, LIST
+
+HISTOGRAM_BINS = 2 ** 20
+"""Number of bins over [-1, 1] used to find sparsity thresholds"""
+TILE_BYTES = 12
+"""Peak bytes per correlation in a tile: the float32 correlation and, while
+finding a sparsity threshold, its int64 histogram bin"""
+logger = getLogger('nipype.workflow')
+
+
+def normalize_timeseries(timeseries: np.ndarray, polort: int = 1
+                         ) -> np.ndarray:
+    """Remove polynomial trends from each row of a voxels × timepoints
+    array and scale each row to unit length, so the dot product of two
+    rows is their Pearson correlation
+
+    Rows with no variance are left as zeros.
+
+    Parameters
+    ----------
+    timeseries : ndarray
+        voxels × timepoints
+
+    polort : int, optional
+        order of the polynomial trend to remove, as AFNI's ``-polort``;
+        default=1
+
+    Returns
+    -------
+    ndarray
+        float32, voxels × timepoints
+    """
+    timeseries = np.asarray(timeseries, dtype=np.float64)
+    # relative to the timeseries' own scale, so constants detrended to
+    # rounding error count as having no variance
+    tolerance = 1e-10 * np.linalg.norm(timeseries, axis=1, keepdims=True)
+    # orthonormal polynomial basis over the timepoints
+    basis, _ = np.linalg.qr(np.vander(
+        np.linspace(-1, 1, timeseries.shape[1]), polort + 1))
+    timeseries = timeseries - (timeseries @ basis) @ basis.T
+    norms = np.linalg.norm(timeseries, axis=1, keepdims=True)
+    constant = norms <= tolerance
+    norms[constant] = 1
+    timeseries /= norms
+    timeseries[constant[:, 0]] = 0
+    return timeseries.astype(np.float32)
+
+
+def _upper_tiles(timeseries: np.ndarray, block_size: int):
+    """Tiles of the upper triangle of the correlation matrix of normalized
+    timeseries, excluding the diagonal
+
+    Yields
+    ------
+    start : int
+        first row (and column) of the tile
+
+    tile : ndarray
+        correlations of rows ``start:start + len(tile)`` with rows
+        ``start:``; the lower triangle and diagonal of the tile's leading
+        square are set to NaN
+    """
+    num_voxels = timeseries.shape[0]
+    for start in range(0, num_voxels, block_size):
+        stop = min(start + block_size, num_voxels)
+        tile = timeseries[start:stop] @ timeseries[start:].T
+        for row in range(stop - start):
+            tile[row, :row + 1] = np.nan
+        yield start, tile
+
+
+def sparsity_to_correlation(timeseries: np.ndarray, sparsity: float,
+                            block_size: int = 1024,
+                            bins: int = HISTOGRAM_BINS) -> float:
+    """Find the correlation threshold keeping the strongest ``sparsity``
+    fraction of the unique connections between normalized timeseries
+
+    Parameters
+    ----------
+    timeseries : ndarray
+        normalized voxels × timepoints, see :py:func:`normalize_timeseries`
+
+    sparsity : float
+        fraction of connections to keep, in (0, 1]
+
+    block_size : int, optional
+        rows of the correlation matrix per tile
+
+    bins : int, optional
+        resolution of the histogram of correlations over [-1, 1]
+
+    Returns
+    -------
+    float
+        correlations greater than this are kept; it is the lower edge of
+        the histogram bin in which the strongest ``sparsity`` fraction of
+        connections ends
+    """
+    num_voxels = timeseries.shape[0]
+    counts = np.zeros(bins, dtype=np.int64)
+    for _, tile in _upper_tiles(timeseries, block_size):
+        # bin in place, counting the lower triangle in an extra bin
+        np.add(tile, 1, out=tile)
+        np.multiply(tile, bins / 2, out=tile)
+        np.clip(tile, 0, bins - 1, out=tile)
+        np.nan_to_num(tile, copy=False, nan=bins)
+        counts += np.bincount(tile.astype(np.intp).ravel(),
+                              minlength=bins + 1)[:bins]
+    num_keep = max(1, int(np.ceil(sparsity * num_voxels *
+                                  (num_voxels - 1) / 2)))
+    top_bin = bins - 1 - int(np.searchsorted(np.cumsum(counts[::-1]),
+                                             num_keep))
+    return max(top_bin, 0) * 2 / bins - 1
+
+
+def degree_centrality(timeseries: np.ndarray, threshold: float,
+                      block_size: int = 1024) -> tuple:
+    """Binarized and weighted degree of each of a set of normalized
+    timeseries
+
+    Parameters
+    ----------
+    timeseries : ndarray
+        normalized voxels × timepoints, see :py:func:`normalize_timeseries`
+
+    threshold : float
+        only correlations greater than this are connections
+
+    block_size : int, optional
+        rows of the correlation matrix per tile
+
+    Returns
+    -------
+    binarized : ndarray
+        number of connections of each voxel
+
+    weighted : ndarray
+        sum of the correlations of each voxel's connections
+
+    Examples
+    --------
+    >>> rng = np.random.default_rng(0)
+    >>> timeseries = normalize_timeseries(rng.standard_normal((50, 30)))
+    >>> correlations = timeseries @ timeseries.T
+    >>> np.fill_diagonal(correlations, np.nan)
+    >>> binarized, weighted = degree_centrality(timeseries, 0.1,
+    ...                                         block_size=7)
+    >>> np.array_equal(binarized, (correlations > 0.1).sum(axis=1))
+    True
+    >>> np.allclose(weighted, np.where(correlations > 0.1, correlations,
+    ...                                0).sum(axis=1))
+    True
+    """
+    num_voxels = timeseries.shape[0]
+    binarized = np.zeros(num_voxels, dtype=np.int64)
+    weighted = np.zeros(num_voxels, dtype=np.float64)
+    for start, tile in _upper_tiles(timeseries, block_size):
+        stop = start + tile.shape[0]
+        # NaNs (the lower triangle) compare False
+        connected = tile > threshold
+        tile[~connected] = 0
+        binarized[start:stop] += connected.sum(axis=1)
+        binarized[start:] += connected.sum(axis=0)
+        weighted[start:stop] += tile.sum(axis=1)
+        weighted[start:] += tile.sum(axis=0)
+    return binarized, weighted
+
+
+def block_size_for_memory(num_voxels: int, memory_gb: float,
+                          resident_bytes: int = 0) -> int:
+    """Rows of the correlation matrix per tile to stay within
+    ``memory_gb``, allowing for :py:data:`TILE_BYTES` per correlation and
+    the arrays already in memory
+
+    Parameters
+    ----------
+    num_voxels : int
+
+    memory_gb : float
+
+    resident_bytes : int, optional
+        memory held alongside the tiles, e.g. by the timeseries
+
+    Returns
+    -------
+    int
+
+    Examples
+    --------
+    >>> block_size_for_memory(1000, 12000 / 1024 ** 3)
+    1
+    >>> block_size_for_memory(1000, 10 * 12000 / 1024 ** 3, 5 * 12000)
+    5
+    >>> block_size_for_memory(1000, 1.0)
+    1000
+    """
+    available = memory_gb * 1024 ** 3 - resident_bytes
+    if available < TILE_BYTES * max(num_voxels, 1):
+        logger.warning('%s GB is not enough memory for even one row of the '
+                       'correlation matrix of %d voxels', memory_gb,
+                       num_voxels)
+    return int(np.clip(available / (TILE_BYTES * max(num_voxels, 1)), 1,
+                       max(num_voxels, 1)))
+
+
+@docstring_parameter(
+    weight_options=tuple(valid_options['centrality']['weight_options']),
+    t_options=valid_options['centrality']['threshold_options'])
+def calc_degree_centrality(in_file: str, template: str,
+                           threshold_option: str, threshold: float,
+                           out_names: ITERABLE[str],
+                           memory_gb: Optional[float] = 1.0,
+                           polort: Optional[int] = 1) -> LIST[str]:
+    """Calculate binarized and weighted degree centrality of a functional
+    image within a mask
+
+    Parameters
+    ----------
+    in_file : str
+        path to 4D functional NIfTI image
+
+    template : str
+        path to 3D mask NIfTI image on the same grid as ``in_file``
+
+    threshold_option : str
+        one of {t_options}
+
+    threshold : float
+        a correlation threshold, or, for 'Sparsity threshold', the
+        fraction of connections to keep in (0, 1]
+
+    out_names : iterable of str
+        an iterable of strings, each ending with one of {weight_options}
+
+    memory_gb : float, optional
+        memory to bound the correlation tiles by; default=1.0
+
+    polort : int, optional
+        order of the polynomial trend to remove from each timeseries;
+        default=1
+
+    Returns
+    -------
+    list of str
+        paths to each of the specified outputs as its own file, in the
+        order {weight_options}
+    """
+    img = nib.load(in_file)
+    # leave room for the loaded image and the normalized timeseries
+    image_bytes = int(np.prod(img.shape)) * img.get_data_dtype().itemsize
+    mask = np.asanyarray(nib.load(template).dataobj)
+    if mask.ndim > 3:
+        mask = mask.reshape(mask.shape[:3])
+    mask = np.nan_to_num(mask) != 0
+    if mask.shape != img.shape[:3]:
+        raise ValueError(f'Mask {template} {mask.shape} and functional '
+                         f'image {in_file} {img.shape[:3]} must be on the '
+                         'same grid')
+    timeseries = normalize_timeseries(
+        np.asanyarray(img.dataobj)[mask], polort)
+    # voxels without variance have no connections
+    varying = np.flatnonzero(np.any(timeseries, axis=1))
+    timeseries = np.ascontiguousarray(timeseries[varying])
+    block_size = block_size_for_memory(len(varying), memory_gb,
+                                       image_bytes + timeseries.nbytes)
+
+    if threshold_option == 'Sparsity threshold':
+        sparsity = threshold
+        threshold = sparsity_to_correlation(timeseries, sparsity, block_size)
+        logger.info('Sparsity %s of %d voxels is correlation threshold %s',
+                    sparsity, len(varying), threshold)
+    binarized = np.zeros(mask.sum(), dtype=np.float32)
+    weighted = np.zeros(mask.sum(), dtype=np.float32)
+    binarized[varying], weighted[varying] = degree_centrality(
+        timeseries, threshold, block_size)
+
+    selected_options = {_[::-1].split('_', 1)[0][::-1]: _ for _ in out_names}
+    output_niftis = []
+    for option, degree in zip(valid_options['centrality']['weight_options'],
+                              (binarized, weighted)):
+        if option in selected_options:
+            out_arr = np.zeros(mask.shape, dtype=np.float32)
+            out_arr[mask] = degree
+            out_file = os.path.join(os.getcwd(),
+                                    selected_options[option] + '.nii.gz')
+            nib.Nifti1Image(out_arr, img.affine).to_filename(out_file)
+            output_niftis.append(out_file)
+    return output_niftis
@@ -33,11 +33,14 @@ def create_centrality_wf(wf_name: str, method_option: str,
                          weight_options: LIST[str], threshold_option: str,
                          threshold: float, num_threads: Optional[int] = 1,
                          memory_gb: Optional[float] = 1.0,
-                         base_dir: Optional[Union[Path, str]] = None
-                         ) -> Workflow:
+                         base_dir: Optional[Union[Path, str]] = None,
+                         using: Optional[str] = 'AFNI') -> Workflow:
     """
     Function to create the afni-based centrality workflow.
 
+    Degree centrality can instead be calculated in-process with
+    :py:func:`~CPAC.network_centrality.degree_centrality.calc_degree_centrality`.
+
     .. seealso::
 
         * :py:func:`~CPAC.network_centrality.pipeline.connect_centrality_workflow`
@@ -63,6 +66,9 @@ def create_centrality_wf(wf_name: str, method_option: str,
         default=1.0
     base_dir : path or str, optional
         the base directory for the workflow; default=None
+    using : string, optional
+        'AFNI' or, for degree centrality only, 'C-PAC' to calculate
+        degree centrality in-process; default='AFNI'
 
     Returns
     -------
@@ -90,6 +96,8 @@ def create_centrality_wf(wf_name: str, method_option: str,
     from CPAC.pipeline import nipype_pipeline_engine as pe
     from nipype.interfaces import utility as util
     from CPAC.network_centrality import utils
+    from CPAC.network_centrality.degree_centrality import \
+        calc_degree_centrality
     from CPAC.utils.interfaces.function import Function
 
     test_thresh = threshold
@@ -117,6 +125,39 @@ def create_centrality_wf(wf_name: str, method_option: str,
     output_node = pe.Node(util.IdentityInterface(fields=['outfile_list']),
                           name='outputspec')
 
+    # In-process degree centrality
+    if method_option == 'degree_centrality' and using == 'C-PAC':
+        cpac_centrality_node = pe.Node(
+            Function(input_names=['in_file', 'template', 'threshold_option',
+                                  'threshold', 'out_names', 'memory_gb'],
+                     output_names=['outfile_list'],
+                     function=calc_degree_centrality, as_module=True),
+            name='cpac_centrality', mem_gb=memory_gb)
+        cpac_centrality_node.inputs.threshold_option = threshold_option
+        cpac_centrality_node.inputs.out_names = out_names
+        cpac_centrality_node.inputs.memory_gb = memory_gb
+        cpac_centrality_node.interface.num_threads = num_threads
+        centrality_wf.connect([(input_node, cpac_centrality_node,
+                                [('in_file', 'in_file'),
+                                 ('template', 'template')]),
+                               (cpac_centrality_node, output_node,
+                                [('outfile_list', 'outfile_list')])])
+        if threshold_option == 'Significance threshold':
+            convert_thr_node = pe.Node(
+                Function(input_names=['datafile', 'p_value', 'two_tailed'],
+                         output_names=['rvalue_threshold'],
+                         function=utils.convert_pvalue_to_r),
+                name='convert_threshold')
+            centrality_wf.connect([(input_node, convert_thr_node,
+                                    [('in_file', 'datafile'),
+                                     ('threshold', 'p_value')]),
+                                   (convert_thr_node, cpac_centrality_node,
+                                    [('rvalue_threshold', 'threshold')])])
+        else:
+            # sparsity as a fraction rather than AFNI's percentage
+            cpac_centrality_node.inputs.threshold = test_thresh
+        return centrality_wf
+
     # Degree centrality
     if method_option == 'degree_centrality':
         afni_centrality_node = pe.Node(DegreeCentrality(environ={
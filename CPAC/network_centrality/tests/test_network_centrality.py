@@ -16,8 +16,11 @@
 # License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
 from itertools import combinations
 from pathlib import Path
+import nibabel as nib
+import numpy as np
 import pytest
 from CPAC.network_centrality.network_centrality import create_centrality_wf
+from CPAC.network_centrality.utils import convert_pvalue_to_r
 from CPAC.pipeline.schema import valid_options
 from CPAC.utils.interfaces.afni import AFNI_SEMVER
 from CPAC.utils.typing import LIST
@@ -62,3 +65,53 @@ def test_create_centrality_wf(method_option: str, weight_options: LIST[str],
     centrality_wf.inputs.inputspec.template = (_DATA_DIR /
                                                'template.nii.gz').absolute()
     centrality_wf.run()
+
+
+@pytest.mark.parametrize('threshold_option,threshold', [
+    ('Significance threshold', 0.05), ('Sparsity threshold', 0.1),
+    ('Correlation threshold', 0.2), ('Correlation threshold', -0.1)])
+def test_cpac_degree_centrality(threshold_option: str, threshold: float,
+                                tmpdir: Path) -> None:
+    '''In-process degree centrality matches thresholding the full
+    correlation matrix'''
+    rng = np.random.default_rng(42)
+    mask = np.zeros((6, 5, 4), dtype=np.int16)
+    mask[1:5, 1:4, :3] = 1
+    data = rng.standard_normal((*mask.shape, 40)) + np.linspace(0, 3, 40)
+    data[1, 1, 0] = 7  # no variance, so no connections
+    nib.Nifti1Image(data, np.eye(4)).to_filename(tmpdir / 'in_file.nii.gz')
+    nib.Nifti1Image(mask, np.eye(4)).to_filename(tmpdir / 'template.nii.gz')
+
+    centrality_wf = create_centrality_wf(
+        'test_cpac_degree', 'degree_centrality',
+        valid_options['centrality']['weight_options'], threshold_option,
+        threshold * 100 if threshold_option == 'Sparsity threshold' else
+        threshold, base_dir=tmpdir, memory_gb=2e-7, using='C-PAC')
+    centrality_wf.inputs.inputspec.in_file = tmpdir / 'in_file.nii.gz'
+    centrality_wf.inputs.inputspec.template = tmpdir / 'template.nii.gz'
+    outputs = [node for node in centrality_wf.run().nodes() if
+               node.name == 'cpac_centrality'][0].result.outputs.outfile_list
+    assert [Path(output).name for output in outputs] == [
+        'degree_centrality_Binarized.nii.gz',
+        'degree_centrality_Weighted.nii.gz']
+
+    # the voxel without variance is the first in the mask
+    timeseries = data[mask != 0][1:]
+    timeseries = timeseries - np.polynomial.polynomial.polyval(
+        np.arange(40), np.polynomial.polynomial.polyfit(
+            np.arange(40), timeseries.T, 1))
+    correlations = np.corrcoef(timeseries)
+    np.fill_diagonal(correlations, -np.inf)
+    if threshold_option == 'Significance threshold':
+        threshold = convert_pvalue_to_r(str(tmpdir / 'in_file.nii.gz'),
+                                        threshold)
+    elif threshold_option == 'Sparsity threshold':
+        unique = np.sort(correlations[np.triu_indices(len(correlations), 1)])
+        threshold = unique[-int(np.ceil(threshold * len(unique))) - 1]
+    connected = correlations > threshold
+    binarized, weighted = (nib.load(output).get_fdata()[mask != 0] for
+                           output in outputs)
+    assert binarized[0] == weighted[0] == 0
+    assert np.array_equal(binarized[1:], connected.sum(axis=1))
+    assert np.allclose(weighted[1:], np.where(connected, correlations, 0
+                                              ).sum(axis=1), atol=1e-4)
@@ -2,16 +2,33 @@ import os
 import numpy as np
 import nibabel as nb
 
-from scipy.fftpack import fft, ifft
+from scipy.fft import irfft, rfft
 
 
-def ideal_bandpass(data, sample_period, bandpass_freqs):
+def ideal_bandpass_mask(sample_length, sample_period, bandpass_freqs):
+    """Frequency mask of an ideal bandpass filter over the bins of the real
+    FFT of a timeseries zero-padded to the next power of 2.
+
+    Parameters
+    ----------
+    sample_length : int
+        Number of timepoints.
+    sample_period : float
+        Length of sampling period in seconds.
+    bandpass_freqs : tuple
+        Tuple containing the bandpass frequencies. (LowCutoff_HighPass HighCutoff_LowPass)
+
+    Returns
+    -------
+    padded_length : int
+        Length of the zero-padded timeseries.
+    freq_mask : numpy.ndarray
+        Boolean mask of the ``padded_length // 2 + 1`` real FFT bins to
+        keep.
+    """
         # Derived from YAN Chao-Gan 120504 based on REST.
     sample_freq = 1. / sample_period
-    sample_length = data.shape[0]
-
-    data_p = np.zeros(int(2**np.ceil(np.log2(sample_length))))
-    data_p[:sample_length] = data
+    padded_length = int(2**np.ceil(np.log2(sample_length)))
 
     LowCutoff, HighCutoff = bandpass_freqs
 
@@ -19,56 +36,125 @@ def ideal_bandpass(data, sample_period, bandpass_freqs):
         low_cutoff_i = 0
     elif (LowCutoff > sample_freq / 2.):
             # Cutoff beyond fs/2 (all-stop filter)
-        low_cutoff_i = int(data_p.shape[0] / 2)
+        low_cutoff_i = int(padded_length / 2)
     else:
         low_cutoff_i = np.ceil(
-            LowCutoff * data_p.shape[0] * sample_period).astype('int')
+            LowCutoff * padded_length * sample_period).astype('int')
 
-    if (HighCutoff > sample_freq / 2. or HighCutoff is None):
+    if (HighCutoff is None or HighCutoff > sample_freq / 2.):
             # Cutoff beyond fs/2 or unspecified (become a highpass filter)
-        high_cutoff_i = int(data_p.shape[0] / 2)
+        high_cutoff_i = int(padded_length / 2)
     else:
         high_cutoff_i = np.fix(
-                HighCutoff * data_p.shape[0] * sample_period).astype('int')
+                HighCutoff * padded_length * sample_period).astype('int')
 
-    freq_mask = np.zeros_like(data_p, dtype='bool')
+    # the negative frequencies of a real signal mirror the positive ones,
+    # so the mask only needs to cover the non-negative bins
+    freq_mask = np.zeros(padded_length // 2 + 1, dtype='bool')
     freq_mask[low_cutoff_i:high_cutoff_i + 1] = True
-    freq_mask[
-            data_p.shape[0] -
-            high_cutoff_i:data_p.shape[0] + 1 - low_cutoff_i
-        ] = True
+    return padded_length, freq_mask
+
+
+def ideal_bandpass(data, sample_period, bandpass_freqs, freq_mask=None):
+    """Ideal bandpass filter of one timeseries, or of each column of a
+    time x series matrix, in one real FFT over the time axis.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Timeseries, with time along the first axis. Filtered in float32 if
+        ``data`` is float32, otherwise in float64.
+    sample_period : float
+        Length of sampling period in seconds.
+    bandpass_freqs : tuple
+        Tuple containing the bandpass frequencies. (LowCutoff_HighPass HighCutoff_LowPass)
+    freq_mask : tuple, optional
+        Precomputed output of ``ideal_bandpass_mask`` for ``data``.
+
+    Returns
+    -------
+    data_bp : numpy.ndarray
+        Filtered timeseries, the same shape as ``data``.
+    """
+    sample_length = data.shape[0]
+    if freq_mask is None:
+        freq_mask = ideal_bandpass_mask(sample_length, sample_period,
+                                        bandpass_freqs)
+    padded_length, freq_mask = freq_mask
+
+    f_data = rfft(data, n=padded_length, axis=0)
+    f_data[~freq_mask] = 0.
+    return irfft(f_data, n=padded_length, axis=0)[:sample_length]
+
+
+def bandpass_image(data, mask, sample_period, bandpass_freqs,
+                   chunk_size=4096):
+    """Demean and bandpass the timeseries of the voxels in ``mask``, in
+    place, in chunks of ``chunk_size`` voxels.
 
-    f_data = fft(data_p)
-    f_data[freq_mask != True] = 0.
-    data_bp = np.real_if_close(ifft(f_data)[:sample_length])
-    return data_bp
+    Parameters
+    ----------
+    data : numpy.ndarray
+        4D image data.
+    mask : numpy.ndarray
+        3D boolean mask of the voxels to filter.
+    sample_period : float
+        Length of sampling period in seconds.
+    bandpass_freqs : tuple
+        Tuple containing the bandpass frequencies. (LowCutoff_HighPass HighCutoff_LowPass)
+    chunk_size : int
+        Number of voxels filtered at a time.
+
+    Returns
+    -------
+    data : numpy.ndarray
+        ``data``, filtered.
+    """
+    freq_mask = ideal_bandpass_mask(data.shape[-1], sample_period,
+                                    bandpass_freqs)
+    voxels = np.argwhere(mask)
+    for start in range(0, len(voxels), chunk_size):
+        index = tuple(voxels[start:start + chunk_size].T)
+        Y = data[index].T
+        Yc = Y - Y.mean(0)
+        data[index] = ideal_bandpass(Yc, sample_period, bandpass_freqs,
+                                     freq_mask).T
+    return data
 
 
 def bandpass_voxels(realigned_file, regressor_file, bandpass_freqs,
-                    sample_period=None):
+                    sample_period=None, dtype='float64', chunk_size=4096):
     """Performs ideal bandpass filtering on each voxel time-series.
     
     Parameters
     ----------
     realigned_file : string
         Path of a realigned nifti file.
+    regressor_file : string
+        Path of a nifti or 1D regressor file to filter the same way, or
+        None.
     bandpass_freqs : tuple
         Tuple containing the bandpass frequencies. (LowCutoff_HighPass HighCutoff_LowPass)
     sample_period : float, optional
         Length of sampling period in seconds.  If not specified,
         this value is read from the nifti file provided.
+    dtype : string, optional
+        'float64' (default) or 'float32' to load and filter images in
+        single precision.
+    chunk_size : int, optional
+        Number of voxels filtered at a time.
         
     Returns
     -------
     bandpassed_file : string
         Path of filtered output (nifti file).
+    regressor_bandpassed_file : string
+        Path of filtered regressors, or None.
     
     """
     nii = nb.load(realigned_file)
-    data = nii.get_fdata().astype('float64')
-    mask = (data != 0).sum(-1) != 0
-    Y = data[mask].T
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
+    data = nii.get_fdata(dtype=dtype)
+    mask = (data != 0).any(-1)
 
     if not sample_period:
         hdr = nii.header
@@ -77,11 +163,8 @@ def bandpass_voxels(realigned_file, regressor_file, bandpass_freqs,
         if sample_period > 20.0:
             sample_period /= 1000.0
 
-    Y_bp = np.zeros_like(Y)
-    for j in range(Y.shape[1]):
-        Y_bp[:, j] = ideal_bandpass(Yc[:, j], sample_period, bandpass_freqs)
+    bandpass_image(data, mask, sample_period, bandpass_freqs, chunk_size)
 
-    data[mask] = Y_bp.T
     img = nb.Nifti1Image(data, header=nii.header,
                          affine=nii.affine)
     bandpassed_file = os.path.join(os.getcwd(),
@@ -94,14 +177,10 @@ def bandpass_voxels(realigned_file, regressor_file, bandpass_freqs,
 
         if regressor_file.endswith('.nii.gz') or regressor_file.endswith('.nii'):
             nii = nb.load(regressor_file)
-            data = nii.get_fdata().astype('float64')
-            mask = (data != 0).sum(-1) != 0
-            Y = data[mask].T
-            Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
-            Y_bp = np.zeros_like(Y)
-            for j in range(Y.shape[1]):
-                Y_bp[:, j] = ideal_bandpass(Yc[:, j], sample_period, bandpass_freqs)
-            data[mask] = Y_bp.T
+            data = nii.get_fdata(dtype=dtype)
+            mask = (data != 0).any(-1)
+            bandpass_image(data, mask, sample_period, bandpass_freqs,
+                           chunk_size)
             
             img = nb.Nifti1Image(data, header=nii.header,
                             affine=nii.affine)
@@ -121,15 +200,11 @@ def bandpass_voxels(realigned_file, regressor_file, bandpass_freqs,
                         header.append(line)
             
             # usecols=[list]
-            regressor = np.loadtxt(regressor_file, skiprows=len(header))
-            Yc = regressor - np.tile(regressor.mean(0), (regressor.shape[0], 1))
-            Y_bp = np.zeros_like(Yc)
-
-            # Modify to allow just 1 regressor column
-            shape = regressor.shape[0] if len(regressor.shape) < 1 else regressor.shape[1]
-            for j in range(shape):
-                Y_bp[:, j] = ideal_bandpass(Yc[:, j], sample_period,
-                                            bandpass_freqs)
+            # ndmin=2 to allow just 1 regressor column
+            regressor = np.loadtxt(regressor_file, skiprows=len(header),
+                                   ndmin=2)
+            Yc = regressor - regressor.mean(0)
+            Y_bp = ideal_bandpass(Yc, sample_period, bandpass_freqs)
 
             regressor_bandpassed_file = os.path.join(os.getcwd(),
                                     'regressor_bandpassed_demeaned_filtered.1D')
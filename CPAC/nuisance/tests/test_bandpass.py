@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy.fftpack import fft, ifft
+
+from CPAC.nuisance.bandpass import bandpass_image, ideal_bandpass
+
+
+def reference_bandpass(data, sample_period, bandpass_freqs):
+    # one timeseries at a time, masking the full complex FFT
+    padded_length = int(2**np.ceil(np.log2(data.shape[0])))
+    low, high = bandpass_freqs
+    low_i = 0 if low is None else int(np.ceil(
+        low * padded_length * sample_period))
+    high_i = int(np.fix(high * padded_length * sample_period))
+    freq_mask = np.zeros(padded_length, dtype=bool)
+    freq_mask[low_i:high_i + 1] = True
+    freq_mask[padded_length - high_i:padded_length + 1 - low_i] = True
+    data_p = np.zeros(padded_length)
+    data_p[:data.shape[0]] = data
+    f_data = fft(data_p)
+    f_data[~freq_mask] = 0.
+    return np.real(ifft(f_data)[:data.shape[0]])
+
+
+@pytest.mark.parametrize('bandpass_freqs', [(0.01, 0.1), (None, 0.1)])
+def test_ideal_bandpass(bandpass_freqs):
+    rng = np.random.default_rng(42)
+    data = rng.standard_normal((150, 7))
+    expected = np.column_stack([reference_bandpass(column, 0.8,
+                                                   bandpass_freqs)
+                                for column in data.T])
+
+    np.testing.assert_allclose(ideal_bandpass(data, 0.8, bandpass_freqs),
+                               expected, atol=1e-12)
+    np.testing.assert_allclose(ideal_bandpass(data[:, 0], 0.8,
+                                              bandpass_freqs),
+                               expected[:, 0], atol=1e-12)
+
+    filtered = ideal_bandpass(data.astype(np.float32), 0.8, bandpass_freqs)
+    assert filtered.dtype == np.float32
+    np.testing.assert_allclose(filtered, expected, atol=1e-5)
+
+
+def test_bandpass_image():
+    rng = np.random.default_rng(42)
+    data = rng.standard_normal((5, 4, 3, 100)) + 10
+    mask = rng.random((5, 4, 3)) > 0.5
+    data[~mask] = 0
+
+    expected = data.copy()
+    for index in np.argwhere(mask):
+        index = tuple(index)
+        expected[index] = reference_bandpass(
+            data[index] - data[index].mean(), 2., (0.01, 0.1))
+
+    np.testing.assert_allclose(
+        bandpass_image(data, mask, 2., (0.01, 0.1), chunk_size=7),
+        expected, atol=1e-12)
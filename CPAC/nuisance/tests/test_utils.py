@@ -5,6 +5,7 @@ import pytest
 import tempfile
 from CPAC.nuisance.utils import find_offending_time_points
 from CPAC.nuisance.utils import calc_compcor_components
+from CPAC.nuisance.utils.compcor import compcor_components
 
 mocked_outputs = \
     p.resource_filename(
@@ -48,3 +49,41 @@ def test_calc_compcor_components():
 
     print('compcor components written to {0}'.format(compcor_filename))
     assert 0 == 1
+
+
+@pytest.mark.parametrize('shape', [(50, 200), (200, 50)])
+def test_compcor_components(shape):
+    rng = np.random.default_rng(42)
+    Yc = rng.standard_normal(shape)
+    Yc -= Yc.mean(0)
+
+    U, explained_variance = compcor_components(Yc, 5)
+
+    U_svd, S, _ = np.linalg.svd(Yc, full_matrices=False)
+    np.testing.assert_allclose(np.abs(U), np.abs(U_svd[:, :5]), atol=1e-8)
+    np.testing.assert_allclose(explained_variance,
+                               S[:5] ** 2 / (S ** 2).sum())
+    assert (U[np.abs(U).argmax(0), range(5)] > 0).all()
+
+
+@pytest.mark.parametrize('remove_mean', [True, False])
+def test_cosine_filter(tmpdir, remove_mean):
+    import nibabel as nb
+    from CPAC.nuisance.utils.compcor import _cosine_drift, _full_rank, \
+                                            cosine_filter
+    os.chdir(tmpdir)
+    rng = np.random.default_rng(42)
+    data = rng.standard_normal((6, 5, 4, 100)) + np.linspace(0, 5, 100)
+    data[:2] = 0
+    nb.Nifti1Image(data, np.eye(4)).to_filename(str(tmpdir / 'bold.nii.gz'))
+
+    filtered = nb.load(cosine_filter(str(tmpdir / 'bold.nii.gz'), 2.0,
+                                     remove_mean=remove_mean,
+                                     chunk_size=7)).get_fdata()
+
+    X = _full_rank(_cosine_drift(128, 2.0 * np.arange(100)))[0]
+    betas = np.linalg.lstsq(X, data.reshape(-1, 100).T, rcond=None)[0]
+    if not remove_mean:
+        X, betas = X[:, :-1], betas[:-1]
+    expected = (data.reshape(-1, 100) - X.dot(betas).T).reshape(data.shape)
+    np.testing.assert_allclose(filtered, expected, atol=1e-10)
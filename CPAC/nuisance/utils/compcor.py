@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 import scipy.signal as signal
 import nibabel as nb
 import numpy as np
@@ -9,13 +10,41 @@ from scipy.linalg import svd
 iflogger = logging.getLogger('nipype.interface')
 
 
-def calc_compcor_components(data_filename, num_components, mask_filename):
+def calc_compcor_components(data_filename, num_components, mask_filename,
+                            chunk_size=64):
+    """
+    Calculate the leading principal components of the detrended,
+    normalized timeseries of the voxels in a mask.
+
+    Only the masked voxels are loaded, in chunks of ``chunk_size``
+    timepoints, and the components are computed with
+    ``compcor_components`` rather than a full SVD. The fraction of
+    variance explained by each component is logged and written to
+    ``compcor_variance.1D``.
+
+    Parameters
+    ----------
+    data_filename : string
+        Path of a 4D nifti file.
+    num_components : int
+        Number of components to keep.
+    mask_filename : string
+        Path of a 3D nifti mask.
+    chunk_size : int, optional
+        Number of timepoints loaded at a time.
+
+    Returns
+    -------
+    regressor_file : string
+        Path of the 1D file of components, one per column.
+    """
+    from CPAC.nuisance.utils.compcor import compcor_components
 
     if num_components < 1:
         raise ValueError('Improper value for num_components ({0}), should be >= 1.'.format(num_components))
 
     try:
-        image_data = nb.load(data_filename).get_fdata().astype(np.float64)
+        image = nb.load(data_filename, keep_file_open=True)
     except:
         print('Unable to load data from {0}'.format(data_filename))
         raise
@@ -25,15 +54,19 @@ def calc_compcor_components(data_filename, num_components, mask_filename):
     except:
         print('Unable to load data from {0}'.format(mask_filename))
 
-    if not safe_shape(image_data, binary_mask):
+    if not safe_shape(image, binary_mask):
         raise ValueError('The data in {0} and {1} do not have a consistent shape'.format(data_filename, mask_filename))
 
     # make sure that the values in binary_mask are binary
-    binary_mask[binary_mask > 0] = 1
-    binary_mask[binary_mask != 1] = 0
+    binary_mask = binary_mask > 0
 
     # reduce the image data to only the voxels in the binary mask
-    image_data = image_data[binary_mask==1, :]
+    timepoints = image.shape[3]
+    image_data = np.empty((int(binary_mask.sum()), timepoints))
+    for start in range(0, timepoints, chunk_size):
+        stop = min(start + chunk_size, timepoints)
+        image_data[:, start:stop] = np.asanyarray(
+            image.dataobj[..., start:stop])[binary_mask]
 
     # filter out any voxels whose variance equals 0
     print('Removing zero variance components')
@@ -46,21 +79,65 @@ def calc_compcor_components(data_filename, num_components, mask_filename):
 
     print('Detrending and centering data')
     Y = signal.detrend(image_data, axis=1, type='linear').T
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
-    Yc = Yc / np.tile(np.array(Yc.std(0)).reshape(1,Yc.shape[1]), (Yc.shape[0],1))
+    del image_data
+    Yc = Y - Y.mean(0)
+    Yc /= Yc.std(0)
 
-    print('Calculating SVD decomposition of Y*Y\'')
-    U, S, Vh = np.linalg.svd(Yc, full_matrices=False)
+    print('Calculating leading components of Y*Y\'')
+    U, explained_variance = compcor_components(Yc, num_components)
+    print('Explained variance per component: {0}'.format(
+        np.array2string(explained_variance, precision=4)))
 
     # write out the resulting regressor file
     regressor_file = os.path.join(os.getcwd(), 'compcor_regressors.1D')
-    np.savetxt(regressor_file, U[:, :num_components], delimiter='\t', fmt='%16g')
+    np.savetxt(regressor_file, U, delimiter='\t', fmt='%16g')
+    np.savetxt(os.path.join(os.getcwd(), 'compcor_variance.1D'),
+               explained_variance, fmt='%16g')
 
     return regressor_file
 
 
+def compcor_components(Yc, num_components):
+    """
+    Leading left singular vectors of a centered time x voxel matrix,
+    from the eigendecomposition of its smaller Gram matrix (time x time,
+    or voxel x voxel if there are fewer voxels than timepoints).
+
+    Parameters
+    ----------
+    Yc : numpy.ndarray
+        Centered time x voxel matrix.
+    num_components : int
+        Number of components to keep.
+
+    Returns
+    -------
+    U : numpy.ndarray
+        time x num_components matrix of components, each signed so that
+        its largest absolute value is positive.
+    explained_variance : numpy.ndarray
+        Fraction of the total variance explained by each component.
+    """
+    timepoints, voxels = Yc.shape
+    if timepoints <= voxels:
+        eigenvalues, U = np.linalg.eigh(Yc @ Yc.T)
+    else:
+        eigenvalues, V = np.linalg.eigh(Yc.T @ Yc)
+        U = Yc @ V
+    # eigh returns eigenvalues in ascending order
+    order = np.argsort(eigenvalues)[::-1][:num_components]
+    eigenvalues = np.clip(eigenvalues, 0, None)
+    U = U[:, order]
+    if timepoints > voxels:
+        U /= np.where(eigenvalues[order] > 0,
+                      np.sqrt(eigenvalues[order]), 1)
+    U *= np.sign(U[np.abs(U).argmax(0), np.arange(U.shape[1])])
+    explained_variance = eigenvalues[order] / eigenvalues.sum()
+    return U, explained_variance
+
+
 # cosine_filter adapted from nipype 'https://github.com/nipy/nipype/blob/d353f0d879826031334b09d33e9443b8c9b3e7fe/nipype/algorithms/confounds.py'
-def cosine_filter(input_image_path, timestep, period_cut=128, remove_mean=True, axis=-1, failure_mode='error'):
+def cosine_filter(input_image_path, timestep, period_cut=128, remove_mean=True, axis=-1, failure_mode='error', mask_path=None, chunk_size=4096):
     """
     input_image_path: string
             Bold image to be filtered.
@@ -68,35 +145,44 @@ def cosine_filter(input_image_path, timestep, period_cut=128, remove_mean=True,
             'Repetition time (TR) of series (in sec) - derived from image header if unspecified'
     period_cut: float
             Minimum period (in sec) for DCT high-pass filter, nipype default value: 128
+    mask_path: string, optional
+            Mask of the voxels to filter. Voxels outside the mask are left
+            unchanged. By default, every voxel with a non-zero value at any
+            timepoint is filtered (all-zero voxels are unchanged by the
+            filter).
+    chunk_size: int, optional
+            Number of voxels filtered at a time.
 
     """
 
-    from CPAC.nuisance.utils.compcor import _full_rank
-    from CPAC.nuisance.utils.compcor import _cosine_drift
+    from CPAC.nuisance.utils.compcor import _cosine_drift_projection
 
     input_img = nb.load(input_image_path)
-    input_data = input_img.get_fdata()
+    # filter in the precision of the input, but at least float32
+    input_data = input_img.get_fdata(dtype=np.promote_types(
+        input_img.get_data_dtype(), np.float32))
 
     datashape = input_data.shape
     timepoints = datashape[axis]
     if datashape[0] == 0 and failure_mode != 'error':
         return input_data, np.array([])
 
-    input_data = input_data.reshape((-1, timepoints))
-
-    frametimes = timestep * np.arange(timepoints)
-    X = _full_rank(_cosine_drift(period_cut, frametimes))[0]
-    non_constant_regressors = X[:, :-1] if X.shape[1] > 1 else np.array([])
-
-    betas = np.linalg.lstsq(X, input_data.T)[0]
+    input_data = np.moveaxis(input_data, axis, -1)
+    if mask_path is not None:
+        voxels = np.argwhere(nb.load(mask_path).get_fdata() != 0)
+    else:
+        voxels = np.argwhere((input_data != 0).any(-1))
 
-    if not remove_mean:
-        X = X[:, :-1]
-        betas = betas[:-1]
+    X, X_pinv = _cosine_drift_projection(timestep, timepoints, period_cut,
+                                         remove_mean)
 
-    residuals = input_data - X.dot(betas).T
+    for start in range(0, len(voxels), chunk_size):
+        index = tuple(voxels[start:start + chunk_size].T)
+        data = input_data[index]
+        betas = data @ X_pinv.T
+        input_data[index] = data - betas @ X.T
 
-    output_data = residuals.reshape(datashape)
+    output_data = np.moveaxis(input_data, -1, axis)
 
     hdr = input_img.header
     output_img = nb.Nifti1Image(output_data, header=hdr,
@@ -111,6 +197,45 @@ def cosine_filter(input_image_path, timestep, period_cut=128, remove_mean=True,
     return cosfiltered_img
 
 
+@lru_cache(maxsize=16)
+def _cosine_drift_projection(timestep, timepoints, period_cut=128,
+                             remove_mean=True):
+    """
+    Cosine drift design and the rows of its pseudo-inverse that give the
+    betas of the drifts to remove, cached per design.
+
+    Parameters
+    ----------
+    timestep : float
+        Repetition time (TR) of series (in sec)
+    timepoints : int
+        Number of timepoints
+    period_cut : float
+        Minimum period (in sec) for DCT high-pass filter
+    remove_mean : bool
+        Whether to remove the constant regressor too
+
+    Returns
+    -------
+    X : array of shape(timepoints, n_drifts)
+        Drifts to remove
+    X_pinv : array of shape(n_drifts, timepoints)
+        Rows of the pseudo-inverse of the full (regularized) design
+        corresponding to the drifts to remove, so that the least-squares
+        betas of a timeseries ``y`` on the full design are
+        ``X_pinv @ y``
+    """
+    frametimes = timestep * np.arange(timepoints)
+    X = _full_rank(_cosine_drift(period_cut, frametimes))[0]
+    X_pinv = np.linalg.pinv(X)
+
+    if not remove_mean:
+        X = X[:, :-1]
+        X_pinv = X_pinv[:-1]
+
+    return X, X_pinv
+
+
 # _cosine_drift and _full_rank copied from nipype 'https://github.com/nipy/nipype/blob/d353f0d879826031334b09d33e9443b8c9b3e7fe/nipype/algorithms/confounds.py'
 def _cosine_drift(period_cut, frametimes):
     """
@@ -315,7 +315,15 @@ def extract_power_params(power_params_lines, power_params_filepath):
 def create_output_dict_list(nifti_globs, pipeline_output_folder,
                             resource_list, get_motion=False,
                             get_raw_score=False, pull_func=False,
-                            derivatives=None, exts=['nii', 'nii.gz']):
+                            derivatives=None, exts=['nii', 'nii.gz'],
+                            output_index=None):
+    """Collect the output files of each resource and strategy
+
+    If ``output_index`` is given (see
+    :py:class:`CPAC.pipeline.output_index.OutputIndex`), files are looked
+    up in it instead of walking the output directory and matching them to
+    ``nifti_globs``.
+    """
 
     import os
     import glob
@@ -374,74 +382,80 @@ def create_output_dict_list(nifti_globs, pipeline_output_folder,
 
     exts = ['.' + ext.lstrip('.') for ext in exts]
 
+    if output_index is not None:
+        pipeline_output_folder = output_index.pipeline_output_folder
+        filepaths = output_index.files(search_dirs, exts)
+    else:
+        filepaths = (os.path.join(root, filename) for root, _, files in
+                     os.walk(pipeline_output_folder) for filename in files)
+
     # parse each result of each "valid" glob string
     output_dict_list = {}
 
-    for root, _, files in os.walk(pipeline_output_folder):
-        for filename in files:
-
-            filepath = os.path.join(root, filename)
-            if not any(fnmatch.fnmatch(filepath, pattern) for pattern in nifti_globs):
-                continue
+    for filepath in filepaths:
+        if output_index is None and not any(
+                fnmatch.fnmatch(filepath, pattern)
+                for pattern in nifti_globs):
+            continue
 
-            if not any(filepath.endswith(ext) for ext in exts):
-                continue
-            relative_filepath = filepath.split(pipeline_output_folder)[1]
-            filepath_pieces = [_f for _f in relative_filepath.split("/") if _f]
+        if not any(filepath.endswith(ext) for ext in exts):
+            continue
+        relative_filepath = filepath.split(pipeline_output_folder)[1]
+        filepath_pieces = [_f for _f in relative_filepath.split("/") if _f]
 
-            resource_id = '_'.join(filepath_pieces[2].split(".")[0].split("_")[3:])
+        resource_id = '_'.join(filepath_pieces[2].split(".")[0].split("_")[3:])
 
-            if resource_id not in search_dirs:
-                continue
+        if resource_id not in search_dirs:
+            continue
 
-            series_id_string = filepath_pieces[2].split("_")[1]
-            strat_info = "_".join(filepath_pieces[2].split("_")[2:3])
+        series_id_string = filepath_pieces[2].split("_")[1]
+        strat_info = "_".join(filepath_pieces[2].split("_")[2:3])
 
-            unique_resource_id = (resource_id, strat_info)
+        unique_resource_id = (resource_id, strat_info)
 
-            if unique_resource_id not in output_dict_list.keys():
-                output_dict_list[unique_resource_id] = []
+        if unique_resource_id not in output_dict_list.keys():
+            output_dict_list[unique_resource_id] = []
 
-            unique_id = filepath_pieces[0]
+        unique_id = filepath_pieces[0]
 
-            series_id = series_id_string.replace("_scan_", "")
-            series_id = series_id.replace("_rest", "")
+        series_id = series_id_string.replace("_scan_", "")
+        series_id = series_id.replace("_rest", "")
 
-            new_row_dict = {}
-            new_row_dict["participant_session_id"] = unique_id
-            new_row_dict["participant_id"], new_row_dict["Sessions"] = \
-                unique_id.split('_')
+        new_row_dict = {}
+        new_row_dict["participant_session_id"] = unique_id
+        new_row_dict["participant_id"], new_row_dict["Sessions"] = \
+            unique_id.split('_')
 
-            new_row_dict["Series"] = series_id
-            new_row_dict["Filepath"] = filepath
+        new_row_dict["Series"] = series_id
+        new_row_dict["Filepath"] = filepath
 
-            print('{0} - {1} - {2}'.format(
-                unique_id.split("_")[0],
-                series_id,
-                resource_id
-            ))
+        print('{0} - {1} - {2}'.format(
+            unique_id.split("_")[0],
+            series_id,
+            resource_id
+        ))
 
-            if get_motion:
-                # if we're including motion measures
-                power_params_file = find_power_params_file(filepath,
-                    resource_id, series_id)
-                power_params_lines = load_text_file(power_params_file,
-                    "power parameters file")
-                meanfd_p, meanfd_j, meandvars = \
-                    extract_power_params(power_params_lines,
-                                         power_params_file)
-                new_row_dict["MeanFD_Power"] = meanfd_p
-                new_row_dict["MeanFD_Jenkinson"] = meanfd_j
-                new_row_dict["MeanDVARS"] = meandvars
+        if get_motion:
+            # if we're including motion measures
+            power_params_file = find_power_params_file(filepath,
+                resource_id, series_id)
+            power_params_lines = load_text_file(power_params_file,
+                "power parameters file")
+            meanfd_p, meanfd_j, meandvars = \
+                extract_power_params(power_params_lines,
+                                     power_params_file)
+            new_row_dict["MeanFD_Power"] = meanfd_p
+            new_row_dict["MeanFD_Jenkinson"] = meanfd_j
+            new_row_dict["MeanDVARS"] = meandvars
 
-            if get_raw_score:
-                # grab raw score for measure mean just in case
-                raw_score_path = grab_raw_score_filepath(filepath,
-                                                         resource_id)
-                new_row_dict["Raw_Filepath"] = raw_score_path
+        if get_raw_score:
+            # grab raw score for measure mean just in case
+            raw_score_path = grab_raw_score_filepath(filepath,
+                                                     resource_id)
+            new_row_dict["Raw_Filepath"] = raw_score_path
 
-            # unique_resource_id is tuple (resource_id,strat_info)
-            output_dict_list[unique_resource_id].append(new_row_dict)
+        # unique_resource_id is tuple (resource_id,strat_info)
+        output_dict_list[unique_resource_id].append(new_row_dict)
 
     return output_dict_list
 
@@ -481,22 +495,37 @@ def create_output_df_dict(output_dict_list, inclusion_list=None):
 def gather_outputs(pipeline_folder, resource_list, inclusion_list,
                    get_motion, get_raw_score, get_func=False,
                    derivatives=None):
+    """Gather the outputs of the selected resources into a dataframe per
+    resource and strategy, from the persistent index of the pipeline
+    output directory (see
+    :py:class:`CPAC.pipeline.output_index.OutputIndex`), which is
+    refreshed first
+    """
+    from CPAC.pipeline.output_index import OutputIndex
 
-    nifti_globs = gather_nifti_globs(
-        pipeline_folder,
-        resource_list,
-        get_func
-    )
+    if len(resource_list) == 0:
+        err = "\n\n[!] No derivatives selected!\n\n"
+        raise Exception(err)
 
-    output_dict_list = create_output_dict_list(
-        nifti_globs,
-        pipeline_folder,
-        resource_list,
-        get_motion,
-        get_raw_score,
-        get_func,
-        derivatives
-    )
+    with OutputIndex(pipeline_folder) as output_index:
+        output_index.refresh()
+        output_dict_list = create_output_dict_list(
+            None,
+            pipeline_folder,
+            resource_list,
+            get_motion,
+            get_raw_score,
+            get_func,
+            derivatives,
+            output_index=output_index
+        )
+
+    if len(output_dict_list) == 0:
+        err = "\n\n[!] No output filepaths found in the pipeline output " \
+              "directory provided for the derivatives selected!\n\nPipeline " \
+              "output directory provided: %s\nDerivatives selected:%s\n\n" \
+              % (pipeline_folder, resource_list)
+        raise Exception(err)
 
     output_df_dict = create_output_df_dict(output_dict_list, inclusion_list)
 
@@ -1088,12 +1117,11 @@ def run_feat(group_config_file, feat=True):
     import os
     import numpy as np
     import pandas as pd
-    from multiprocessing import Process
     from CPAC.pipeline.cpac_ga_model_generator import create_dir
     from CPAC.utils.create_flame_model_files import create_flame_model_files
 
     # let's get the show on the road
-    procss = []
+    jobs = []
 
     # get group pipeline config loaded
     c = load_config_yml(group_config_file)
@@ -1215,22 +1243,22 @@ def run_feat(group_config_file, feat=True):
 
         if feat:
             from CPAC.group_analysis.group_analysis import run_feat_pipeline
-            procss.append(Process(target=run_feat_pipeline,
-                                  args=(c, models[id_tuple]['merged'],
-                                        models[id_tuple]['merged_mask'],
-                                        f_test, mat, con, grp, model_out_dir,
-                                        work_dir, log_dir, model_name, fts)))
+            jobs.append(('/'.join(id_tuple), run_feat_pipeline,
+                         (c, models[id_tuple]['merged'],
+                          models[id_tuple]['merged_mask'],
+                          f_test, mat, con, grp, model_out_dir,
+                          work_dir, log_dir, model_name, fts)))
         else:
             from CPAC.randomise.randomise import prep_randomise_workflow
             model_out_dir = model_out_dir.replace('feat_results',
                                                   'randomise_results')
-            procss.append(Process(target=prep_randomise_workflow,
-                                  args=(c, models[id_tuple]['merged'],
-                                        models[id_tuple]['merged_mask'],
-                                        f_test, mat, con, grp, model_out_dir,
-                                        work_dir, log_dir, model_name, fts)))
+            jobs.append(('/'.join(id_tuple), prep_randomise_workflow,
+                         (c, models[id_tuple]['merged'],
+                          models[id_tuple]['merged_mask'],
+                          f_test, mat, con, grp, model_out_dir,
+                          work_dir, log_dir, model_name, fts)))
 
-    manage_processes(procss, out_dir, c["fsl_feat"]["num_models_at_once"])
+    run_group_jobs(jobs, out_dir, c["fsl_feat"]["num_models_at_once"])
 
 
 def run_cwas_group(pipeline_dir, out_dir, working_dir, crash_dir, roi_file,
@@ -1809,7 +1837,8 @@ def run_isc_group(pipeline_dir, out_dir, working_dir, crash_dir,
                 isc_wf = create_isc(name=it_id,
                                     output_dir=unique_out_dir,
                                     working_dir=working_dir,
-                                    crash_dir=crash_dir)
+                                    crash_dir=crash_dir,
+                                    n_procs=num_cpus)
                 isc_wf.inputs.inputspec.subjects = func_paths
                 isc_wf.inputs.inputspec.permutations = permutations
                 isc_wf.inputs.inputspec.std = std_filter
@@ -1841,7 +1870,8 @@ def run_isc_group(pipeline_dir, out_dir, working_dir, crash_dir,
                 isfc_wf = create_isfc(name=it_id,
                                       output_dir=unique_out_dir,
                                       working_dir=working_dir,
-                                      crash_dir=crash_dir)
+                                      crash_dir=crash_dir,
+                                      n_procs=num_cpus)
                 isfc_wf.inputs.inputspec.subjects = func_paths
                 isfc_wf.inputs.inputspec.permutations = permutations
                 isfc_wf.inputs.inputspec.std = std_filter
@@ -1995,7 +2025,8 @@ def run_qpp(group_config_file):
 
             output_df_group = output_df_group.sort_values(by='participant_session_id')
 
-            wf = create_qpp(name="QPP", working_dir=group_working_dir, crash_dir=group_crash_dir)
+            wf = create_qpp(name="QPP", working_dir=group_working_dir, crash_dir=group_crash_dir,
+                            n_procs=c["pipeline_setup"]["system_config"]["num_cpus"])
 
             wf.inputs.inputspec.window_length = c["qpp"]["window"]
             wf.inputs.inputspec.permutations = c["qpp"]["permutations"]
@@ -2010,51 +2041,155 @@ def run_qpp(group_config_file):
             wf.run()
 
 
-def manage_processes(procss, output_dir, num_parallel=1):
+def _run_group_job(target, args, kwargs, conn):
+    """Run a group-level job in its own process, sending its errors and
+    resource usage (including any of its subprocesses) back to the
+    process managing the jobs"""
+    import resource
+    import sys
+    import traceback
 
-    import os
+    error = None
+    try:
+        target(*args, **kwargs)
+    except Exception:  # pylint: disable=broad-except
+        error = traceback.format_exc()
+    finally:
+        # a SystemExit from the job still reports its usage, then exits
+        # with the job's own code
+        usage = [resource.getrusage(who) for who in (
+            resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        maxrss_unit = 1 if sys.platform == 'darwin' else 1024
+        conn.send({
+            'error': error,
+            'cpu_seconds': sum(ru.ru_utime + ru.ru_stime for ru in usage),
+            'max_rss_gb': max(ru.ru_maxrss for ru in usage) * maxrss_unit /
+                          1024 ** 3})
+        conn.close()
+    if error is not None:
+        sys.exit(1)
+
+
+def _receive_usage(job):
+    """Read a group-level job's report of its errors and resource usage,
+    if it sent one, and close its end of the pipe"""
+    receiver = job['receiver']
+    try:
+        if receiver.poll():
+            job['usage'].update(receiver.recv())
+    except EOFError:
+        pass
+    receiver.close()
 
-    # start kicking it off
-    pid = open(os.path.join(output_dir, 'pid_group.txt'), 'w')
 
-    jobQueue = []
-    if len(procss) <= num_parallel:
-        """
-        Stream all the subjects as sublist is
-        less than or equal to the number of
-        subjects that need to run
-        """
-        for p in procss:
-            p.start()
-            print(p.pid, file=pid)
+def run_group_jobs(jobs, output_dir, num_parallel=1):
+    """Run group-level jobs, each in its own process, at most
+    ``num_parallel`` at a time
 
-    else:
-        """
-        Stream the subject workflows for preprocessing.
-        At Any time in the pipeline c.numSubjectsAtOnce
-        will run, unless the number remaining is less than
-        the value of the parameter stated above
-        """
-        idx = 0
-        while idx < len(procss):
-            if len(jobQueue) == 0 and idx == 0:
-                idc = idx
-                for p in procss[idc: idc + num_parallel]:
-                    p.start()
-                    print(p.pid, file=pid)
-                    jobQueue.append(p)
-                    idx += 1
-            else:
-                for job in jobQueue:
-                    if not job.is_alive():
-                        print('found dead job {0}'.format(job))
-                        loc = jobQueue.index(job)
-                        del jobQueue[loc]
-                        procss[idx].start()
-                        jobQueue.append(procss[idx])
-                        idx += 1
-
-    pid.close()
+    The process IDs of the jobs are written to ``pid_group.txt`` and a
+    summary of each job's exit code, timing, CPU time and peak memory to
+    ``group_jobs_summary.json`` in ``output_dir``.
+
+    Parameters
+    ----------
+    jobs : list of tuple
+        ``(name, target, args)`` or ``(name, target, args, kwargs)``
+
+    output_dir : str
+
+    num_parallel : int
+
+    Returns
+    -------
+    list of dict
+        the summary of each job, in the order given
+    """
+    import json
+    import os
+    import time
+    from collections import deque
+    from multiprocessing import Pipe, Process
+    from multiprocessing.connection import wait
+
+    num_parallel = max(1, int(num_parallel or 1))
+    pending = deque(enumerate(jobs))
+    running = {}
+    summary = [None] * len(jobs)
+
+    with open(os.path.join(output_dir, 'pid_group.txt'), 'w') as pid:
+        while pending or running:
+            while pending and len(running) < num_parallel:
+                idx, job = pending.popleft()
+                name, target, args = job[:3]
+                kwargs = job[3] if len(job) > 3 else {}
+                receiver, sender = Pipe(duplex=False)
+                process = Process(target=_run_group_job, name=name,
+                                  args=(target, args, kwargs, sender))
+                process.start()
+                sender.close()
+                print(process.pid, file=pid, flush=True)
+                running[process.sentinel] = {
+                    'idx': idx, 'name': name, 'process': process,
+                    'receiver': receiver, 'start': time.time(),
+                    'usage': {'error': None, 'cpu_seconds': None,
+                              'max_rss_gb': None}}
+            # block until at least one running job finishes or reports its
+            # usage; reading reports as they arrive keeps a job whose report
+            # is larger than the pipe's buffer from blocking before it exits
+            receivers = {job['receiver']: job for job in running.values() if
+                         not job['receiver'].closed}
+            finished = []
+            for ready in wait(list(running) + list(receivers)):
+                if ready in receivers:
+                    _receive_usage(receivers[ready])
+                else:
+                    finished.append(ready)
+            for sentinel in finished:
+                job = running.pop(sentinel)
+                idx, name, process, start, usage = (
+                    job['idx'], job['name'], job['process'], job['start'],
+                    job['usage'])
+                # the job has exited, so its report (if any) is complete
+                if not job['receiver'].closed:
+                    _receive_usage(job)
+                process.join()
+                summary[idx] = {'name': name, 'pid': process.pid,
+                                'exitcode': process.exitcode,
+                                'start': time.strftime(
+                                    '%Y-%m-%dT%H:%M:%S',
+                                    time.localtime(start)),
+                                'wall_seconds': time.time() - start,
+                                **usage}
+                if process.exitcode:
+                    print('\n\n[!] Group analysis job {0} failed with exit '
+                          'code {1}:\n{2}\n'.format(
+                              name, process.exitcode, usage['error'] or ''))
+                else:
+                    print('Group analysis job {0} finished in {1:.1f} s '
+                          '(CPU time: {2:.1f} s, peak memory: {3:.2f} '
+                          'GB)'.format(name, summary[idx]['wall_seconds'],
+                                       usage['cpu_seconds'] or 0,
+                                       usage['max_rss_gb'] or 0))
+
+    with open(os.path.join(output_dir, 'group_jobs_summary.json'),
+              'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    failed = [job['name'] for job in summary if job['exitcode']]
+    if failed:
+        print('\n\n[!] {0} of {1} group analysis jobs failed: {2}\n'
+              'See {3} for details.\n'.format(
+                  len(failed), len(summary), ', '.join(failed),
+                  os.path.join(output_dir, 'group_jobs_summary.json')))
+    return summary
+
+
+def manage_processes(procss, output_dir, num_parallel=1):
+    """Run unstarted processes at most ``num_parallel`` at a time; see
+    :py:func:`run_group_jobs`"""
+    # pylint: disable=protected-access
+    return run_group_jobs([(p.name, p._target, p._args, p._kwargs) for
+                           p in procss], output_dir, num_parallel)
 
 
 def run(config_file):
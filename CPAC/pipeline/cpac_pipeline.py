@@ -219,6 +219,7 @@ from CPAC.utils.monitoring import getLogger, log_nodes_cb, log_nodes_initial, \
                                   LOGTAIL, set_up_logger, \
                                   WARNING_FREESURFER_OFF_WITH_DATA
 from CPAC.utils.monitoring.draw_gantt_chart import resource_report
+from CPAC.utils.interfaces.datasink import UPLOAD_LOG, upload_totals
 from CPAC.utils.utils import (
     check_config_resources,
     check_system_deps,
@@ -552,6 +553,10 @@ Please, make yourself aware of how it works and its assumptions:
             set_up_logger('callback', cb_log_filename, 'debug', log_dir,
                           mock=True)
 
+            # DataSinks add up their S3 uploads from this run only
+            if os.path.exists(os.path.join(log_dir, UPLOAD_LOG)):
+                os.remove(os.path.join(log_dir, UPLOAD_LOG))
+
             # Log initial information from all the nodes
             log_nodes_initial(workflow)
 
@@ -774,6 +779,12 @@ CPAC run error:
                     resource_report(cb_log_filename,
                                     num_cores_per_sub, logger)
 
+                for container, totals in upload_totals(log_dir).items():
+                    logger.info('%s: uploaded %d files (%.1f MB) to S3; '
+                                'skipped %d unchanged files', container,
+                                totals['files'], totals['bytes'] / 1024 ** 2,
+                                totals['skipped'])
+
                 logger.info('%s', execution_info.format(
                     workflow=workflow.name,
                     pipeline=c.pipeline_setup['pipeline_name'],
@@ -24,6 +24,7 @@ from voluptuous.error import Invalid
 from CPAC.utils.configuration import check_pname, Configuration, set_subject
 from CPAC.utils.ga import track_run
 from CPAC.utils.monitoring import failed_to_start, log_nodes_cb
+from CPAC.utils.s3_staging import stage_inputs
 from CPAC.longitudinal_pipeline.longitudinal_workflow import \
     anat_longitudinal_wf
 from CPAC.utils.configuration.yaml_template import upgrade_pipeline_to_1_8
@@ -407,6 +408,8 @@ def run(subject_list_file, config_file=None, p_name=None, plugin=None,
                       "directory: %s\n\nMake sure you have permissions " \
                       "to write to this directory.\n\n" % c.pipeline_setup['working_directory']['path']
                 raise Exception(err)
+        # Stage S3 inputs into the local cache before any workflow starts
+        stage_inputs(sublist, c)
         '''
         if not os.path.exists(c.pipeline_setup['log_directory']['path']):
             try:
@@ -18,6 +18,7 @@ import ast
 import copy
 import hashlib
 import json
+from functools import lru_cache
 from itertools import chain
 import logging
 import os
@@ -59,6 +60,46 @@ from CPAC.resources.templates.lookup_table import lookup_identifier
 logger = getLogger('nipype.workflow')
 
 
+@lru_cache(maxsize=4096)
+def _variants_conflict(current_strat, current_spread, other_strat,
+                       other_spread):
+    """Whether two linked inputs come from incompatible strategies
+
+    Parameters
+    ----------
+    current_strat, other_strat : frozenset
+        the variant of each of an input's CpacVariant entries
+
+    current_spread, other_spread : frozenset
+        every variant of each input's resource in the resource pool
+
+    Returns
+    -------
+    bool
+    """
+    current_strat = set(current_strat)
+    for spread_label in current_spread:
+        if 'NO-' in spread_label:
+            continue
+        if spread_label not in current_strat:
+            current_strat.add(f'NO-{spread_label}')
+    other_strat = set(other_strat)
+    for spread_label in other_spread:
+        if 'NO-' in spread_label:
+            continue
+        if spread_label not in other_strat:
+            other_strat.add(f'NO-{spread_label}')
+
+    for variant in current_spread:
+        in_current_strat = variant is None or variant in current_strat
+        in_other_strat = ((variant is None and None in other_spread) or
+                          variant in other_strat)
+        in_other_spread = variant in other_spread
+        if in_other_spread and in_current_strat != in_other_strat:
+            return True
+    return False
+
+
 class ResourcePool:
     def __init__(self, rpool=None, name=None, cfg=None, pipe_list=None):
 
@@ -487,8 +528,6 @@ class ResourcePool:
         # TODO: NOTE: NOT COMPATIBLE WITH SUB-RPOOL/STRAT_POOLS
         # TODO: (and it doesn't have to be)
 
-        import itertools
-
         linked_resources = []
         resource_list = []
         if debug:
@@ -562,118 +601,28 @@ class ResourcePool:
         # TODO: and the actual resource is encoded in the tag: of the last item, every time!
         # keying the strategies to the resources, inverting it
         if len_inputs > 1:
-            strats = itertools.product(*total_pool)
-
-            # we now currently have "strats", the combined permutations of all the strategies, as a list of tuples, each tuple combining one version of input each, being one of the permutations.
-            # OF ALL THE DIFFERENT INPUTS. and they are tagged by their fetched inputs with {name}:{strat}.
-            # so, each tuple has ONE STRAT FOR EACH INPUT, so if there are three inputs, each tuple will have 3 items.
+            # "strats" are the combined permutations of all the strategies,
+            # ONE STRAT FOR EACH INPUT, in the order itertools.product
+            # would give them, but without the combinations of linked
+            # inputs with conflicting variants, which are pruned as soon as
+            # both inputs are chosen rather than generated and dropped
             new_strats = {}
-
-            # get rid of duplicates - TODO: refactor .product
-            strat_str_list = []            
-            strat_list_list = []
-            for strat_tuple in strats:
-                strat_list = list(copy.deepcopy(strat_tuple))
-                strat_str = str(strat_list)
-                if strat_str not in strat_str_list:
-                    strat_str_list.append(strat_str)
-                    strat_list_list.append(strat_list)
-
-            if debug:
-                verbose_logger = getLogger('engine')
-                verbose_logger.debug('len(strat_list_list): %s\n',
-                                     len(strat_list_list))
-            for strat_list in strat_list_list:
-
-                json_dct = {}
-                for strat in strat_list:
-                    # strat is a prov list for a single resource/input
-                    strat_resource, strat_idx = \
-                        self.generate_prov_string(strat)
-                    strat_json = self.get_json(strat_resource,
-                                               strat=strat_idx)
-                    json_dct[strat_resource] = strat_json
-
-                drop = False
-                if linked_resources:
-                    for linked in linked_resources:  # <--- 'linked' is each tuple
-                        if drop:
-                            break
-                        for xlabel in linked:
-                            if drop:
-                                break
-                            xjson = copy.deepcopy(json_dct[xlabel])
-                            for ylabel in linked:
-                                if xlabel == ylabel:
-                                    continue
-                                yjson = copy.deepcopy(json_dct[ylabel])
-                                
-                                if 'CpacVariant' not in xjson:
-                                    xjson['CpacVariant'] = {}
-                                if 'CpacVariant' not in yjson:
-                                    yjson['CpacVariant'] = {}
-                                    
-                                current_strat = []
-                                for key, val in xjson['CpacVariant'].items():
-                                    if isinstance(val, list):
-                                        current_strat.append(val[0])
-                                    else:
-                                        current_strat.append(val)
-                                current_spread = list(set(variant_pool[xlabel]))
-                                for spread_label in current_spread:
-                                    if 'NO-' in spread_label:
-                                        continue
-                                    if spread_label not in current_strat:
-                                        current_strat.append(f'NO-{spread_label}')
-                                
-                                other_strat = []
-                                for key, val in yjson['CpacVariant'].items():
-                                    if isinstance(val, list):
-                                        other_strat.append(val[0])
-                                    else:
-                                        other_strat.append(val)
-                                other_spread = list(set(variant_pool[ylabel]))
-                                for spread_label in other_spread:
-                                    if 'NO-' in spread_label:
-                                        continue
-                                    if spread_label not in other_strat:
-                                        other_strat.append(f'NO-{spread_label}')
-                                
-                                for variant in current_spread:
-                                    in_current_strat = False
-                                    in_other_strat = False
-                                    in_other_spread = False
-
-                                    if variant is None:
-                                        in_current_strat = True
-                                        if None in other_spread:
-                                            in_other_strat = True
-                                    if variant in current_strat:
-                                        in_current_strat = True
-                                    if variant in other_strat:
-                                        in_other_strat = True
-                                    if variant in other_spread:
-                                        in_other_spread = True
-
-                                    if not in_other_strat:
-                                        if in_other_spread:
-                                            if in_current_strat:
-                                                drop = True
-                                                break
-
-                                    if in_other_strat:
-                                        if in_other_spread:
-                                            if not in_current_strat:
-                                                drop = True
-                                                break       
-                                if drop:
-                                    break
-                if drop:
-                    continue
-
+            strat_str_set = set()
+            n_strats = 0
+            for keyed_strats in self._linked_strats(total_pool,
+                                                    linked_resources,
+                                                    variant_pool):
                 # make the merged strat label from the multiple inputs
                 # strat_list is actually the merged CpacProvenance lists
-                pipe_idx = str(strat_list)
+                pipe_idx = '[' + ', '.join(
+                    strat_idx for _, _, strat_idx in keyed_strats) + ']'
+                if pipe_idx in strat_str_set:
+                    continue
+                strat_str_set.add(pipe_idx)
+                n_strats += 1
+                strat_list = copy.deepcopy(
+                    [cpac_prov for cpac_prov, _, _ in keyed_strats])
+
                 new_strats[pipe_idx] = ResourcePool()     # <----- new_strats is A DICTIONARY OF RESOURCEPOOL OBJECTS!
                 # placing JSON info at one level higher only for copy convenience
                 new_strats[pipe_idx].rpool['json'] = {}
@@ -681,8 +630,7 @@ class ResourcePool:
                 new_strats[pipe_idx].rpool['json']['CpacProvenance'] = strat_list
 
                 # now just invert resource:strat to strat:resource for each resource:strat
-                for cpac_prov in strat_list:
-                    resource, strat = self.generate_prov_string(cpac_prov)
+                for _, resource, strat in keyed_strats:
                     resource_strat_dct = self.rpool[resource][strat]   # <----- remember, this is the dct of 'data' and 'json'.
                     new_strats[pipe_idx].rpool[resource] = resource_strat_dct   # <----- new_strats is A DICTIONARY OF RESOURCEPOOL OBJECTS! each one is a new slice of the resource pool combined together.
                     self.pipe_list.append(pipe_idx)
@@ -697,6 +645,9 @@ class ResourcePool:
                     if data_type not in new_strats[pipe_idx].rpool['json']['subjson']:
                         new_strats[pipe_idx].rpool['json']['subjson'][data_type] = {}
                     new_strats[pipe_idx].rpool['json']['subjson'][data_type].update(copy.deepcopy(resource_strat_dct['json']))
+            if debug:
+                verbose_logger = getLogger('engine')
+                verbose_logger.debug('len(new_strats): %s\n', n_strats)
         else:
             new_strats = {}
             for resource_strat_list in total_pool:       # total_pool will have only one list of strats, for the one input
@@ -715,6 +666,86 @@ class ResourcePool:
                     new_strats[pipe_idx].rpool['json']['subjson'][data_type].update(copy.deepcopy(resource_strat_dct['json']))
         return new_strats
 
+    def _linked_strats(self, total_pool, linked_resources, variant_pool):
+        """Generate the combinations of one strategy per input of
+        :py:meth:`get_strats` in the order :py:func:`itertools.product`
+        would, skipping those where linked inputs have conflicting
+        variants
+
+        Each pair of linked inputs is checked as soon as the strategies of
+        both are chosen, so the combinations that follow a conflict are
+        never generated.
+
+        Parameters
+        ----------
+        total_pool : list of list
+            the CpacProvenance of each strategy of each input
+
+        linked_resources : list of list
+
+        variant_pool : dict
+
+        Yields
+        ------
+        list of tuple
+            ``(cpac_prov, resource, pipe_idx)`` for each input
+        """
+        # provenance strings are generated once per strategy rather than
+        # once per combination
+        keyed_pool = [[(cpac_prov, *self.generate_prov_string(cpac_prov))
+                       for cpac_prov in sub_pool] for sub_pool in total_pool]
+        num_inputs = len(keyed_pool)
+        # as in a dict of JSONs keyed by resource, the last input of a
+        # resource is the one compared, so a pair of linked resources can
+        # be checked once neither can be replaced by a later input
+        last_input = {}
+        for position, sub_pool in enumerate(keyed_pool):
+            for _, resource, _ in sub_pool:
+                last_input[resource] = position
+        checks = [[] for _ in range(num_inputs)]
+        for linked in linked_resources:
+            for xlabel in linked:
+                for ylabel in linked:
+                    if xlabel != ylabel:
+                        checks[max(last_input.get(xlabel, num_inputs - 1),
+                                   last_input.get(ylabel, num_inputs - 1))
+                               ].append((xlabel, ylabel))
+        spreads = {label: frozenset(variants) for label, variants in
+                   variant_pool.items()}
+        variants = {}
+        json_dct = {}
+        chosen = [None] * num_inputs
+
+        def strat_variants(label):
+            resource, strat = json_dct[label]
+            if (resource, strat) not in variants:
+                variants[(resource, strat)] = frozenset(
+                    val[0] if isinstance(val, list) else val for val in
+                    self.get_json(resource, strat=strat).get(
+                        'CpacVariant', {}).values())
+            return variants[(resource, strat)]
+
+        def combine(position):
+            if position == num_inputs:
+                yield list(chosen)
+                return
+            for keyed_strat in keyed_pool[position]:
+                resource, strat = keyed_strat[1:]
+                replaced = json_dct.get(resource)
+                json_dct[resource] = (resource, strat)
+                chosen[position] = keyed_strat
+                if not any(_variants_conflict(
+                        strat_variants(xlabel), spreads[xlabel],
+                        strat_variants(ylabel), spreads[ylabel])
+                           for xlabel, ylabel in checks[position]):
+                    yield from combine(position + 1)
+                if replaced is None:
+                    del json_dct[resource]
+                else:
+                    json_dct[resource] = replaced
+
+        yield from combine(0)
+
     def derivative_xfm(self, wf, label, connection, json_info, pipe_idx,
                        pipe_x):
 
@@ -10,6 +10,10 @@ STATEMENT OF CHANGES:
 CHANGES:
     * Supports just-in-time dynamic memory allocation
     * Supports overriding memory estimates via a log file and a buffer
+    * Supports estimating memory from a model of input data size learned
+      from callback logs of prior runs
+    * Supports ordering ready jobs by their estimated remaining critical
+      path and reports predicted vs. actual makespan
 
 ORIGINAL WORK'S ATTRIBUTION NOTICE:
     Copyright (c) 2009-2016, Nipype developers
@@ -34,17 +38,26 @@ This file is part of C-PAC.
 """
 import gc
 import json
+import os
 import platform
 import resource
 import sys
+import time
 from copy import deepcopy
 from logging import INFO
 from textwrap import indent
 from traceback import format_exception
 from nipype.pipeline.plugins.multiproc import logger
-from numpy import flatnonzero
+from numpy import flatnonzero, zeros
 from CPAC.pipeline.nipype_pipeline_engine import MapNode, UNDEFINED_SIZE
-from CPAC.utils.monitoring import log_nodes_cb
+from CPAC.utils.monitoring import input_data_features, log_nodes_cb, \
+                                 MemoryModel, RuntimeModel
+from CPAC.utils.monitoring.usage_model import callback_log_paths
+
+
+# static estimate of a node's runtime (seconds) for node types without
+# observed runtimes, so unobserved paths are ranked by their length
+DEFAULT_RUNTIME = 1.
 
 
 def get_peak_usage():
@@ -94,14 +107,32 @@ class CpacNipypeCustomPluginMixin():
             plugin_args = {}
         if 'status_callback' not in plugin_args:
             plugin_args['status_callback'] = log_nodes_cb
+        if 'scheduler' not in plugin_args:
+            plugin_args['scheduler'] = 'critical_path'
         if 'runtime' in plugin_args:
+            observed = {}
+            for usage in callback_log_paths(plugin_args['runtime']['usage']):
+                for node_key, observation in parse_previously_observed_mem_gb(
+                    usage
+                ).items():
+                    if isinstance(observation, (int, float)):
+                        observed[node_key] = max(
+                            observation, observed.get(node_key, 0))
             self.runtime = {node_key: observation * (
                 1 + plugin_args['runtime']['buffer'] / 100
-            ) for node_key, observation in parse_previously_observed_mem_gb(
-                plugin_args['runtime']['usage']).items()}
+            ) for node_key, observation in observed.items()}
+            self.memory_model = MemoryModel.from_callback_logs(
+                plugin_args['runtime']['usage'],
+                plugin_args['runtime']['buffer'],
+                plugin_args['runtime'].get('min_observations', 3))
+            self._modeled = set()
+            self.runtime_model = RuntimeModel.from_callback_logs(
+                plugin_args['runtime']['usage'])
         super().__init__(plugin_args=plugin_args)
         self.peak = 0
         self._stats = None
+        self._critical_path = None
+        self.makespan = {}
 
     def _check_resources_(self, running_tasks):
         """
@@ -126,6 +157,80 @@ class CpacNipypeCustomPluginMixin():
 
         return free_memory_gb, free_processors
 
+    def _estimate_runtime(self, node):
+        """Estimate a node's runtime (seconds) from observed runtimes,
+        falling back to :py:data:`DEFAULT_RUNTIME`"""
+        model = getattr(self, 'runtime_model', None)
+        if model is not None and node.fullname in model:
+            return model.predict(node.fullname)
+        return DEFAULT_RUNTIME
+
+    def _generate_dependency_list(self, graph):
+        """Generate the dependency list, then estimate each job's
+        remaining critical path: its own runtime plus the longest chain of
+        estimated runtimes through its dependents"""
+        super()._generate_dependency_list(graph)
+        runtimes = [self._estimate_runtime(node) for node in self.procs]
+        index = {node: jobid for jobid, node in enumerate(self.procs)}
+        self._critical_path = zeros(len(self.procs))
+        # self.procs is topologically sorted, so dependents come later
+        for jobid in reversed(range(len(self.procs))):
+            self._critical_path[jobid] = runtimes[jobid] + max((
+                self._critical_path[index[dependent]] for dependent in
+                graph.successors(self.procs[jobid])), default=0)
+        critical_path = max(self._critical_path, default=0)
+        work_bound = sum(runtime * min(node.n_procs, self.processors) for
+                         runtime, node in zip(runtimes, self.procs)
+                         ) / self.processors
+        self.makespan = {
+            'participant': self.procs[0].fullname.split('.', 1)[0] if
+            self.procs else None,
+            'num_nodes': len(self.procs),
+            'predicted_critical_path_seconds': critical_path,
+            'predicted_work_bound_seconds': work_bound,
+            'predicted_makespan_seconds': max(critical_path, work_bound)}
+
+    def _sort_jobs(self, jobids, scheduler='tsort'):
+        """Order ready jobs. With the ``'critical_path'`` scheduler, jobs
+        with the longest estimated remaining critical path come first."""
+        if scheduler == 'critical_path' and self._critical_path is not None:
+            # MapNode subnodes inherit their MapNode's estimate
+            mapnodesubids = self.mapnodesubids or {}
+            return sorted(jobids, key=lambda jobid: -self._critical_path[
+                mapnodesubids.get(jobid, jobid)])
+        return super()._sort_jobs(jobids, scheduler=scheduler)
+
+    def run(self, graph, config, updatehash=False):
+        """Run the graph, then report predicted vs. actual makespan"""
+        start = time.time()
+        try:
+            return super().run(graph, config, updatehash=updatehash)
+        finally:
+            self._report_makespan(config, time.time() - start)
+
+    def _report_makespan(self, config, actual):
+        """Log predicted vs. actual makespan and write it to
+        ``makespan.json`` in the log directory"""
+        if not self.makespan:
+            return
+        self.makespan['actual_makespan_seconds'] = actual
+        logger.info('[%s] Predicted makespan %0.1fs (critical path %0.1fs, '
+                    'work bound %0.1fs), actual %0.1fs for %s.',
+                    type(self).__name__[:-len('Plugin')],
+                    self.makespan['predicted_makespan_seconds'],
+                    self.makespan['predicted_critical_path_seconds'],
+                    self.makespan['predicted_work_bound_seconds'], actual,
+                    self.makespan['participant'])
+        log_dir = config.get('logging', {}).get('log_directory')
+        if log_dir and os.path.isdir(log_dir):
+            try:
+                with open(os.path.join(log_dir, 'makespan.json'), 'w',
+                          encoding='utf-8') as makespan_file:
+                    json.dump(self.makespan, makespan_file, indent=2)
+            except OSError as os_error:
+                logger.warning('Could not write makespan report: %s',
+                               os_error)
+
     def _clean_exception(self, jobid, graph):
         traceback = format_exception(*sys.exc_info())
         self._clean_queue(
@@ -133,19 +238,32 @@ class CpacNipypeCustomPluginMixin():
                                   "traceback": traceback}
         )
 
-    def _override_memory_estimate(self, node):
+    def _override_memory_estimate(self, node, features=None):
         """
         Override node memory estimate with provided runtime memory
         usage, buffered
 
+        If enough nodes of this node's type have been observed, the
+        estimate comes from the memory model of input data size (or the
+        most observed for the node type if ``features`` is ``None``).
+        Otherwise, the estimate comes from the most observed for a node
+        with a matching name.
+
         Parameters
         ----------
         node : nipype.pipeline.engine.nodes.Node
 
+        features : dict or None
+            see :py:func:`CPAC.utils.monitoring.input_data_features`
+
         Returns
         -------
         None
         """
+        model = getattr(self, 'memory_model', None)
+        if model is not None and node.fullname in model:
+            node.override_mem_gb(model.predict(node.fullname, features))
+            return
         if hasattr(node, 'list_node_names'):
             for node_id in node.list_node_names():
                 # drop top-level node name
@@ -159,6 +277,31 @@ class CpacNipypeCustomPluginMixin():
             if self._match_for_overrides(node, node_id):
                 return
 
+    def _model_memory_estimate(self, jobid):
+        """Refine a ready job's memory estimate from the memory model
+        now that the job's inputs exist
+
+        Parameters
+        ----------
+        jobid : int
+
+        Returns
+        -------
+        None
+        """
+        node = self.procs[jobid]
+        if jobid in self._modeled or node.fullname not in self.memory_model:
+            return
+        self._modeled.add(jobid)
+        try:
+            # pylint: disable=protected-access
+            node._get_inputs()
+            features = input_data_features(node.inputs.get())
+        except Exception:  # pylint: disable=broad-except
+            return
+        if features is not None:
+            self._override_memory_estimate(node, features)
+
     def _match_for_overrides(self, node, node_id):
         """Match node memory estimate with provided runtime memory usage key
 
@@ -320,6 +463,8 @@ class CpacNipypeCustomPluginMixin():
                         continue
 
             # Check requirements of this job
+            if hasattr(self, 'memory_model'):
+                self._model_memory_estimate(jobid)
             next_job_gb = min(self.procs[jobid].mem_gb, self.memory_gb)
             next_job_th = min(self.procs[jobid].n_procs, self.processors)
 
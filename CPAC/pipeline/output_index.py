@@ -0,0 +1,284 @@
+# Copyright (C) 2023  C-PAC Developers
+
+# This file is part of C-PAC.
+
+# C-PAC is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# C-PAC is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public
+# License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
+"""Persistent index of the files in a C-PAC pipeline output directory
+
+The index is an SQLite database of every file under the output directory,
+with the output-directory entities the group runners select outputs by
+(``unique_id``, ``resource_id``, ``series`` and ``strat_info``) and the
+BIDS entities of the filename. It is kept in ``.cpac_output_index`` in
+the output directory (or in a temporary directory if the output directory
+is read-only) and refreshed incrementally: a directory is only listed
+again if its modification time changed since it was last indexed.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from CPAC.utils.monitoring.custom_logging import getLogger
+
+INDEX_DIR = '.cpac_output_index'
+INDEX_FILE = 'index.sqlite'
+SCHEMA_VERSION = 1
+logger = getLogger('nipype.workflow')
+
+
+def output_entities(relative_path):
+    """Entities of an output file from its path relative to a pipeline
+    output directory, i.e. ``<unique_id>/<anat|func>/<filename>``
+
+    Parameters
+    ----------
+    relative_path : str
+
+    Returns
+    -------
+    dict
+
+    Examples
+    --------
+    >>> output_entities('sub-1_ses-1/func/'
+    ...                 'sub-1_ses-1_task-rest_space-template_alff.nii.gz')
+    ... # doctest: +NORMALIZE_WHITESPACE
+    {'unique_id': 'sub-1_ses-1', 'resource_id': 'space-template_alff',
+     'series': 'ses-1', 'strat_info': 'task-rest',
+     'entities': {'sub': '1', 'ses': '1', 'task': 'rest',
+                  'space': 'template', 'suffix': 'alff'}}
+    >>> output_entities('log.txt')['resource_id'] is None
+    True
+    """
+    # pylint: disable=import-outside-toplevel
+    from CPAC.utils.bids_utils import bids_entities_from_filename
+    pieces = [piece for piece in relative_path.split('/') if piece]
+    entities = {}
+    for entity in bids_entities_from_filename(pieces[-1]):
+        key, _, value = entity.partition('-')
+        if value:
+            entities[key] = value
+        else:
+            entities['suffix'] = key
+    record = {'unique_id': pieces[0] if len(pieces) > 1 else None,
+              'resource_id': None, 'series': None, 'strat_info': None,
+              'entities': entities}
+    if len(pieces) > 2:
+        # as parsed by CPAC.pipeline.cpac_group_runner.create_output_dict_list
+        record['resource_id'] = '_'.join(
+            pieces[2].split('.')[0].split('_')[3:])
+        series_id_string = pieces[2].split('_')[1:2]
+        record['series'] = (series_id_string[0].replace('_scan_', '')
+                            .replace('_rest', '')
+                            if series_id_string else '')
+        record['strat_info'] = '_'.join(pieces[2].split('_')[2:3])
+    return record
+
+
+class OutputIndex:
+    """Index of the files in a pipeline output directory
+
+    Parameters
+    ----------
+    pipeline_output_folder : str
+
+    index_path : str, optional
+        SQLite database to keep the index in
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> pipeline_dir = tempfile.mkdtemp()
+    >>> func_dir = os.path.join(pipeline_dir, 'sub-1_ses-1', 'func')
+    >>> os.makedirs(func_dir)
+    >>> open(os.path.join(func_dir, 'sub-1_ses-1_task-rest_alff.nii.gz'),
+    ...      'w').close()
+    >>> index = OutputIndex(pipeline_dir)
+    >>> index.refresh()
+    (3, 3)
+    >>> [os.path.relpath(path, pipeline_dir) for path in index.files(
+    ...     ['alff'], ['.nii', '.nii.gz'])]
+    ['sub-1_ses-1/func/sub-1_ses-1_task-rest_alff.nii.gz']
+    """
+    def __init__(self, pipeline_output_folder, index_path=None):
+        self.pipeline_output_folder = os.path.abspath(
+            pipeline_output_folder).rstrip('/')
+        self.index_path = index_path or self._default_index_path()
+        self._connection = sqlite3.connect(self.index_path, timeout=60)
+        self._create_tables()
+
+    def _default_index_path(self):
+        index_dir = os.path.join(self.pipeline_output_folder, INDEX_DIR)
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+        except OSError:
+            index_dir = os.path.join(tempfile.gettempdir(), 'cpac',
+                                     INDEX_DIR)
+            os.makedirs(index_dir, exist_ok=True)
+            return os.path.join(index_dir, hashlib.sha1(
+                self.pipeline_output_folder.encode()).hexdigest() + '.sqlite')
+        return os.path.join(index_dir, INDEX_FILE)
+
+    def _create_tables(self):
+        with self._connection as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                conn.execute('DROP TABLE IF EXISTS files')
+                conn.execute('DROP TABLE IF EXISTS dirs')
+            conn.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY '
+                         'KEY, parent TEXT, mtime_ns INTEGER)')
+            conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY '
+                         'KEY, dir TEXT, unique_id TEXT, resource_id TEXT, '
+                         'series TEXT, strat_info TEXT, entities TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_dir ON files (dir)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_resource_id ON '
+                         'files (resource_id)')
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        """Close the connection to the index"""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def refresh(self):
+        """Bring the index up to date with the output directory in one
+        pass, only listing directories modified since they were indexed
+
+        Returns
+        -------
+        num_dirs : int
+            directories in the output directory
+
+        num_listed : int
+            directories listed in this refresh
+        """
+        root = self.pipeline_output_folder
+        with self._connection as conn:
+            indexed = {}
+            children = {}
+            for path, parent, mtime_ns in conn.execute(
+                    'SELECT path, parent, mtime_ns FROM dirs'):
+                indexed[path] = mtime_ns
+                children.setdefault(parent, []).append(path)
+            # directories modified this recently may still be changing
+            # within the resolution of their mtime, so are listed again
+            # next time
+            recent = time.time_ns() - 2 * 10 ** 9
+            seen = set()
+            listed = 0
+            stack = [root]
+            while stack:
+                path = stack.pop()
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(path)
+                if indexed.get(path) == mtime_ns:
+                    stack.extend(children.get(path, []))
+                    continue
+                listed += 1
+                files = []
+                subdirs = []
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            # as in os.walk, don't follow links to dirs
+                            if (not entry.is_symlink() and
+                                    entry.name != INDEX_DIR):
+                                subdirs.append(entry.path)
+                        else:
+                            files.append(entry.path)
+                conn.execute('DELETE FROM files WHERE dir = ?', (path,))
+                conn.executemany(
+                    'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [self._file_row(filepath, path) for filepath in files])
+                conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                             (path, os.path.dirname(path),
+                              mtime_ns if mtime_ns < recent else -1))
+                stack.extend(subdirs)
+            stale = [(path,) for path in indexed if path not in seen]
+            conn.executemany('DELETE FROM files WHERE dir = ?', stale)
+            conn.executemany('DELETE FROM dirs WHERE path = ?', stale)
+        logger.info('Indexed %s: listed %d of %d directories', root, listed,
+                    len(seen))
+        return len(seen), listed
+
+    def _file_row(self, filepath, dirpath):
+        record = output_entities(
+            filepath[len(self.pipeline_output_folder):])
+        return (filepath, dirpath, record['unique_id'],
+                record['resource_id'], record['series'],
+                record['strat_info'], json.dumps(record['entities']))
+
+    def files(self, resource_ids=None, exts=None):
+        """Paths of indexed files
+
+        Parameters
+        ----------
+        resource_ids : list of str, optional
+            only include these resources
+
+        exts : list of str, optional
+            only include files with these extensions
+
+        Returns
+        -------
+        list of str
+            sorted
+        """
+        return [record['path'] for record in
+                self.records(resource_ids, exts)]
+
+    def records(self, resource_ids=None, exts=None):
+        """Indexed files and their entities
+
+        Parameters
+        ----------
+        resource_ids : list of str, optional
+
+        exts : list of str, optional
+            see :py:meth:`files`
+
+        Returns
+        -------
+        list of dict
+            sorted by path
+        """
+        query = ('SELECT path, unique_id, resource_id, series, strat_info, '
+                 'entities FROM files')
+        params = []
+        if resource_ids is not None:
+            resource_ids = list(resource_ids)
+            query += (' WHERE resource_id IN (' +
+                      ', '.join('?' * len(resource_ids)) + ')')
+            params = resource_ids
+        if exts is not None:
+            exts = tuple('.' + ext.lstrip('.') for ext in exts)
+        records = []
+        for path, unique_id, resource_id, series, strat_info, entities in \
+                self._connection.execute(query + ' ORDER BY path', params):
+            if exts is None or path.endswith(exts):
+                records.append({'path': path, 'unique_id': unique_id,
+                                'resource_id': resource_id,
+                                'series': series, 'strat_info': strat_info,
+                                'entities': json.loads(entities)})
+        return records
@@ -412,13 +412,19 @@ latest_schema = Schema({
                 'random',
                 All(int, Range(min=1, max=np.iinfo(np.int32).max)))),
             'observed_usage': {
-                'callback_log': Maybe(str),
+                'callback_log': Maybe(Any(str, [str])),
                 'buffer': Number,
             },
         },
         'Amazon-AWS': {
             'aws_output_bucket_credentials': Maybe(str),
             's3_encryption': bool1_1,
+            'input_cache': {
+                'path': Maybe(str),
+                'max_size_gb': Maybe(Number),
+                'num_threads': All(int, Range(min=1)),
+                'retries': All(int, Range(min=0)),
+            },
         },
         'Debugging': {
             'verbose': bool1_1,
@@ -1041,6 +1047,7 @@ latest_schema = Schema({
         'memory_allocation': Number,
         'template_specification_file': Maybe(str),
         'degree_centrality': {
+            'using': In({'AFNI', 'C-PAC'}),
             'weight_options': [In(
                 valid_options['centrality']['weight_options']
             )],
@@ -6,3 +6,70 @@ def run_gather_outputs_func(pipeline_out_dir):
                                 None, False, False, get_func=True)
     print(df_dct)
 
+
+
+def _sleep_job(seconds, out_file):
+    import time
+    with open(out_file, 'a') as log:
+        print('start', time.time(), file=log)
+    time.sleep(seconds)
+    with open(out_file, 'a') as log:
+        print('finish', time.time(), file=log)
+
+
+def _failing_job():
+    raise ValueError('bad model')
+
+
+def _long_error_job():
+    raise RuntimeError('x' * 200000)
+
+
+def _exiting_job(code):
+    import sys
+    sys.exit(code)
+
+
+def test_run_group_jobs(tmp_path):
+    import json
+    from CPAC.pipeline.cpac_group_runner import run_group_jobs
+    logs = [str(tmp_path / f'job_{i}.log') for i in range(4)]
+    jobs = [(f'job_{i}', _sleep_job, (0.5, log)) for i, log in
+            enumerate(logs)]
+    jobs.insert(2, ('failing', _failing_job, ()))
+    summary = run_group_jobs(jobs, str(tmp_path), num_parallel=2)
+
+    assert [job['name'] for job in summary] == [
+        'job_0', 'job_1', 'failing', 'job_2', 'job_3']
+    assert [job['exitcode'] for job in summary] == [0, 0, 1, 0, 0]
+    assert 'ValueError: bad model' in summary[2]['error']
+    assert all(job['max_rss_gb'] > 0 for job in summary)
+    with open(tmp_path / 'group_jobs_summary.json') as summary_file:
+        assert json.load(summary_file) == summary
+    with open(tmp_path / 'pid_group.txt') as pid_file:
+        assert len(pid_file.readlines()) == 5
+
+    # no more than 2 jobs ran at once
+    events = []
+    for log in logs:
+        with open(log) as log_file:
+            for line in log_file:
+                event, timestamp = line.split()
+                events.append((float(timestamp), event == 'start'))
+    concurrent = 0
+    for _, started in sorted(events):
+        concurrent += 1 if started else -1
+        assert concurrent <= 2
+
+
+def test_run_group_jobs_reports(tmp_path):
+    """Reports larger than a pipe's buffer don't block their jobs, and jobs
+    that exit keep their own exit codes"""
+    from CPAC.pipeline.cpac_group_runner import run_group_jobs
+    jobs = [('long_error', _long_error_job, ()),
+            ('exit_0', _exiting_job, (0,)), ('exit_3', _exiting_job, (3,))]
+    summary = run_group_jobs(jobs, str(tmp_path), num_parallel=2)
+    assert [job['exitcode'] for job in summary] == [1, 0, 3]
+    assert 'x' * 200000 in summary[0]['error']
+    assert summary[1]['error'] is None
+    assert all(job['cpu_seconds'] is not None for job in summary)
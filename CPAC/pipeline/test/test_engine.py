@@ -154,6 +154,33 @@ def test_build_workflow(pipe_config, bids_dir, test_dir):
 
     wf.run()
 
+def test_get_strats_linked():
+    """Strategies of linked inputs with conflicting variants are skipped,
+    and the rest are in the order of every combination of strategies"""
+    rpool = ResourcePool()
+    for resource, variants in [
+            ('desc-preproc_bold', ['a', 'b']),
+            ('space-bold_desc-brain_mask', ['a', 'b']),
+            ('T1w', [None, None])]:
+        rpool.rpool[resource] = {}
+        for i, variant in enumerate(variants):
+            prov = ['bold:ingress', f'{resource}:node_{i}']
+            json_info = {'CpacProvenance': prov}
+            if variant:
+                json_info['CpacVariant'] = {'fork': [variant]}
+            rpool.rpool[resource][str(prov)] = {'data': (resource, i),
+                                                'json': json_info}
+
+    strats = rpool.get_strats([('desc-preproc_bold',
+                                'space-bold_desc-brain_mask'), 'T1w'])
+    assert [[strat_pool.get_data(resource)[1] for resource in
+             ('desc-preproc_bold', 'space-bold_desc-brain_mask', 'T1w')]
+            for strat_pool in strats.values()] == [
+        [0, 0, 0], [0, 0, 1], [1, 1, 0], [1, 1, 1]]
+    for pipe_idx, strat_pool in strats.items():
+        assert pipe_idx == str(strat_pool.get('json')['CpacProvenance'])
+
+
 # bids_dir = "/Users/steven.giavasis/data/HBN-SI_dataset/rawdata"
 # test_dir = "/test_dir"
 
@@ -67,3 +67,82 @@ def test_Workflow(tmpdir):  # pylint: disable=invalid-name
     out_node = list(out.nodes)[0]
     assert out_node.mem_gb == DEFAULT_MEM_GB + get_data_size(
         example_filepath, 'xyzt') * 0.1
+
+
+def test_memory_model_override(tmpdir):
+    # pylint: disable=import-outside-toplevel
+    import json
+    from CPAC.pipeline.nipype_pipeline_engine.plugins import MultiProcPlugin
+    from CPAC.utils.monitoring import input_data_features
+    example_filepath = os.path.join(data_path, 'example4d.nii.gz')
+    shape = list(get_data_size(example_filepath, mode) for
+                 mode in ('xyz', 't'))
+    for participant in range(3):
+        with open(tmpdir / f'callback_{participant}.log', 'w',
+                  encoding='utf-8') as callback_log:
+            for t in (1, 2, 4):
+                callback_log.write(json.dumps({
+                    'id': f'cpac_sub-{participant}.wf_0.get_sample_data_'
+                          f'{t}',
+                    'runtime_memory_gb': 0.5 + 0.25 * t,
+                    'input_data_shape': [shape[0], 1, 1, t],
+                    'num_image_inputs': 1}) + '\n')
+
+    plugin = MultiProcPlugin(plugin_args={
+        'n_procs': 1, 'memory_gb': 4,
+        'runtime': {'usage': str(tmpdir / 'callback_*.log'), 'buffer': 0}})
+    node = Node(Function(['filepath'], ['filepath'], get_sample_data),
+                name='get_sample_data_9')
+    node.inputs.filepath = example_filepath
+    # pylint: disable=protected-access
+    plugin._override_memory_estimate(node)
+    assert node.mem_gb == pytest.approx(1.5)
+    plugin._override_memory_estimate(
+        node, input_data_features(node.inputs.get()))
+    assert node.mem_gb == pytest.approx(0.5 + 0.25 * shape[1])
+
+    square_node = Node(square, name='square')
+    plugin._override_memory_estimate(square_node)
+    assert square_node.mem_gb == DEFAULT_MEM_GB
+
+
+def test_critical_path_scheduler(tmpdir):
+    # pylint: disable=import-outside-toplevel,protected-access
+    import json
+    import networkx as nx
+    from CPAC.pipeline.nipype_pipeline_engine.plugins import MultiProcPlugin
+    with open(tmpdir / 'callback.log', 'w', encoding='utf-8') as callback_log:
+        callback_log.write(json.dumps({
+            'id': 'cpac_sub-0.wf_0.register_0',
+            'start': '2023-01-01T00:00:00',
+            'finish': '2023-01-01T00:10:00'}) + '\n')
+
+    plugin = MultiProcPlugin(plugin_args={
+        'n_procs': 2, 'memory_gb': 4,
+        'runtime': {'usage': str(tmpdir / 'callback.log'), 'buffer': 0}})
+    graph = nx.DiGraph()
+    # a short chain of three quick nodes and a long registration
+    short = [Node(square, name=f'square_{i}') for i in range(3)]
+    register = Node(square, name='register_2')
+    graph.add_edges_from([(short[0], short[1]), (short[1], short[2])])
+    graph.add_node(register)
+    plugin._generate_dependency_list(graph)
+
+    ready = [plugin.procs.index(node) for node in (short[0], register)]
+    assert plugin._sort_jobs(ready, scheduler='critical_path') == ready[::-1]
+    assert plugin._sort_jobs(ready, scheduler='tsort') == ready
+    assert plugin.makespan['predicted_critical_path_seconds'] == 600
+    assert plugin.makespan['predicted_makespan_seconds'] == 600
+
+    wf = Workflow('example_workflow', base_dir=tmpdir)
+    square_node = Node(square, name='square')
+    square_node.inputs.x = 2
+    wf.add_nodes([square_node])
+    wf.config['logging'] = {'log_directory': str(tmpdir)}
+    wf.run(plugin=MultiProcPlugin(plugin_args={'n_procs': 1,
+                                               'memory_gb': 4}))
+    with open(tmpdir / 'makespan.json', encoding='utf-8') as makespan_file:
+        makespan = json.load(makespan_file)
+    assert makespan['num_nodes'] == 1
+    assert makespan['predicted_makespan_seconds'] == 1
+    assert makespan['actual_makespan_seconds'] > 0
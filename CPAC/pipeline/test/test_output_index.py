@@ -0,0 +1,85 @@
+"""Tests for the pipeline output directory index"""
+import os
+
+import pytest
+
+from CPAC.pipeline.cpac_group_runner import create_output_dict_list, \
+                                            gather_nifti_globs, \
+                                            gather_outputs
+from CPAC.pipeline.output_index import OutputIndex
+
+OUTPUTS = [
+    'sub-{sub}_ses-1/func/sub-{sub}_ses-1_task-rest_space-template_alff.nii.gz',
+    'sub-{sub}_ses-1/func/sub-{sub}_ses-1_task-rest_space-template_'
+    'desc-zstd_alff.nii.gz',
+    'sub-{sub}_ses-1/func/sub-{sub}_ses-1_task-rest_space-template_'
+    'desc-zstd_alff.json',
+    'sub-{sub}_ses-1/anat/sub-{sub}_ses-1_desc-preproc_T1w.nii.gz',
+    'sub-{sub}_ses-1/func/sub-{sub}_ses-1_task-rest_desc-mean_bold.nii.gz']
+
+
+def _age(path):
+    """Make every directory under path look as if it was last modified
+    long ago, so the index trusts their mtimes"""
+    for root, dirs, _ in os.walk(path):
+        for dirname in dirs + ['']:
+            os.utime(os.path.join(root, dirname), (1, 1))
+
+
+@pytest.fixture(name='pipeline_dir')
+def fixture_pipeline_dir(tmp_path):
+    """A pipeline output directory of empty output files"""
+    pipeline_dir = tmp_path / 'pipeline_test'
+    for sub in range(1, 4):
+        for output in OUTPUTS:
+            path = pipeline_dir / output.format(sub=sub)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+    return str(pipeline_dir)
+
+
+def test_gather_outputs_matches_globs(pipeline_dir):
+    """Outputs gathered from the index match those gathered by globbing"""
+    resources = ['space-template_alff', 'space-template_desc-zstd_alff']
+    expected = create_output_dict_list(
+        gather_nifti_globs(pipeline_dir, resources), pipeline_dir,
+        resources)
+    gathered = gather_outputs(pipeline_dir, resources, None, False, False)
+    assert sorted(gathered) == sorted(expected) == [
+        ('space-template_alff', 'task-rest'),
+        ('space-template_desc-zstd_alff', 'task-rest')]
+    for key, rows in expected.items():
+        assert (gathered[key].sort_values('Filepath').to_dict('records') ==
+                sorted(rows, key=lambda row: row['Filepath']))
+    with pytest.raises(Exception, match='No output filepaths found'):
+        gather_outputs(pipeline_dir, ['space-template_reho'], None, False,
+                       False)
+
+
+def test_incremental_refresh(pipeline_dir):
+    """Only modified directories are listed again"""
+    with OutputIndex(pipeline_dir) as index:
+        assert index.refresh() == (10, 10)
+        _age(pipeline_dir)
+        assert index.refresh() == (10, 10)
+        assert index.refresh() == (10, 0)
+
+        new_output = os.path.join(
+            pipeline_dir, 'sub-2_ses-1', 'func',
+            'sub-2_ses-1_task-rest_space-template_reho.nii.gz')
+        open(new_output, 'w').close()
+        os.utime(os.path.dirname(new_output), (2, 2))
+        assert index.refresh() == (10, 1)
+        assert index.files(['space-template_reho']) == [new_output]
+        record, = index.records(['space-template_reho'])
+        assert record['unique_id'] == 'sub-2_ses-1'
+        assert record['entities'] == {'sub': '2', 'ses': '1', 'task': 'rest',
+                                      'space': 'template', 'suffix': 'reho'}
+
+    # a new connection picks up where the last left off
+    os.remove(new_output)
+    os.utime(os.path.dirname(new_output), (3, 3))
+    with OutputIndex(pipeline_dir) as index:
+        assert index.refresh() == (10, 1)
+        assert index.files(['space-template_reho']) == []
+        assert len(index.files(['space-template_alff'], ['nii.gz'])) == 3
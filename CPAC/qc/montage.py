@@ -0,0 +1,376 @@
+# Copyright (C) 2023  C-PAC Developers
+
+# This file is part of C-PAC.
+
+# C-PAC is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# C-PAC is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public
+# License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
+"""Render QC montages of overlays on an underlay
+
+Volumes are loaded once per process, keyed by their content, so the same
+underlay resampled for several derivatives is read once. The slices of
+an underlay shown in each direction are cached with it. Each montage is
+composited into one image per layer and drawn on its own Agg canvas
+without pyplot, so montages can be rendered concurrently in threads.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import os
+from threading import RLock
+
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import nibabel as nb
+import numpy as np
+
+MONTAGE_SHAPE = (3, 6)
+"""Rows and columns of slices in a montage"""
+MONTAGE_DPI = 200
+SLICE_AXES = {'axial': 2, 'sagittal': 0}
+"""Axis of the volume each montage direction slices along"""
+VOLUME_CACHE_SIZE = 4
+"""Volumes kept in memory per process, enough for the underlay and three
+tissue overlays of one montage"""
+_COLORBAR_DERIVATIVES = ('snr', 'reho', 'vmhc', 'sca_', 'alff',
+                         'centrality', 'dr_tempreg')
+_EDGE_OVERLAYS = ('skull_vis', 't1_edge_on_mean_func_in_t1',
+                  'MNI_edge_on_mean_func_mni')
+# held while loading, so concurrent montages sharing a volume load it once
+_cache_lock = RLock()
+# a path to each content key seen, to load the volume from on a cache miss
+_key_paths = {}
+
+
+@lru_cache(maxsize=64)
+def _digest(path, mtime_ns, size):
+    # pylint: disable=unused-argument
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as volume_file:
+        for chunk in iter(lambda: volume_file.read(2 ** 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def content_key(path):
+    """Digest of a file's content, recalculated only when its modification
+    time or size changes
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    str
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return _digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=VOLUME_CACHE_SIZE)
+def _load_volume(key):
+    volume = np.asanyarray(nb.load(_key_paths[key]).dataobj,
+                           dtype=np.float32)
+    volume.flags.writeable = False
+    return volume
+
+
+def load_volume(path):
+    """Load a 3D volume as read-only float32, once per content
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    ndarray
+    """
+    with _cache_lock:
+        return _load_volume(_content_key(path))
+
+
+def _content_key(path):
+    """Content key of a file, remembering where to load it from"""
+    key = content_key(path)
+    _key_paths[key] = path
+    return key
+
+
+def _max_abs(volume):
+    """Largest absolute value in a volume, or 1 if it has none"""
+    with np.errstate(invalid='ignore'):
+        max_ = np.nanmax(np.abs(volume)) if volume.size else np.nan
+    return float(max_) if np.isfinite(max_) and max_ != 0 else 1.0
+
+
+def get_slice(volume, direction, index, shape=None):
+    """One slice of a volume, rotated for display
+
+    Parameters
+    ----------
+    volume : ndarray
+
+    direction : str
+        'axial' or 'sagittal'
+
+    index : int
+
+    shape : tuple, optional
+        crop or pad (with NaN) the slice to this shape, aligned to the top
+        left as when drawn over a slice of this shape
+
+    Returns
+    -------
+    ndarray
+    """
+    axis = SLICE_AXES[direction]
+    if index >= volume.shape[axis]:
+        return np.full(shape, np.nan, dtype=np.float32)
+    slc = np.rot90(volume[(slice(None),) * axis + (index,)]).astype(
+        np.float32)
+    if shape is None or slc.shape == tuple(shape):
+        return slc
+    fitted = np.full(shape, np.nan, dtype=np.float32)
+    rows, cols = (min(slc.shape[0], shape[0]), min(slc.shape[1], shape[1]))
+    fitted[:rows, :cols] = slc[:rows, :cols]
+    return fitted
+
+
+@lru_cache(maxsize=16)
+def _underlay_slices(key, direction):
+    # pylint: disable=import-outside-toplevel
+    from CPAC.qc.utils import determine_start_and_end, get_spacing
+    volume = _load_volume(key)
+    start, end = determine_start_and_end(volume, direction, 0.0001)
+    spacing = max(get_spacing(*MONTAGE_SHAPE[::-1], end - start), 1)
+    indices = tuple(range(start, end, spacing)[:np.prod(MONTAGE_SHAPE)])
+    slices = np.array([get_slice(volume, direction, index) for
+                       index in indices], dtype=np.float32)
+    slices.flags.writeable = False
+    return indices, slices
+
+
+def underlay_slices(underlay, direction):
+    """The slices of an underlay shown in a montage in one direction, and
+    their indices, cached with the underlay
+
+    Parameters
+    ----------
+    underlay : str
+        path to NIfTI image
+
+    direction : str
+        'axial' or 'sagittal'
+
+    Returns
+    -------
+    indices : tuple of int
+
+    slices : ndarray
+        slices × rows × columns, read-only
+    """
+    with _cache_lock:
+        return _underlay_slices(_content_key(underlay), direction)
+
+
+def mosaic(slices, pad=2):
+    """Tile slices into one image of :py:data:`MONTAGE_SHAPE`, row by
+    row, with NaN between and after them
+
+    Parameters
+    ----------
+    slices : sequence of ndarray
+        slices of equal shape
+
+    pad : int, optional
+        pixels between slices
+
+    Returns
+    -------
+    ndarray
+
+    Examples
+    --------
+    >>> mosaic([np.ones((2, 3))] * 7).shape
+    (10, 28)
+    >>> int(np.isfinite(mosaic([np.ones((2, 3))] * 7)).sum())
+    42
+    """
+    nrows, ncols = MONTAGE_SHAPE
+    height, width = np.shape(slices[0])
+    tiled = np.full((nrows * (height + pad) - pad,
+                     ncols * (width + pad) - pad), np.nan, dtype=np.float32)
+    for i, slc in enumerate(slices[:nrows * ncols]):
+        row, col = divmod(i, ncols)
+        tiled[row * (height + pad):row * (height + pad) + height,
+              col * (width + pad):col * (width + pad) + width] = slc
+    return tiled
+
+
+def render_montage(png_name, underlay, layers, colorbar_ticks=None):
+    """Draw a montage on its own Agg canvas and save it
+
+    Parameters
+    ----------
+    png_name : str
+        path to save the montage to
+
+    underlay : ndarray
+        slices of the underlay, see :py:func:`underlay_slices`
+
+    layers : list of tuple
+        ``(slices, cmap name, vmin, vmax)`` for each overlay, drawn in
+        order; zeros and NaNs are transparent
+
+    colorbar_ticks : sequence of float, optional
+        draw a colorbar for the last layer with these ticks
+
+    Returns
+    -------
+    str
+        ``png_name``
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot()
+    axes.set_axis_off()
+    image = None
+    if len(underlay):
+        axes.imshow(mosaic(underlay), cmap=matplotlib.colormaps['Greys_r'])
+        for slices, cmap, vmin, vmax in layers:
+            slices = np.where(slices == 0, np.nan, slices)
+            image = axes.imshow(mosaic(slices),
+                                cmap=matplotlib.colormaps[cmap],
+                                alpha=0.82, vmin=vmin, vmax=vmax)
+    if colorbar_ticks is not None and image is not None:
+        colorbar = fig.colorbar(image, ax=axes, ticks=colorbar_ticks)
+        colorbar.ax.tick_params(labelsize=5)
+    fig.savefig(png_name, dpi=MONTAGE_DPI, bbox_inches='tight')
+    return png_name
+
+
+def make_montage(overlay, underlay, png_name, cbar_name, direction):
+    """Draw a montage of an overlay on an underlay in one direction
+
+    Parameters
+    ----------
+    overlay : str
+        path to NIfTI image
+
+    underlay : str
+        path to NIfTI image
+
+    png_name : str
+        name of the montage to save in the current directory
+
+    cbar_name : str
+        name of the overlay colormap
+
+    direction : str
+        'axial' or 'sagittal'
+
+    Returns
+    -------
+    str
+        path to the montage
+    """
+    indices, slices = underlay_slices(underlay, direction)
+    volume = load_volume(overlay)
+    if 'skull_vis' in png_name:
+        volume = np.where(volume < 20.0, 0, volume)
+    max_ = _max_abs(volume)
+    overlay_slices = np.array([get_slice(volume, direction, index,
+                                         slices.shape[1:]) for
+                               index in indices], dtype=np.float32)
+    if any(edge in png_name for edge in _EDGE_OVERLAYS):
+        overlay_slices[np.nan_to_num(overlay_slices) != 0] = max_
+    vmin = 0 if cbar_name in ('red_to_blue', 'green') else -max_
+
+    colorbar_ticks = None
+    if 'snr' in png_name:
+        colorbar_ticks = np.linspace(0, max_, 8)
+    elif any(derivative in png_name for derivative in _COLORBAR_DERIVATIVES):
+        colorbar_ticks = np.linspace(-max_, max_, 8)
+    return render_montage(os.path.join(os.getcwd(), png_name), slices,
+                          [(overlay_slices, cbar_name, vmin, max_)],
+                          colorbar_ticks)
+
+
+def make_montage_gm_wm_csf(overlay_csf, overlay_wm, overlay_gm, underlay,
+                           png_name, direction):
+    """Draw a montage of CSF, WM and GM maps on an underlay in one
+    direction
+
+    Parameters
+    ----------
+    overlay_csf, overlay_wm, overlay_gm : str
+        paths to NIfTI images
+
+    underlay : str
+        path to NIfTI image
+
+    png_name : str
+        name of the montage to save in the current directory
+
+    direction : str
+        'axial' or 'sagittal'
+
+    Returns
+    -------
+    str
+        path to the montage
+    """
+    indices, slices = underlay_slices(underlay, direction)
+    layers = []
+    for overlay, cmap in ((overlay_csf, 'green'), (overlay_wm, 'blue'),
+                          (overlay_gm, 'red')):
+        volume = load_volume(overlay)
+        tissue = np.array([get_slice(volume, direction, index,
+                                     slices.shape[1:]) for
+                           index in indices], dtype=np.float32)
+        max_ = _max_abs(volume)
+        tissue[np.nan_to_num(tissue) != 0] = max_
+        layers.append((tissue, cmap, 0, max_))
+    return render_montage(os.path.join(os.getcwd(), png_name), slices, layers)
+
+
+def render_montages(montages, max_workers=None):
+    """Render montages concurrently in threads
+
+    Volumes and underlay slices are cached, so each is loaded once
+    however many montages share it.
+
+    Parameters
+    ----------
+    montages : list of tuple
+        ``(function, args)`` for each montage, where ``function`` is
+        :py:func:`make_montage` or :py:func:`make_montage_gm_wm_csf`
+
+    max_workers : int, optional
+        default: one thread per montage up to the number of CPUs
+
+    Returns
+    -------
+    list of str
+        paths to the montages, in the order given
+    """
+    if len(montages) < 2:
+        return [function(*args) for function, args in montages]
+    with ThreadPoolExecutor(max_workers or min(len(montages),
+                                               os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(function, *args) for function, args in
+                   montages]
+        return [future.result() for future in futures]
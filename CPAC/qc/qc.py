@@ -4,8 +4,7 @@ matplotlib.use('Agg', force=True)
 from nipype.interfaces import afni 
 from CPAC.utils.interfaces.function import Function
 from CPAC.qc.utils import (
-    resample_1mm, montage_axial, montage_sagittal,
-    montage_gm_wm_csf_axial, montage_gm_wm_csf_sagittal,
+    resample_1mm, montage_axial_sagittal, montage_gm_wm_csf_axial_sagittal,
     cal_snr_val, gen_histogram, drop_percent, gen_motion_plt,
     gen_plot_png,
     gen_carpet_plt
@@ -55,60 +54,36 @@ def create_montage(wf_name, cbar_name, png_name, mapnode=True):
     wf.connect(inputnode, 'overlay', resample_o, 'file_')
     wf.connect(resample_o, 'new_fname', outputnode, 'resampled_overlay')
 
-    # node for axial montages
+    # node for axial and sagittal montages, rendered together
     if mapnode:
-        montage_a = pe.MapNode(Function(input_names=['overlay',
-                                                     'underlay',
-                                                     'png_name',
-                                                     'cbar_name'],
-                                        output_names=['png_name'],
-                                        function=montage_axial,
-                                        as_module=True),
-                               name='montage_a',
-                               iterfield=['overlay'])
+        montage = pe.MapNode(Function(input_names=['overlay',
+                                                   'underlay',
+                                                   'png_name',
+                                                   'cbar_name'],
+                                      output_names=['axial_png',
+                                                    'sagittal_png'],
+                                      function=montage_axial_sagittal,
+                                      as_module=True),
+                             name='montage',
+                             iterfield=['overlay'])
     else:
-        montage_a = pe.Node(Function(input_names=['overlay',
-                                                  'underlay',
-                                                  'png_name',
-                                                  'cbar_name'],
-                                     output_names=['png_name'],
-                                     function=montage_axial,
-                                     as_module=True),
-                            name='montage_a')
-    montage_a.inputs.cbar_name = cbar_name
-    montage_a.inputs.png_name = png_name + '_a.png'
-
-    wf.connect(resample_u, 'new_fname', montage_a, 'underlay')
-    wf.connect(resample_o, 'new_fname', montage_a, 'overlay')
-
-    # node for sagittal montages
-    if mapnode:
-        montage_s = pe.MapNode(Function(input_names=['overlay',
-                                                     'underlay',
-                                                     'png_name',
-                                                     'cbar_name'],
-                                        output_names=['png_name'],
-                                        function=montage_sagittal,
-                                        as_module=True),
-                               name='montage_s',
-                               iterfield=['overlay'])
-    else:
-        montage_s = pe.Node(Function(input_names=['overlay',
-                                                  'underlay',
-                                                  'png_name',
-                                                  'cbar_name'],
-                                     output_names=['png_name'],
-                                     function=montage_sagittal,
-                                     as_module=True),
-                            name='montage_s')
-    montage_s.inputs.cbar_name = cbar_name
-    montage_s.inputs.png_name = png_name + '_s.png'
-
-    wf.connect(resample_u, 'new_fname', montage_s, 'underlay')
-    wf.connect(resample_o, 'new_fname', montage_s, 'overlay')
-
-    wf.connect(montage_a, 'png_name', outputnode, 'axial_png')
-    wf.connect(montage_s, 'png_name', outputnode, 'sagittal_png')
+        montage = pe.Node(Function(input_names=['overlay',
+                                                'underlay',
+                                                'png_name',
+                                                'cbar_name'],
+                                   output_names=['axial_png',
+                                                 'sagittal_png'],
+                                   function=montage_axial_sagittal,
+                                   as_module=True),
+                          name='montage')
+    montage.inputs.cbar_name = cbar_name
+    montage.inputs.png_name = png_name
+
+    wf.connect(resample_u, 'new_fname', montage, 'underlay')
+    wf.connect(resample_o, 'new_fname', montage, 'overlay')
+
+    wf.connect(montage, 'axial_png', outputnode, 'axial_png')
+    wf.connect(montage, 'sagittal_png', outputnode, 'sagittal_png')
 
     return wf
 
@@ -148,45 +123,28 @@ def create_montage_gm_wm_csf(wf_name, png_name):
     wf.connect(inputNode, 'overlay_gm', resample_o_gm, 'file_')
     wf.connect(inputNode, 'overlay_wm', resample_o_wm, 'file_')
 
-    montage_a = pe.Node(Function(input_names=['overlay_csf',
-                                              'overlay_wm',
-                                              'overlay_gm',
-                                              'underlay',
-                                              'png_name'],
-                                 output_names=['png_name'],
-                                 function=montage_gm_wm_csf_axial,
-                                 as_module=True),
-                        name='montage_a')
-
-
-    wf.connect(resample_u, 'new_fname', montage_a, 'underlay')
-    wf.connect(resample_o_csf, 'new_fname', montage_a, 'overlay_csf')
-    wf.connect(resample_o_gm, 'new_fname', montage_a, 'overlay_gm')
-    wf.connect(resample_o_wm, 'new_fname', montage_a, 'overlay_wm')
-    montage_a.inputs.png_name = png_name + '_a.png'
-
-    montage_s = pe.Node(Function(input_names=['overlay_csf',
-                                              'overlay_wm',
-                                              'overlay_gm',
-                                              'underlay',
-                                              'png_name'],
-                                 output_names=['png_name'],
-                                 function=montage_gm_wm_csf_sagittal,
-                                 as_module=True),
-                        name='montage_s')
-    montage_s.inputs.png_name = png_name + '_s.png'
-
-    wf.connect(resample_u, 'new_fname', montage_s, 'underlay')
-    wf.connect(resample_o_csf, 'new_fname', montage_s, 'overlay_csf')
-    wf.connect(resample_o_gm, 'new_fname', montage_s, 'overlay_gm')
-    wf.connect(resample_o_wm, 'new_fname', montage_s, 'overlay_wm')
+    montage = pe.Node(Function(input_names=['overlay_csf',
+                                            'overlay_wm',
+                                            'overlay_gm',
+                                            'underlay',
+                                            'png_name'],
+                               output_names=['axial_png', 'sagittal_png'],
+                               function=montage_gm_wm_csf_axial_sagittal,
+                               as_module=True),
+                      name='montage')
+    montage.inputs.png_name = png_name
+
+    wf.connect(resample_u, 'new_fname', montage, 'underlay')
+    wf.connect(resample_o_csf, 'new_fname', montage, 'overlay_csf')
+    wf.connect(resample_o_gm, 'new_fname', montage, 'overlay_gm')
+    wf.connect(resample_o_wm, 'new_fname', montage, 'overlay_wm')
 
     wf.connect(resample_u, 'new_fname', outputNode, 'resampled_underlay')
     wf.connect(resample_o_csf, 'new_fname', outputNode, 'resampled_overlay_csf')
     wf.connect(resample_o_wm, 'new_fname', outputNode, 'resampled_overlay_wm')
     wf.connect(resample_o_gm, 'new_fname', outputNode, 'resampled_overlay_gm')
-    wf.connect(montage_a, 'png_name', outputNode, 'axial_png')
-    wf.connect(montage_s, 'png_name', outputNode, 'sagittal_png')
+    wf.connect(montage, 'axial_png', outputNode, 'axial_png')
+    wf.connect(montage, 'sagittal_png', outputNode, 'sagittal_png')
 
     return wf
 
@@ -0,0 +1,92 @@
+"""Tests for rendering QC montages"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+
+import matplotlib.image as mpimg
+import nibabel as nb
+import numpy as np
+import pytest
+
+import CPAC.qc.pipeline  # noqa: F401  # pylint: disable=unused-import
+from CPAC.qc import montage
+from CPAC.qc.utils import montage_axial_sagittal, \
+                          montage_gm_wm_csf_axial_sagittal
+
+
+@pytest.fixture(name='volumes')
+def fixture_volumes(tmp_path):
+    """An underlay, two derivatives and three tissue maps"""
+    rng = np.random.default_rng(0)
+    grid = np.indices((40, 48, 36)).astype(float)
+    brain = (((grid - np.array([20, 24, 18])[:, None, None, None]) /
+              np.array([16, 20, 14])[:, None, None, None]) ** 2).sum(0) < 1
+    paths = {}
+    for name, data in [
+            ('underlay', brain * (100 + rng.random(brain.shape))),
+            ('sub-1_reho', brain * rng.standard_normal(brain.shape)),
+            ('sub-1_alff', brain * rng.random(brain.shape)),
+            ('csf', brain & (grid[0] < 15)), ('wm', brain & (grid[0] > 25)),
+            ('gm', brain & (grid[2] > 25))]:
+        paths[name] = str(tmp_path / f'{name}.nii.gz')
+        nb.Nifti1Image(data.astype(np.float32), np.eye(4)).to_filename(
+            paths[name])
+    return paths
+
+
+def test_montages(monkeypatch, tmp_path, volumes):
+    """Montages render concurrently in both directions, loading each
+    volume once"""
+    monkeypatch.chdir(tmp_path)
+    # pylint: disable=protected-access
+    montage._load_volume.cache_clear()
+    montage._underlay_slices.cache_clear()
+    overlays = [volumes['sub-1_reho'], volumes['sub-1_alff']]
+    axial, sagittal = montage_axial_sagittal(overlays, volumes['underlay'],
+                                             'sca_roi', 'cyan_to_yellow')
+    assert [path.rsplit('/', 1)[-1] for path in axial + sagittal] == [
+        'sub-1_reho_sca_roi_a.png', 'sub-1_alff_sca_roi_a.png',
+        'sub-1_reho_sca_roi_s.png', 'sub-1_alff_sca_roi_s.png']
+    assert montage._load_volume.cache_info().misses == 3
+    assert montage._underlay_slices.cache_info().misses == 2
+
+    indices, slices = montage.underlay_slices(volumes['underlay'], 'axial')
+    assert len(indices) == len(slices) <= 18
+    assert slices.shape[1:] == (48, 40)
+
+    pngs = montage_gm_wm_csf_axial_sagittal(
+        volumes['csf'], volumes['wm'], volumes['gm'], volumes['underlay'],
+        'montage_csf_gm_wm')
+    assert montage._underlay_slices.cache_info().misses == 2
+    for png in [*axial, *sagittal, *pngs]:
+        image = mpimg.imread(png)
+        # the overlays and underlay are drawn, not just the background
+        assert len(np.unique(image.reshape(-1, image.shape[-1]),
+                             axis=0)) > 3
+
+
+def test_render_thread_safe(monkeypatch, tmp_path, volumes):
+    """The same montage rendered in several threads at once is identical"""
+    monkeypatch.chdir(tmp_path)
+    with ThreadPoolExecutor(4) as pool:
+        pngs = list(pool.map(lambda i: montage.make_montage(
+            volumes['sub-1_reho'], volumes['underlay'], f'{i}_reho_a.png',
+            'red_to_blue', 'axial'), range(4)))
+    images = [mpimg.imread(png) for png in pngs]
+    assert all(np.array_equal(images[0], image) for image in images[1:])
+
+
+def test_copies_share_cache(tmp_path, volumes):
+    """Copies of an underlay at different paths are loaded once"""
+    copy = str(tmp_path / 'copy' / 'underlay.nii.gz')
+    os.makedirs(os.path.dirname(copy))
+    shutil.copyfile(volumes['underlay'], copy)
+    # pylint: disable=protected-access
+    montage._load_volume.cache_clear()
+    montage._underlay_slices.cache_clear()
+    assert montage.load_volume(copy) is montage.load_volume(
+        volumes['underlay'])
+    montage.underlay_slices(volumes['underlay'], 'axial')
+    montage.underlay_slices(copy, 'axial')
+    assert montage._load_volume.cache_info().misses == 1
+    assert montage._underlay_slices.cache_info().misses == 1
@@ -18,6 +18,8 @@ from matplotlib.colors import ListedColormap
 from nipype.interfaces import afni
 from CPAC.pipeline import nipype_pipeline_engine as pe
 import nipype.interfaces.utility as util
+from CPAC.qc.montage import make_montage, make_montage_gm_wm_csf, \
+    render_montages
 
 
 def generate_qc_pages(qc_dir):
@@ -512,58 +514,24 @@ def determine_start_and_end(data, direction, percent):
 
     """
 
-    x, y, z = data.shape
-
-    xx1 = 0
-    xx2 = x - 1
-    zz1 = 0
-    zz2 = z - 1
-    total_non_zero_voxels = len(np.nonzero(data.flatten())[0])
-    thresh = percent * float(total_non_zero_voxels)
-    start = None
-    end = None
-
+    thresh = percent * float(np.count_nonzero(data))
+    # nonzero voxels in each slice
     if 'axial' in direction:
-
-        while(zz2 > 0):
-
-            d = len(np.nonzero(data[:, :, zz2].flatten())[0])
-            if float(d) > thresh:
-                break
-
-            zz2 -= 1
-
-        while(zz1 < zz2):
-
-            d = len(np.nonzero(data[:, :, zz1].flatten())[0])
-            if float(d) > thresh:
-                break
-
-            zz1 += 1
-
-        start =  zz1
-        end = zz2
-
+        slice_counts = np.count_nonzero(data, axis=(0, 1))
     else:
-        while(xx2 > 0):
-            d = len(np.nonzero(data[xx2, :, :].flatten())[0])
-            if float(d) > thresh:
-                break
-
-            xx2 -= 1
-
-        while(xx1 < xx2):
+        slice_counts = np.count_nonzero(data, axis=(1, 2))
+    above = np.flatnonzero(slice_counts > thresh)
 
-            d = len(np.nonzero(data[xx1, :, :].flatten())[0])
-            if float(d) > thresh:
-                break
+    end = int(above[-1]) if above.size else 0
+    start = int(above[0]) if above.size and above[0] < end else end
 
-            xx1 += 1
+    return start, end
 
-        start = xx1
-        end = xx2
 
-    return start, end
+def _overlay_png_name(overlay, png_name):
+    """Prefix a montage name with the name of one of several overlays"""
+    fname = os.path.basename(os.path.splitext(os.path.splitext(overlay)[0])[0])
+    return fname + '_' + png_name
 
 
 def montage_axial(overlay, underlay, png_name, cbar_name):
@@ -592,19 +560,11 @@ def montage_axial(overlay, underlay, png_name, cbar_name):
 
     """
 
-    pngs = None
     if isinstance(overlay, list):
-        pngs = []
-        for ov in overlay:
-            fname = os.path.basename(os.path.splitext(os.path.splitext(ov)[0])[0])
-            pngs.append(make_montage_axial(ov, underlay,
-                                           fname + '_' + png_name, cbar_name))
-    else:
-        pngs = make_montage_axial(overlay, underlay, png_name, cbar_name)
-
-    png_name = pngs
-
-    return png_name
+        return render_montages([(make_montage, (
+            ov, underlay, _overlay_png_name(ov, png_name), cbar_name,
+            'axial')) for ov in overlay])
+    return make_montage_axial(overlay, underlay, png_name, cbar_name)
 
 
 def make_montage_axial(overlay, underlay, png_name, cbar_name):
@@ -632,113 +592,8 @@ def make_montage_axial(overlay, underlay, png_name, cbar_name):
     png_name : Path to generated PNG
 
     """
-    import os
-    import matplotlib
-    matplotlib.rcParams.update({'font.size': 5})
-    import matplotlib.cm as cm
-    from mpl_toolkits.axes_grid1 import ImageGrid
-    import matplotlib.pyplot as plt
-    import nibabel as nb
-    import numpy as np
 
-    Y = nb.load(underlay).get_fdata()
-    X = nb.load(overlay).get_fdata()
-    X = X.astype(np.float32)
-    Y = Y.astype(np.float32)
-
-    if 'skull_vis' in png_name:
-        X[X < 20.0] = 0.0
-    if 'skull_vis' in png_name or \
-            't1_edge_on_mean_func_in_t1' in png_name or \
-                'MNI_edge_on_mean_func_mni' in png_name:
-        max_ = np.nanmax(np.abs(X.flatten()))
-        X[X != 0.0] = max_
-
-    z1, z2 = determine_start_and_end(Y, 'axial', 0.0001)
-    spacing = get_spacing(6, 3, z2 - z1)
-    x, y, z = Y.shape
-    fig = plt.figure(1)
-    max_ = np.max(np.abs(Y))
-
-    if ('snr' in png_name) or ('reho' in png_name) or \
-            ('vmhc' in png_name) or ('sca_' in png_name) or \
-            ('alff' in png_name) or ('centrality' in png_name) or \
-            ('dr_tempreg' in png_name):
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode="single", cbar_pad=0.2,
-                         direction="row")
-    else:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, direction="row")
-
-    zz = z1
-    for i in range(6*3):
-        if zz >= z2:
-            break
-        try:
-            im = grid[i].imshow(np.rot90(Y[:, :, zz]), cmap=cm.Greys_r)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "axial montage for {0}\n\nDetails:{1}. This error might occur because of a registration error encountered while using ANTs.\
-                  Please refer to the png image located in your working directory for more insight."
-                  "\n".format(png_name, e))
-            pass
-        zz += spacing
-
-    x, y, z = X.shape
-    X[X == 0.0] = np.nan
-    max_ = np.nanmax(np.abs(X.flatten()))
-
-    zz = z1
-    im = None
-    for i in range(6*3):
-        if zz >= z2:
-            break
-
-        try:
-            if cbar_name == 'red_to_blue':
-                im = grid[i].imshow(np.rot90(X[:, :, zz]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            elif cbar_name == 'green':
-                im = grid[i].imshow(np.rot90(X[:, :, zz]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            else:
-                im = grid[i].imshow(np.rot90(X[:, :, zz]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=- max_, vmax=max_)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "axial montage for {0}\n\nDetails:{1}.This error might occur because of a registration error encountered while using ANTs.\
-                   Please refer to the image located in your working directory for more insight"
-                  "\n".format(png_name, e))
-            pass
-
-        grid[i].axes.get_xaxis().set_visible(False)
-        grid[i].axes.get_yaxis().set_visible(False)
-        zz += spacing
-
-    cbar = grid.cbar_axes[0].colorbar(im)
-
-    if 'snr' in png_name:
-        cbar.ax.set_yticks(np.linspace(0, max_, 8))
-
-    elif ('reho' in png_name) or ('vmhc' in png_name) or \
-            ('sca_' in png_name) or ('alff' in png_name) or \
-            ('centrality' in png_name) or ('dr_tempreg' in png_name):
-        cbar.ax.set_yticks(np.linspace(-max_, max_, 8))
-
-    plt.axis("off")
-    png_name = os.path.join(os.getcwd(), png_name)
-    plt.savefig(png_name, dpi=200, bbox_inches='tight')
-    plt.close()
-
-    matplotlib.rcdefaults()
-
-    return png_name
+    return make_montage(overlay, underlay, png_name, cbar_name, 'axial')
 
 
 def montage_sagittal(overlay, underlay, png_name, cbar_name):
@@ -768,18 +623,11 @@ def montage_sagittal(overlay, underlay, png_name, cbar_name):
 
     """
 
-    pngs = None
-
     if isinstance(overlay, list):
-        pngs = []
-        for ov in overlay:
-            fname = os.path.basename(os.path.splitext(os.path.splitext(ov)[0])[0])
-            pngs.append(make_montage_sagittal(ov, underlay, fname + '_' + png_name, cbar_name))
-    else:
-        pngs = make_montage_sagittal(overlay, underlay, png_name, cbar_name)
-    png_name = pngs
-
-    return png_name
+        return render_montages([(make_montage, (
+            ov, underlay, _overlay_png_name(ov, png_name), cbar_name,
+            'sagittal')) for ov in overlay])
+    return make_montage_sagittal(overlay, underlay, png_name, cbar_name)
 
 
 def make_montage_sagittal(overlay, underlay, png_name, cbar_name):
@@ -807,129 +655,8 @@ def make_montage_sagittal(overlay, underlay, png_name, cbar_name):
     png_name : Path to generated PNG
 
     """
-    import matplotlib
-    import os
-    import numpy as np
 
-    matplotlib.rcParams.update({'font.size': 5})
-
-    try:
-        from mpl_toolkits.axes_grid1 import ImageGrid
-    except:
-        from mpl_toolkits.axes_grid import ImageGrid
-    import matplotlib.cm as cm
-    import matplotlib.pyplot as plt
-    import nibabel as nb
-
-    from mpl_toolkits.axes_grid1 import ImageGrid
-
-    from CPAC.qc.utils import determine_start_and_end, get_spacing
-
-    Y = nb.load(underlay).get_fdata()
-    X = nb.load(overlay).get_fdata()
-    X = X.astype(np.float32)
-    Y = Y.astype(np.float32)
-
-    if 'skull_vis' in png_name:
-        X[X < 20.0] = 0.0
-    if 'skull_vis' in png_name or \
-            't1_edge_on_mean_func_in_t1' in png_name or \
-                'MNI_edge_on_mean_func_mni' in png_name:
-        max_ = np.nanmax(np.abs(X.flatten()))
-        X[X != 0.0] = max_
-
-    x1, x2 = determine_start_and_end(Y, 'sagittal', 0.0001)
-    spacing = get_spacing(6, 3, x2 - x1)
-    x, y, z = Y.shape
-    fig = plt.figure(1)
-    max_ = np.max(np.abs(Y))
-
-    if ('snr' in png_name) or ('reho' in png_name) or \
-            ('vmhc' in png_name) or ('sca_' in png_name) or \
-            ('alff' in png_name) or ('centrality' in png_name) or \
-            ('dr_tempreg' in png_name):
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode="single", cbar_pad=0.5,
-                         direction="row")
-    else:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode=None, direction="row")
-
-    xx = x1
-    for i in range(6*3):
-        if xx >= x2:
-            break
-
-        try:
-            im = grid[i].imshow(np.rot90(Y[xx, :, :]), cmap=cm.Greys_r)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "sagittal montage for {0}\n\nDetails:{1}.This error might occur because of a registration error encountered while using ANTs\
-                   Please refer to the image located in your working directory for more insight"
-                  "\n".format(png_name, e))
-            pass
-
-        grid[i].get_xaxis().set_visible(False)
-        grid[i].get_yaxis().set_visible(False)
-        xx += spacing
-
-    x, y, z = X.shape
-    X[X == 0.0] = np.nan
-    max_ = np.nanmax(np.abs(X.flatten()))
-    xx = x1
-    for i in range(6*3):
-        if xx >= x2:
-            break
-        im = None
-
-        try:
-            if cbar_name == 'red_to_blue':
-                im = grid[i].imshow(np.rot90(X[xx, :, :]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            elif cbar_name == 'green':
-                im = grid[i].imshow(np.rot90(X[xx, :, :]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=0, vmax=max_)
-            else:
-                im = grid[i].imshow(np.rot90(X[xx, :, :]),
-                                    cmap=cm.get_cmap(cbar_name), alpha=0.82,
-                                    vmin=- max_, vmax=max_)
-        except IndexError as e:
-            # TODO: send this to the logger instead
-            print("\n[!] QC Interface: Had a problem with creating the "
-                  "sagittal montage for {0}\n\nDetails:{1}.This error might occur because of a registration error encountered while using ANTs.\
-                   Please refer to the image located in your working directory for more insight"
-                  "\n".format(png_name, e))
-            pass
-
-        xx += spacing
-
-    try:
-        cbar = grid.cbar_axes[0].colorbar(im)
-
-        if 'snr' in png_name:
-            cbar.ax.set_yticks(np.linspace(0, max_, 8))
-        elif ('reho' in png_name) or ('vmhc' in png_name) or \
-                ('sca_' in png_name) or ('alff' in png_name) or \
-                ('centrality' in png_name) or ('dr_tempreg' in png_name):
-            cbar.ax.set_yticks(np.linspace(-max_, max_, 8))
-
-    except AttributeError as e:
-        # TODO: send this to the logger instead
-        print("\n[!] QC Interface: Had a problem with creating the "
-              "sagittal montage for {0}\n\nDetails:{1}"
-              "\n".format(png_name, e))
-        pass
-
-    plt.axis("off")
-    png_name = os.path.join(os.getcwd(), png_name)
-    plt.savefig(png_name, dpi=200, bbox_inches='tight')
-    plt.close()
-    matplotlib.rcdefaults()
-
-    return png_name
+    return make_montage(overlay, underlay, png_name, cbar_name, 'sagittal')
 
 
 def montage_gm_wm_csf_axial(overlay_csf, overlay_wm, overlay_gm, underlay, png_name):
@@ -961,71 +688,9 @@ def montage_gm_wm_csf_axial(overlay_csf, overlay_wm, overlay_gm, underlay, png_n
     png_name : Path to generated PNG
 
     """
-    import numpy as np
-    from mpl_toolkits.axes_grid1 import ImageGrid as ImageGrid
-    import matplotlib.pyplot as plt
-    import nibabel as nb
-    import matplotlib.cm as cm
-
-    Y = nb.load(underlay).get_fdata()
-    z1, z2 = determine_start_and_end(Y, 'axial', 0.0001)
-    spacing = get_spacing(6, 3, z2 - z1)
-    X_csf = nb.load(overlay_csf).get_fdata()
-    X_wm = nb.load(overlay_wm).get_fdata()
-    X_gm = nb.load(overlay_gm).get_fdata()
-    X_csf = X_csf.astype(np.float32)
-    X_wm = X_wm.astype(np.float32)
-    X_gm = X_gm.astype(np.float32)
-    Y = Y.astype(np.float32)
-
-    max_csf = np.nanmax(np.abs(X_csf.flatten()))
-    X_csf[X_csf != 0.0] = max_csf
-    max_wm = np.nanmax(np.abs(X_wm.flatten()))
-    X_wm[X_wm != 0.0] = max_wm
-    max_gm = np.nanmax(np.abs(X_gm.flatten()))
-    X_gm[X_gm != 0.0] = max_gm
-    fig = plt.figure(1)
-
-    try:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                          aspect=True, cbar_mode=None, direction="row")
-    except:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode=None, direction="row")
-
-    zz = z1
-    for i in range(6*3):
-        if zz >= z2:
-            break
-        im = grid[i].imshow(np.rot90(Y[:, :, zz]), cmap=cm.Greys_r)
-        zz += spacing
-
-    x, y, z = X_csf.shape
-    X_csf[X_csf == 0.0] = np.nan
-    X_wm[X_wm == 0.0] = np.nan
-    X_gm[X_gm == 0.0] = np.nan
-
-    zz = z1
-    im = None
-    for i in range(6*3):
-        if zz >= z2:
-            break
-        im = grid[i].imshow(np.rot90(X_csf[:, :, zz]), cmap=cm.get_cmap('green'), alpha=0.82, vmin=0, vmax=max_csf)
-        im = grid[i].imshow(np.rot90(X_wm[:, :, zz]), cmap=cm.get_cmap('blue'), alpha=0.82, vmin=0, vmax=max_wm)
-        im = grid[i].imshow(np.rot90(X_gm[:, :, zz]), cmap=cm.get_cmap('red'), alpha=0.82, vmin=0, vmax=max_gm)
-
-        grid[i].axes.get_xaxis().set_visible(False)
-        grid[i].axes.get_yaxis().set_visible(False)
-        zz += spacing
-
-    cbar = grid.cbar_axes[0].colorbar(im)
-
-    plt.axis("off")
-    png_name = os.path.join(os.getcwd(), png_name)
-    plt.savefig(png_name, dpi=200, bbox_inches='tight')
-    plt.close()
 
-    return png_name
+    return make_montage_gm_wm_csf(overlay_csf, overlay_wm, overlay_gm,
+                                  underlay, png_name, 'axial')
 
 
 def montage_gm_wm_csf_sagittal(overlay_csf, overlay_wm, overlay_gm, underlay, png_name):
@@ -1057,80 +722,89 @@ def montage_gm_wm_csf_sagittal(overlay_csf, overlay_wm, overlay_gm, underlay, pn
 
     """
 
-    import numpy as np
-    from mpl_toolkits.axes_grid1 import ImageGrid as ImageGrid
-    import matplotlib.pyplot as plt
-    import matplotlib.cm as cm
-    import nibabel as nb
+    return make_montage_gm_wm_csf(overlay_csf, overlay_wm, overlay_gm,
+                                  underlay, png_name, 'sagittal')
 
-    Y = nb.load(underlay).get_fdata()
-    x1, x2 = determine_start_and_end(Y, 'sagittal', 0.0001)
-    spacing = get_spacing(6, 3, x2 - x1)
-    X_csf = nb.load(overlay_csf).get_fdata()
-    X_wm = nb.load(overlay_wm).get_fdata()
-    X_gm = nb.load(overlay_gm).get_fdata()
-    X_csf = X_csf.astype(np.float32)
-    X_wm = X_wm.astype(np.float32)
-    X_gm = X_gm.astype(np.float32)
-    Y = Y.astype(np.float32)
-
-    max_csf = np.nanmax(np.abs(X_csf.flatten()))
-    X_csf[X_csf != 0.0] = max_csf
-    max_wm = np.nanmax(np.abs(X_wm.flatten()))
-    X_wm[X_wm != 0.0] = max_wm
-    max_gm = np.nanmax(np.abs(X_gm.flatten()))
-    X_gm[X_gm != 0.0] = max_gm
-    x, y, z = Y.shape
-    fig = plt.figure(1)
-    max_ = np.max(np.abs(Y))
+def montage_axial_sagittal(overlay, underlay, png_name, cbar_name):
+    """
+    Draws Montages using overlay on Anatomical brain in Axial and Sagittal
+    Directions, all at once
 
-    try:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                          aspect=True, cbar_mode=None, direction="row")
-    except:
-        grid = ImageGrid(fig, 111, nrows_ncols=(3, 6), share_all=True,
-                         aspect=True, cbar_mode=None, direction="row")
-
-    zz = x1
-    for i in range(6*3):
-        if zz >= x2:
-            break
-        im = grid[i].imshow(np.rot90(Y[zz, :, :]), cmap=cm.Greys_r)
-        zz += spacing
-
-    x, y, z = X_csf.shape
-    X_csf[X_csf == 0.0] = np.nan
-    X_wm[X_wm == 0.0] = np.nan
-    X_gm[X_gm == 0.0] = np.nan
-
-    zz = x1
-    im = None
-    for i in range(6*3):
-        if zz >= x2:
-            break
-
-        im = grid[i].imshow(np.rot90(X_csf[zz, :, :]),
-                            cmap=cm.get_cmap('green'), alpha=0.82, vmin=0,
-                            vmax=max_csf)
-        im = grid[i].imshow(np.rot90(X_wm[zz, :, :]),
-                            cmap=cm.get_cmap('blue'), alpha=0.82, vmin=0,
-                            vmax=max_wm)
-        im = grid[i].imshow(np.rot90(X_gm[zz, :, :]),
-                            cmap=cm.get_cmap('red'), alpha=0.82, vmin=0,
-                            vmax=max_gm)
-
-        grid[i].axes.get_xaxis().set_visible(False)
-        grid[i].axes.get_yaxis().set_visible(False)
-        zz += spacing
-
-    cbar = grid.cbar_axes[0].colorbar(im)
-
-    plt.axis("off")
-    png_name = os.path.join(os.getcwd(), png_name)
-    plt.savefig(png_name, dpi=200, bbox_inches='tight')
-    plt.close()
+    Parameters
+    ----------
 
-    return png_name
+    overlay : string or list of strings
+            Nifi file(s)
+
+    underlay : string
+            Nifti for Anatomical Brain
+
+    cbar_name : string
+            name of the cbar
+
+    png_name : string
+            Proposed name of the montage plots, without extension
+
+    Returns
+    -------
+
+    axial_png : Path(s) to generated axial PNG(s)
+
+    sagittal_png : Path(s) to generated sagittal PNG(s)
+
+    """
+    overlays = overlay if isinstance(overlay, list) else [overlay]
+    montages = []
+    for direction, suffix in (('axial', '_a.png'), ('sagittal', '_s.png')):
+        for ov in overlays:
+            name = png_name + suffix
+            if isinstance(overlay, list):
+                name = _overlay_png_name(ov, name)
+            montages.append((make_montage, (ov, underlay, name, cbar_name,
+                                            direction)))
+    pngs = render_montages(montages)
+    if isinstance(overlay, list):
+        return pngs[:len(overlays)], pngs[len(overlays):]
+    return tuple(pngs)
+
+
+def montage_gm_wm_csf_axial_sagittal(overlay_csf, overlay_wm, overlay_gm,
+                                     underlay, png_name):
+    """
+    Draws Montages using GM WM and CSF overlays on Anatomical brain in Axial
+    and Sagittal Directions, both at once
+
+    Parameters
+    ----------
+
+    overlay_csf : string
+            Nifi file CSF MAP
+
+    overlay_wm : string
+            Nifti file WM MAP
+
+    overlay_gm : string
+            Nifti file GM MAP
+
+    underlay : string
+            Nifti for Anatomical Brain
+
+    png_name : string
+            Proposed name of the montage plots, without extension
+
+    Returns
+    -------
+
+    axial_png : Path to generated axial PNG
+
+    sagittal_png : Path to generated sagittal PNG
+
+    """
+    return tuple(render_montages([
+        (make_montage_gm_wm_csf, (overlay_csf, overlay_wm, overlay_gm,
+                                  underlay, png_name + suffix, direction))
+        for direction, suffix in (('axial', '_a.png'),
+                                  ('sagittal', '_s.png'))]))
 
 
 def register_pallete(colors_file, cbar_name):
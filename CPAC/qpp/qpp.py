@@ -1,3 +1,5 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import nibabel as nib
 import os
@@ -34,14 +36,127 @@ def normalize_segment(segment, df):
     return segment
 
 
+def window_norms(data, window_length):
+    """
+    Norm of every mean-centered window of the data, from running sums of
+    the data and its square over time.
+    """
+    column_sums = np.concatenate([[0], np.cumsum(data.sum(axis=0))])
+    column_squares = np.concatenate([[0], np.cumsum((data ** 2).sum(axis=0))])
+
+    window_sums = column_sums[window_length:] - column_sums[:-window_length]
+    window_squares = column_squares[window_length:] - \
+        column_squares[:-window_length]
+
+    df = data.shape[0] * window_length
+    return np.sqrt(np.clip(window_squares - window_sums ** 2 / df, 0, None))
+
+
+def window_correlations(template, data_fft, norms):
+    """
+    Correlation of a normalized (voxels, window_length) template with every
+    window of the data, as one cross-correlation against the precomputed
+    FFT of the data.
+    """
+    trs = len(norms) + template.shape[1] - 1
+    template_fft = np.fft.rfft(template, n=trs, axis=1)
+    xcorr = np.fft.irfft(np.einsum('vf,vf->f', np.conj(template_fft),
+                                   data_fft), n=trs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return xcorr[:len(norms)] / norms
+
+
+def normalize_template(template):
+    template = template - template.mean()
+    return template / np.sqrt(np.sum(template ** 2))
+
+
+# per-process state of the dataset being searched, set by `_init_qpp`
+_qpp = {}
+
+
+def _init_qpp(data, window_length, inpectable_trs, correlation_thresholds,
+              convergence_iterations):
+    # the correlations are invariant to a constant offset of the data, and
+    # centering keeps the running sums of `window_norms` well conditioned
+    data = data - data.mean()
+    _qpp.update({
+        'data': data,
+        'data_fft': np.fft.rfft(data, axis=1),
+        'norms': window_norms(data, window_length),
+        'window_length': window_length,
+        'inpectable_trs': inpectable_trs,
+        'correlation_thresholds': correlation_thresholds,
+        'convergence_iterations': convergence_iterations,
+    })
+
+
+def _qpp_permutation(initial_tr):
+
+    data = _qpp['data']
+    window_length = _qpp['window_length']
+    inpectable_trs = _qpp['inpectable_trs']
+    convergence_iterations = _qpp['convergence_iterations']
+
+    trs = data.shape[1]
+
+    def correlate(template):
+        correlations = window_correlations(normalize_template(template),
+                                           _qpp['data_fft'], _qpp['norms'])
+        return correlations[inpectable_trs]
+
+    template_holder = np.zeros(trs)
+    template_holder[inpectable_trs] = correlate(
+        data[:, initial_tr:initial_tr + window_length])
+
+    template_holder_convergence = np.zeros((convergence_iterations, trs))
+
+    for iteration, peak_threshold in enumerate(_qpp['correlation_thresholds']):
+
+        peaks, _ = find_peaks(template_holder, height=peak_threshold, distance=window_length)
+        peaks = np.delete(peaks, np.where(~np.isin(peaks, inpectable_trs))[0])
+
+        template_holder = smooth(template_holder)
+
+        found_peaks = np.size(peaks)
+        if found_peaks < 1:
+            break
+
+        peaks_segments = np.zeros((data.shape[0], window_length))
+        for peak in peaks:
+            peaks_segments += data[:, peak:peak + window_length]
+
+        template_holder[inpectable_trs] = correlate(peaks_segments)
+
+        if np.all(correlation(template_holder, template_holder_convergence) > 0.9999):
+            break
+
+        if convergence_iterations > 1:
+            template_holder_convergence[1:] = template_holder_convergence[0:-1]
+        template_holder_convergence[0] = template_holder
+
+    if found_peaks > 1:
+        return {
+            'template': template_holder,
+            'peaks': peaks,
+            'final_iteration': iteration,
+            'correlation_score': np.sum(template_holder[peaks]),
+        }
+    return {}
+
+
 def detect_qpp(data, num_scans, window_length,
                permutations, correlation_threshold, 
                iterations, convergence_iterations=1,
-               random_state=None):
+               random_state=None, n_procs=1):
     """
     This code is adapted from the paper "Quasi-periodic patterns (QP): Large-
     scale dynamics in resting state fMRI that correlate with local infraslow
     electrical activity", Shella Keilholz et al. NeuroImage, 2014.
+
+    The correlation of a template with every window of the data is computed
+    as a single FFT cross-correlation, normalized by running window sums
+    computed once per dataset. Permutations run in `n_procs` processes.
     """
 
     random_state = check_random_state(random_state)
@@ -59,60 +174,24 @@ def detect_qpp(data, num_scans, window_length,
     trs_per_scan = int(trs / num_scans)
     inpectable_trs = np.arange(trs) % trs_per_scan
     inpectable_trs = np.where(inpectable_trs < trs_per_scan - window_length + 1)[0]
-
-    df = voxels * window_length
+    # a window cannot run past the end of the data
+    inpectable_trs = inpectable_trs[inpectable_trs <= trs - window_length]
 
     initial_trs = random_state.choice(inpectable_trs, permutations)
 
-    permutation_result = [{} for _ in range(permutations)]
-    for perm in range(permutations):
-
-        template_holder = np.zeros(trs)
-        random_initial_window = normalize_segment(flattened_segment(data, window_length, initial_trs[perm]), df)
-        for tr in inpectable_trs:
-            scan_window = normalize_segment(flattened_segment(data, window_length, tr), df)
-            template_holder[tr] = np.dot(random_initial_window, scan_window)
+    qpp_args = (data, window_length, inpectable_trs, correlation_thresholds,
+                convergence_iterations)
 
-        template_holder_convergence = np.zeros((convergence_iterations, trs))
-
-        for iteration in range(iterations):
-
-            peak_threshold = correlation_thresholds[iteration]
-
-            peaks, _ = find_peaks(template_holder, height=peak_threshold, distance=window_length)
-            peaks = np.delete(peaks, np.where(~np.isin(peaks, inpectable_trs))[0])
-
-            template_holder = smooth(template_holder)
-
-            found_peaks = np.size(peaks)
-            if found_peaks < 1:
-                break
-
-            peaks_segments = flattened_segment(data, window_length, peaks[0])
-            for peak in peaks[1:]:
-                peaks_segments = peaks_segments + flattened_segment(data, window_length, peak)
-
-            peaks_segments = peaks_segments / found_peaks
-            peaks_segments = normalize_segment(peaks_segments, df)
-
-            for tr in inpectable_trs:
-                scan_window = normalize_segment(flattened_segment(data, window_length, tr), df)
-                template_holder[tr] = np.dot(peaks_segments, scan_window)
-
-            if np.all(correlation(template_holder, template_holder_convergence) > 0.9999):
-                break
-
-            if convergence_iterations > 1:
-                template_holder_convergence[1:] = template_holder_convergence[0:-1]
-            template_holder_convergence[0] = template_holder
-
-        if found_peaks > 1:
-            permutation_result[perm] = {
-                'template': template_holder,
-                'peaks': peaks,
-                'final_iteration': iteration,
-                'correlation_score': np.sum(template_holder[peaks]),
-            }
+    if n_procs > 1:
+        with ProcessPoolExecutor(max_workers=n_procs,
+                                 initializer=_init_qpp,
+                                 initargs=qpp_args) as pool:
+            permutation_result = list(pool.map(_qpp_permutation,
+                                               initial_trs))
+    else:
+        _init_qpp(*qpp_args)
+        permutation_result = list(map(_qpp_permutation, initial_trs))
+        _qpp.clear()
 
     # Retrieve max correlation of template from permutations
     correlation_scores = np.array([
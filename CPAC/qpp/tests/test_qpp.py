@@ -57,4 +57,26 @@ def test_qpp():
     for xc in best_selected_peaks:
         plt.axvline(x=xc, color='r')
     plt.legend()
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+def test_window_correlations():
+    from CPAC.qpp.qpp import (flattened_segment, normalize_segment,
+                              normalize_template, window_correlations,
+                              window_norms)
+
+    voxels, trs, window_length = 50, 80, 7
+    data = np.random.RandomState(0).normal(size=(voxels, trs))
+    template = data[:, 30:30 + window_length]
+    df = voxels * window_length
+
+    correlations = window_correlations(normalize_template(template),
+                                       np.fft.rfft(data, axis=1),
+                                       window_norms(data, window_length))
+
+    template = normalize_segment(template.flatten(order='F'), df)
+    expected = [
+        np.dot(template, normalize_segment(
+            flattened_segment(data, window_length, tr), df))
+        for tr in range(trs - window_length + 1)
+    ]
+    assert np.allclose(correlations, expected)
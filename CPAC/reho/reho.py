@@ -96,7 +96,8 @@ def create_reho(wf_name):
 
     reho_imports = ['import os', 'import sys', 'import nibabel as nb',
                     'import numpy as np',
-                    'from CPAC.reho.utils import f_kendall']
+                    'from CPAC.reho.utils import cluster_offsets, '
+                    'tied_ranks']
     raw_reho_map = pe.Node(util.Function(input_names=['in_file', 'mask_file',
                                                       'cluster_size'],
                                          output_names=['out_file'],
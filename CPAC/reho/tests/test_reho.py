@@ -0,0 +1,42 @@
+import os
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+from CPAC.reho.utils import cluster_offsets, compute_reho, f_kendall, \
+                            tied_ranks
+
+
+def test_tied_ranks():
+    ranks = tied_ranks(np.array([[3., 1., 1., 2.],
+                                 [5., 5., 5., 0.]]))
+    np.testing.assert_array_equal(ranks, [[3, 1, 1, 2],
+                                          [2, 2, 2, 0]])
+
+
+@pytest.mark.parametrize('cluster_size', [7, 19, 27])
+def test_compute_reho(tmpdir, cluster_size):
+    os.chdir(tmpdir)
+    rng = np.random.default_rng(42)
+    data = rng.integers(0, 5, (8, 7, 6, 20)).astype(np.float32)
+    mask = (rng.random((8, 7, 6)) > 0.25).astype(np.float32)
+    nb.Nifti1Image(data, np.eye(4)).to_filename('bold.nii.gz')
+    nb.Nifti1Image(mask, np.eye(4)).to_filename('mask.nii.gz')
+
+    reho = nb.load(compute_reho('bold.nii.gz', 'mask.nii.gz',
+                                cluster_size, chunk_size=11)).get_fdata()
+
+    assert cluster_offsets(cluster_size).shape == (cluster_size, 3)
+
+    # compare against KCC computed one voxel at a time
+    ranks = tied_ranks(data.reshape(-1, 20)).reshape(data.shape).astype(int)
+    expected = np.zeros(mask.shape)
+    for i, j, k in np.argwhere(mask[1:-1, 1:-1, 1:-1]) + 1:
+        neighbors = [(i + x, j + y, k + z) for x, y, z in
+                     cluster_offsets(cluster_size)
+                     if mask[i + x, j + y, k + z]]
+        expected[i, j, k] = f_kendall(np.array([ranks[n] for n in
+                                                neighbors]).T)
+
+    np.testing.assert_allclose(reho, expected)
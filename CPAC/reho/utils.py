@@ -1,3 +1,7 @@
+import os
+
+import nibabel as nb
+import numpy as np
 
 
 def getOpString(mean, std_dev):
@@ -67,211 +71,163 @@ def f_kendall(timeseries_matrix):
     return kcc
 
 
-def compute_reho(in_file, mask_file, cluster_size):
+def tied_ranks(timeseries_matrix, chunk_size=16384):
 
     """
-    Computes the ReHo Map, by computing tied ranks of the timepoints,
-    followed by computing Kendall's coefficient concordance(KCC) of a
-    timeseries with its neighbours
+    Ranks the timepoints of every row of a (voxels, timepoints) matrix at
+    once, assigning tied values the ceiling of their average zero-based
+    rank
 
     Parameters
     ----------
 
-    in_file : nifti file
-        4D EPI File
-
-    mask_file : nifti file
-        Mask of the EPI File(Only Compute ReHo of voxels in the mask)
-
-    cluster_size : integer
-        for a brain voxel the number of neighbouring brain voxels to use for
-        KCC.
+    timeseries_matrix : ndarray
+        A (voxels, timepoints) matrix of timeseries
 
+    chunk_size : integer
+        number of voxels ranked per call, to bound temporary memory
 
     Returns
     -------
 
-    out_file : nifti file
-        ReHo map of the input EPI image
+    ranks : ndarray
+        float32 (voxels, timepoints) matrix of tied ranks
 
     """
 
-    out_file = None
+    import numpy as np
+    from scipy.stats import rankdata
 
-    res_fname = (in_file)
-    res_mask_fname = (mask_file)
-    CUTNUMBER = 10
+    ranks = np.empty(timeseries_matrix.shape, dtype=np.float32)
 
-    if not (cluster_size == 27 or cluster_size == 19 or cluster_size == 7):
-        cluster_size = 27
+    for start in range(0, timeseries_matrix.shape[0], chunk_size):
+        stop = start + chunk_size
+        ranks[start:stop] = np.ceil(rankdata(timeseries_matrix[start:stop],
+                                             method='average', axis=1) - 1)
 
-    nvoxel = cluster_size
+    return ranks
 
-    res_img = nb.load(res_fname)
-    res_mask_img = nb.load(res_mask_fname)
 
-    res_data = res_img.get_fdata()
-    res_mask_data = res_mask_img.get_fdata()
+def cluster_offsets(cluster_size):
 
-    print(res_data.shape)
-    (n_x, n_y, n_z, n_t) = res_data.shape
+    """
+    Returns the (x, y, z) offsets of a 7, 19 or 27 voxel neighbourhood
+
+    Parameters
+    ----------
 
-    # "flatten" each volume of the timeseries into one big array instead of
-    # x,y,z - produces (timepoints, N voxels) shaped data array
-    res_data = np.reshape(res_data, (n_x*n_y*n_z, n_t), order='F').T
+    cluster_size : integer
+        number of voxels in the neighbourhood, including the centre voxel
 
-    # create a blank array of zeroes of size n_voxels, one for each time point
-    Ranks_res_data = np.tile((np.zeros((1, (res_data.shape)[1]))),
-                             [(res_data.shape)[0], 1])
+    Returns
+    -------
 
-    # divide the number of total voxels by the cutnumber (set to 10)
-    # ex. end up with a number in the thousands if there are tens of thousands
-    # of voxels
-    segment_length = np.ceil(float((res_data.shape)[1])/float(CUTNUMBER))
+    offsets : ndarray
+        (cluster_size, 3) integer array of offsets from the centre voxel
 
-    for icut in range(0, CUTNUMBER):
+    """
 
-        segment = None
+    import numpy as np
 
-        # create a Numpy array of evenly spaced values from the segment
-        # starting point up until the segment_length integer
-        if not (icut == (CUTNUMBER - 1)):
-            segment = np.array(np.arange(icut * segment_length,
-                                         (icut+1) * segment_length))
-        else:
-            segment = np.array(np.arange(icut * segment_length,
-                                         (res_data.shape[1])))
+    offsets = np.array([(i, j, k) for k in (-1, 0, 1)
+                        for j in (-1, 0, 1) for i in (-1, 0, 1)])
+    distance = np.abs(offsets).sum(1)
 
-        segment = np.int64(segment[np.newaxis])
+    if cluster_size == 19:
+        # drop the 8 corners
+        offsets = offsets[distance < 3]
+    elif cluster_size == 7:
+        # keep the centre and the 6 face neighbours
+        offsets = offsets[distance < 2]
 
-        # res_data_piece is a chunk of the original timeseries in_file, but
-        # aligned with the current segment index spacing
-        res_data_piece = res_data[:, segment[0]]
-        nvoxels_piece = res_data_piece.shape[1]
+    return offsets
 
-        # run a merge sort across the time axis, re-ordering the flattened
-        # volume voxel arrays
-        res_data_sorted = np.sort(res_data_piece, 0, kind='mergesort')
-        sort_index = np.argsort(res_data_piece, axis=0, kind='mergesort')
 
-        # subtract each volume from each other
-        db = np.diff(res_data_sorted, 1, 0)
+def compute_reho(in_file, mask_file, cluster_size, chunk_size=16384):
 
-        # convert any zero voxels into "True" flag
-        db = db == 0
+    """
+    Computes the ReHo Map, by computing tied ranks of the timepoints,
+    followed by computing Kendall's coefficient concordance(KCC) of a
+    timeseries with its neighbours
 
-        # return an n_voxel (n voxels within the current segment) sized array
-        # of values, each value being the sum total of TRUE values in "db"
-        sumdb = np.sum(db, 0)
+    Ranks are computed once for every voxel in the mask, and Kendall's
+    coefficient is evaluated for blocks of ``chunk_size`` voxels at a time
+    by gathering the ranks of each neighbour offset in the cluster.
 
-        temp_array = np.array(np.arange(0, n_t))
-        temp_array = temp_array[:, np.newaxis]
+    Parameters
+    ----------
 
-        sorted_ranks = np.tile(temp_array, [1, nvoxels_piece])
+    in_file : nifti file
+        4D EPI File
 
-        if np.any(sumdb[:]):
+    mask_file : nifti file
+        Mask of the EPI File(Only Compute ReHo of voxels in the mask)
 
-            tie_adjust_index = np.flatnonzero(sumdb)
+    cluster_size : integer
+        for a brain voxel the number of neighbouring brain voxels to use for
+        KCC.
 
-            for i in range(0, len(tie_adjust_index)):
+    chunk_size : integer
+        number of voxels processed at once, to bound memory
 
-                ranks = sorted_ranks[:, tie_adjust_index[i]]
 
-                ties = db[:, tie_adjust_index[i]]
+    Returns
+    -------
 
-                tieloc = np.append(np.flatnonzero(ties), n_t + 2)
-                maxties = len(tieloc)
-                tiecount = 0
+    out_file : nifti file
+        ReHo map of the input EPI image
 
-                while(tiecount < maxties -1):
-                    tiestart = tieloc[tiecount]
-                    ntied = 2
-                    while(tieloc[tiecount + 1] == (tieloc[tiecount] + 1)):
-                        tiecount += 1
-                        ntied += 1
+    """
 
-                    ranks[tiestart:tiestart + ntied] = np.ceil(np.float32(np.sum(ranks[tiestart:tiestart + ntied ]))/np.float32(ntied))
-                    tiecount += 1
+    out_file = None
 
-                sorted_ranks[:, tie_adjust_index[i]] = ranks
+    if not (cluster_size == 27 or cluster_size == 19 or cluster_size == 7):
+        cluster_size = 27
 
-        del db, sumdb
-        sort_index_base = np.tile(np.multiply(np.arange(0, nvoxels_piece), n_t), [n_t, 1])
-        sort_index += sort_index_base
-        del sort_index_base
+    res_img = nb.load(in_file)
+    res_mask_img = nb.load(mask_file)
 
-        ranks_piece = np.zeros((n_t, nvoxels_piece))
+    res_mask_data = res_mask_img.get_fdata()
+    (n_x, n_y, n_z, n_t) = res_img.shape
 
-        ranks_piece = ranks_piece.flatten(order='F')
-        sort_index = sort_index.flatten(order='F')
-        sorted_ranks = sorted_ranks.flatten(order='F')
+    # only voxels inside the mask can contribute to a neighbourhood, so rank
+    # just those; the extra last row of zeros stands in for voxels outside
+    # the mask
+    in_mask = res_mask_data > 0
+    n_mask = int(in_mask.sum())
+    ranks = np.zeros((n_mask + 1, n_t), dtype=np.float32)
+    ranks[:n_mask] = tied_ranks(np.asanyarray(res_img.dataobj)[in_mask],
+                                chunk_size)
 
-        ranks_piece[sort_index] = np.array(sorted_ranks)
+    lookup = np.full((n_x, n_y, n_z), n_mask, dtype=np.int64)
+    lookup[in_mask] = np.arange(n_mask)
 
-        ranks_piece = np.reshape(ranks_piece, (n_t, nvoxels_piece), order='F')
+    # KCC is computed for every non-border voxel whose mask value is nonzero
+    centers = np.trunc(res_mask_data) != 0
+    centers[[0, -1], :, :] = False
+    centers[:, [0, -1], :] = False
+    centers[:, :, [0, -1]] = False
+    centers = np.argwhere(centers)
 
-        del sort_index, sorted_ranks
+    offsets = cluster_offsets(cluster_size)
 
-        Ranks_res_data[:, segment[0]] = ranks_piece
+    K = np.zeros((n_x, n_y, n_z))
 
-        sys.stdout.write('.')
+    for start in range(0, centers.shape[0], chunk_size):
+        center = centers[start:start + chunk_size]
+        sr = np.zeros((center.shape[0], n_t))
+        k = np.zeros(center.shape[0])
 
-    Ranks_res_data = np.reshape(Ranks_res_data, (n_t, n_x, n_y, n_z), order='F')
+        for offset in offsets:
+            neighbor = lookup[tuple((center + offset).T)]
+            sr += ranks[neighbor]
+            k += neighbor < n_mask
 
-    K = np.zeros((n_x, n_y, n_z))
+        s = np.sum(np.power(sr, 2), 1) - n_t*np.power(np.mean(sr, 1), 2)
 
-    mask_cluster = np.ones((3, 3, 3))
-
-    if nvoxel == 19:
-        mask_cluster[0, 0, 0] = 0
-        mask_cluster[0, 2, 0] = 0
-        mask_cluster[2, 0, 0] = 0
-        mask_cluster[2, 2, 0] = 0
-        mask_cluster[0, 0, 2] = 0
-        mask_cluster[0, 2, 2] = 0
-        mask_cluster[2, 0, 2] = 0
-        mask_cluster[2, 2, 2] = 0
-
-    elif nvoxel == 7:
-
-        mask_cluster[0, 0, 0] = 0
-        mask_cluster[0, 1, 0] = 0
-        mask_cluster[0, 2, 0] = 0
-        mask_cluster[0, 0, 1] = 0
-        mask_cluster[0, 2, 1] = 0
-        mask_cluster[0, 0, 2] = 0
-        mask_cluster[0, 1, 2] = 0
-        mask_cluster[0, 2, 2] = 0
-        mask_cluster[1, 0, 0] = 0
-        mask_cluster[1, 2, 0] = 0
-        mask_cluster[1, 0, 2] = 0
-        mask_cluster[1, 2, 2] = 0
-        mask_cluster[2, 0, 0] = 0
-        mask_cluster[2, 1, 0] = 0
-        mask_cluster[2, 2, 0] = 0
-        mask_cluster[2, 0, 1] = 0
-        mask_cluster[2, 2, 1] = 0
-        mask_cluster[2, 0, 2] = 0
-        mask_cluster[2, 1, 2] = 0
-        mask_cluster[2, 2, 2] = 0
-
-    for i in range(1, n_x - 1):
-        for j in range(1, n_y -1):
-            for k in range(1, n_z -1):
-
-                block = Ranks_res_data[:, i-1:i+2, j-1:j+2, k-1:k+2]
-                mask_block = res_mask_data[i-1:i+2, j-1:j+2, k-1:k+2]
-
-                if not(int(mask_block[1, 1, 1]) == 0):
-
-                    if nvoxel == 19 or nvoxel == 7:
-                        mask_block = np.multiply(mask_block, mask_cluster)
-
-                    R_block = np.reshape(block, (block.shape[0], 27),
-                                         order='F')
-                    mask_R_block = R_block[:, np.argwhere(np.reshape(mask_block, (1, 27), order='F') > 0)[:, 1]]
-
-                    K[i, j, k] = f_kendall(mask_R_block)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            K[tuple(center.T)] = 12 * s/np.power(k, 2)/(np.power(n_t, 3) -
+                                                        n_t)
 
     img = nb.Nifti1Image(K, header=res_img.header,
                          affine=res_img.affine)
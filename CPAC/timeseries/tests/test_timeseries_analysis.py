@@ -0,0 +1,106 @@
+import csv
+import os
+
+import nibabel as nb
+import numpy as np
+
+from CPAC.timeseries.timeseries_analysis import gen_roi_timeseries, \
+                                              gen_voxel_timeseries, \
+                                              get_voxel_timeseries
+
+
+def test_gen_roi_timeseries(tmpdir):
+    os.chdir(tmpdir)
+    rng = np.random.default_rng(42)
+    data = rng.random((6, 5, 4, 30)).astype(np.float32)
+    atlases = {'atlas_a': rng.integers(0, 5, (6, 5, 4)),
+               'atlas_b': rng.integers(0, 3, (6, 5, 4)) * 10}
+    nb.Nifti1Image(data, np.eye(4)).to_filename('bold.nii.gz')
+    for name, atlas in atlases.items():
+        nb.Nifti1Image(atlas.astype(np.float32),
+                       np.eye(4)).to_filename(name + '.nii.gz')
+
+    outputs = gen_roi_timeseries('bold.nii.gz',
+                                 [name + '.nii.gz' for name in atlases],
+                                 [True, True], chunk_size=7)
+
+    for (name, atlas), (oneD_file, csv_file, npz_file) in zip(
+            atlases.items(), outputs):
+        labels = [n for n in np.unique(atlas) if n > 0]
+        expected = np.array([data[atlas == n].mean(axis=0)
+                             for n in labels])
+
+        with open(oneD_file) as f:
+            assert f.readline().strip() == ','.join(
+                '#{0}'.format(n) for n in labels)
+        np.testing.assert_allclose(
+            np.loadtxt(oneD_file, delimiter=',', skiprows=1, ndmin=2).T,
+            expected, atol=1e-6)
+
+        csv = np.loadtxt(csv_file, delimiter=',', skiprows=1, ndmin=2)
+        np.testing.assert_array_equal(csv[:, 0], labels)
+        np.testing.assert_allclose(csv[:, 1:], expected, atol=1e-6)
+
+        npz = np.load(npz_file)
+        np.testing.assert_array_equal(npz['roi_numbers'], labels)
+        np.testing.assert_allclose(npz['roi_data'], expected, atol=1e-6)
+
+    assert gen_roi_timeseries('bold.nii.gz', 'atlas_a.nii.gz') == \
+        os.path.abspath('roi_atlas_a.1D')
+
+
+def test_gen_voxel_timeseries(tmpdir):
+    os.chdir(tmpdir)
+    rng = np.random.default_rng(42)
+    affine = np.diag([2., 3., 4., 1.])
+    affine[:3, 3] = [-10., 5., 20.]
+    data = rng.random((6, 5, 4, 30)).astype(np.float32)
+    mask = rng.random((6, 5, 4)) > 0.5
+    bold = nb.Nifti1Image(data, affine)
+    bold.set_qform(affine)
+    bold.to_filename('bold.nii.gz')
+    nb.Nifti1Image(mask.astype(np.float32), affine).to_filename(
+        'mask.nii.gz')
+
+    oneD_file, npy_file, coords_file, csv_file = gen_voxel_timeseries(
+        'bold.nii.gz', 'mask.nii.gz', [True, True], chunk_size=7)
+
+    expected = data[mask].T
+    expected_coords = [np.dot(affine, list(ijk) + [1])[:3]
+                       for ijk in np.argwhere(mask)]
+    np.testing.assert_allclose(np.loadtxt(oneD_file),
+                               expected.mean(axis=1), atol=1e-6)
+    np.testing.assert_array_equal(np.load(npy_file), expected)
+    np.testing.assert_allclose(np.load(coords_file), expected_coords)
+
+    with open(csv_file) as f:
+        header = next(csv.reader(f))
+    assert header[0] == 'volume/xyz'
+    assert header[1:] == [str(tuple(xyz)) for xyz in
+                          np.array(expected_coords).tolist()]
+    rows = np.loadtxt(csv_file, delimiter=',', skiprows=1)
+    np.testing.assert_array_equal(rows[:, 0], np.arange(30))
+    np.testing.assert_allclose(rows[:, 1:], expected, rtol=1e-6)
+
+    assert gen_voxel_timeseries('bold.nii.gz', 'mask.nii.gz') == oneD_file
+
+
+def test_get_voxel_timeseries(tmpdir):
+    os.chdir(tmpdir)
+    rng = np.random.default_rng(42)
+    nb.Nifti1Image(rng.random((6, 5, 4, 30)).astype(np.float32),
+                   np.eye(4)).to_filename('bold.nii.gz')
+    nb.Nifti1Image((rng.random((6, 5, 4)) > 0.5).astype(np.float32),
+                   np.eye(4)).to_filename('mask.nii.gz')
+
+    wf = get_voxel_timeseries()
+    wf.base_dir = str(tmpdir)
+    wf.inputs.inputspec.rest = os.path.abspath('bold.nii.gz')
+    wf.inputs.inputspec.output_type = [False, True]
+    wf.inputs.input_mask.mask = os.path.abspath('mask.nii.gz')
+    node = [node for node in wf.run().nodes() if
+            node.name == 'timeseries_voxel'][0]
+
+    assert [os.path.basename(path) for path in
+            node.result.outputs.oneD_file] == [
+        'mask_mask.1D', 'mask_mask.npy', 'mask_mask_coords.npy']
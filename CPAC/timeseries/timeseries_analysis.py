@@ -89,15 +89,16 @@ def get_voxel_timeseries(wf_name='voxel_timeseries'):
                         name='outputspec')
 
     timeseries_voxel = pe.Node(util.Function(input_names=['data_file',
-                                                          'template'],
+                                                          'template',
+                                                          'output_type'],
                                             output_names=['oneD_file'],
                                             function=gen_voxel_timeseries),
                               name='timeseries_voxel')
 
     wflow.connect(inputNode, 'rest',
                   timeseries_voxel, 'data_file')
-    #wflow.connect(inputNode, 'output_type',
-    #              timeseries_voxel, 'output_type')
+    wflow.connect(inputNode, 'output_type',
+                  timeseries_voxel, 'output_type')
     wflow.connect(inputNode_mask, 'mask',
                   timeseries_voxel, 'template')
 
@@ -500,28 +501,31 @@ def get_normalized_moments(wf_name='normalized_moments'):
     return wflow
 
 
-def gen_roi_timeseries(data_file, template, output_type):
+def roi_label_means(data_file, templates, chunk_size=64):
     """
-    Method to extract mean of voxel across
-    all timepoints for each node in roi mask
+    Method to compute the mean timeseries of every label in one or more
+    roi masks in a single pass over the functional data
+
+    The functional data are read in float32 chunks of `chunk_size`
+    timepoints, so the whole 4D image is never held in memory. Voxels are
+    sorted by label once per mask, and each chunk is reduced to the sum
+    over every label at once with ``np.add.reduceat``.
 
     Parameters
     ----------
     data_file : string
         path to input functional data
-    template : string
-        path to input roi mask in functional native space
-    output_type : list
-        list of two boolean values suggesting
-        the output types - numpy npz file and csv
-        format
+    templates : list of strings
+        paths to input roi masks in functional native space
+    chunk_size : integer
+        number of timepoints read at a time
 
     Returns
     -------
-    out_list : list
-        list of 1D file, txt file, csv file and/or npz file containing
-        mean timeseries for each scan corresponding
-        to each node in roi mask
+    roi_means : list of tuples
+        (labels, means) for each roi mask, where labels is the array of
+        positive roi numbers and means is the float32 array of shape
+        (labels, timepoints) of the mean timeseries of each roi
 
     Raises
     ------
@@ -529,112 +533,140 @@ def gen_roi_timeseries(data_file, template, output_type):
 
     """
     import nibabel as nib
-    import csv
     import numpy as np
-    import os
-    import shutil
-
-    unit_data = nib.load(template).get_fdata()
-    # Cast as rounded-up integer
-    unit_data = np.int64(np.ceil(unit_data))
-    datafile = nib.load(data_file)
-    img_data = datafile.get_fdata()
-    vol = img_data.shape[3]
 
-    if unit_data.shape != img_data.shape[:3]:
-        raise Exception('\n\n[!] CPAC says: Invalid Shape Error.'
-                        'Please check the voxel dimensions. '
-                        'Data and roi should have the same shape.\n\n')
-
-    nodes = np.unique(unit_data).tolist()
-    sorted_list = []
-    node_dict = {}
-    out_list = []
+    img = nib.load(data_file, keep_file_open=True)
+    vol = img.shape[3]
+
+    reductions = []
+    for template in templates:
+        # Cast as rounded-up integer
+        unit_data = np.int64(np.ceil(nib.load(template).get_fdata()))
+
+        if unit_data.shape != img.shape[:3]:
+            raise Exception('\n\n[!] CPAC says: Invalid Shape Error.'
+                            'Please check the voxel dimensions. '
+                            'Data and roi should have the same shape.\n\n')
+
+        unit_data = unit_data.ravel(order='F')
+        voxels = np.flatnonzero(unit_data > 0)
+        order = voxels[np.argsort(unit_data[voxels], kind='stable')]
+        labels, starts, counts = np.unique(unit_data[order],
+                                           return_index=True,
+                                           return_counts=True)
+        reductions.append((labels, order, starts, counts,
+                           np.empty((len(labels), vol), dtype=np.float32)))
+
+    for start in range(0, vol, chunk_size):
+        stop = min(start + chunk_size, vol)
+        chunk = np.asarray(img.dataobj[..., start:stop], dtype=np.float32)
+        chunk = chunk.reshape((-1, stop - start), order='F')
+        for labels, order, starts, counts, means in reductions:
+            if not len(labels):
+                continue
+            sums = np.add.reduceat(chunk[order], starts, axis=0,
+                                   dtype=np.float64)
+            means[:, start:stop] = sums / counts[:, np.newaxis]
 
-    # extracting filename from input template
-    tmp_file = os.path.splitext(
-                    os.path.basename(template))[0]
-    tmp_file = os.path.splitext(tmp_file)[0]
-    oneD_file = os.path.abspath('roi_' + tmp_file + '.1D')
-    txt_file = os.path.abspath('roi_' + tmp_file + '.txt')
-    csv_file = os.path.abspath('roi_' + tmp_file + '.csv')
-    numpy_file = os.path.abspath('roi_' + tmp_file + '.npz')
+    return [(labels, means) for labels, _, _, _, means in reductions]
 
-    nodes.sort()
-    for n in nodes:
-        if n > 0:
-            node_array = img_data[unit_data == n]
-            node_str = 'node_{0}'.format(n)
-            avg = np.mean(node_array, axis=0)
-            avg = np.round(avg, 6)
-            list1 = [n] + avg.tolist()
-            sorted_list.append(list1)
-            node_dict[node_str] = avg.tolist()
 
-    # writing to 1Dfile
-    print("writing 1D file..")
+def gen_roi_timeseries(data_file, template, output_type=None, chunk_size=64):
+    """
+    Method to extract mean of voxel across
+    all timepoints for each node in roi mask
 
-    f = open(oneD_file, 'w')
-    writer = csv.writer(f, delimiter=',')
+    Every roi mask in `template` is extracted against the same pass over
+    the functional data (see `roi_label_means`).
 
-    value_list = []
+    Parameters
+    ----------
+    data_file : string
+        path to input functional data
+    template : string or list of strings
+        path(s) to input roi mask(s) in functional native space
+    output_type : list
+        list of two boolean values suggesting
+        the output types - csv and numpy npz file
+    chunk_size : integer
+        number of timepoints read at a time
 
-    new_keys = sorted([
-        int(float(key.split('node_')[1])) for key in node_dict
-    ])
+    Returns
+    -------
+    oneD_file : string or list
+        1D file containing mean timeseries for each scan corresponding
+        to each node in roi mask, or list of the 1D file and the csv
+        and/or npz files if any are requested in `output_type`. A list of
+        these is returned if `template` is a list
 
-    roi_number_list = [str(n) for n in new_keys]
+    Raises
+    ------
+    Exception
 
-    roi_number_str = []
-    for number in roi_number_list:
-        roi_number_str.append("#" + number)
+    """
+    import numpy as np
+    import os
 
-    for key in new_keys:
-        value_list.append(str('{0}\n'.format(node_dict['node_{0}'.format(key)])))
+    from CPAC.timeseries.timeseries_analysis import roi_label_means
 
-    column_list = list(zip(*value_list))
+    templates = [template] if isinstance(template, str) else list(template)
+    if not output_type:
+        output_type = [False, False]
 
-    writer.writerow(roi_number_str)
+    outputs = []
+    for tmpl, (labels, means) in zip(
+            templates, roi_label_means(data_file, templates, chunk_size)):
 
-    for column in column_list:
-        writer.writerow(list(column))
-    f.close()
+        # extracting filename from input template
+        tmp_file = os.path.splitext(os.path.basename(tmpl))[0]
+        tmp_file = os.path.splitext(tmp_file)[0]
+        oneD_file = os.path.abspath('roi_' + tmp_file + '.1D')
+        csv_file = os.path.abspath('roi_' + tmp_file + '.csv')
+        numpy_file = os.path.abspath('roi_' + tmp_file + '.npz')
 
-    out_list.append(oneD_file)
+        means = np.round(means, 6)
 
-    # copy the 1D contents to txt file
-    shutil.copy(oneD_file, txt_file)
-    out_list.append(txt_file)
+        # writing to 1Dfile, one row per timepoint and one column per roi
+        print("writing 1D file..")
+        np.savetxt(oneD_file, means.T, fmt='%.6f', delimiter=',',
+                   header=','.join('#{0}'.format(n) for n in labels),
+                   comments='')
+        out_list = [oneD_file]
 
-    # if csv is required
-    '''
-    if output_type[0]:
-        print("writing csv file..")
-        f = open(csv_file, 'wt')
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-        headers = ['node/volume'] + np.arange(vol).tolist()
-        writer.writerow(headers)
-        writer.writerows(sorted_list)
-        f.close()
-        out_list.append(csv_file)
+        # if csv is required, one row per roi and one column per volume
+        if output_type[0]:
+            print("writing csv file..")
+            headers = ['node/volume'] + [str(t) for t in
+                                         range(means.shape[1])]
+            np.savetxt(csv_file, np.column_stack([labels, means]),
+                       fmt=['%d'] + ['%.6f'] * means.shape[1],
+                       delimiter=',', header=','.join(headers),
+                       comments='')
+            out_list.append(csv_file)
 
-    # if npz file is required
-    if output_type[1]:
-        print("writing npz file..")
-        np.savez(numpy_file, roi_data=value_list, roi_numbers=roi_number_list)
-        out_list.append(numpy_file)
+        # if npz file is required
+        if output_type[1]:
+            print("writing npz file..")
+            np.savez(numpy_file, roi_data=means, roi_numbers=labels)
+            out_list.append(numpy_file)
 
-    return out_list
-    '''
+        outputs.append(out_list if len(out_list) > 1 else oneD_file)
 
-    return oneD_file
+    return outputs[0] if isinstance(template, str) else outputs
 
 
-def gen_voxel_timeseries(data_file, template):
+def gen_voxel_timeseries(data_file, template, output_type=None,
+                         chunk_size=64):
     """
     Method to extract timeseries for each voxel
     in the data that is present in the input mask
 
+    The functional data are read in chunks of `chunk_size` timepoints.
+    Voxel timeseries are written to a float32 .npy file of shape
+    (timepoints, voxels) alongside a (voxels, 3) .npy file of the world
+    coordinates of each voxel; the csv is only written if requested, one
+    block of rows at a time.
+
     Parameters
     ----------
     datafile : string (nifti file)
@@ -643,84 +675,90 @@ def gen_voxel_timeseries(data_file, template):
         path to input mask in functional native space
     output_type : list
         list of two boolean values suggesting
-        the output types - numpy npz file and csv
-        format
+        the output types - csv and numpy npy files
+    chunk_size : integer
+        number of timepoints read and written at a time
 
     Returns
     -------
-    out_list : list of files
-        Based on ouput_type options method returns a list containing
-        path to npz and csv file having timeseries of each voxel in
-        the data that is present in the input mask.The row header
-        corresponds to voxel's xyz cordinates and column headers corresponds
-        to the volume index in the csv. By default it outputs afni compatible
-        1D file with mean of timeseries of voxels across timepoints.
+    oneD_file : string or list of files
+        By default, path to an afni compatible 1D file with the mean of
+        the timeseries of voxels across timepoints. If any `output_type`
+        is requested, a list of the 1D file followed by the voxel
+        timeseries and coordinate npy files and/or the csv file. The row
+        header of the csv corresponds to voxel's xyz cordinates and column
+        headers corresponds to the volume index.
 
     Raises
     ------
     Exception
 
     """
+    from contextlib import nullcontext
     import nibabel as nib
     import numpy as np
-    import csv
     import os
 
-    unit = nib.load(template)
-    unit_data = unit.get_fdata()
-    datafile = nib.load(data_file)
-    img_data = datafile.get_fdata()
-    header_data = datafile.header
-    qform = header_data.get_qform()
-    sorted_list = []
-    vol_dict = {}
-    out_list = []
+    if not output_type:
+        output_type = [False, False]
+
+    mask = nib.load(template).get_fdata() != 0
+    datafile = nib.load(data_file, keep_file_open=True)
+    vol = datafile.shape[3]
+
+    if mask.shape != datafile.shape[:3]:
+        raise Exception('\n\n[!] CPAC says: Invalid Shape Error.'
+                        'Please check the voxel dimensions. '
+                        'Data and mask should have the same shape.\n\n')
 
     tmp_file = os.path.splitext(
                   os.path.basename(template))[0]
     tmp_file = os.path.splitext(tmp_file)[0]
     oneD_file = os.path.abspath('mask_' + tmp_file + '.1D')
-    f = open(oneD_file, 'wt')
+    npy_file = os.path.abspath('mask_' + tmp_file + '.npy')
+    coords_file = os.path.abspath('mask_' + tmp_file + '_coords.npy')
+    csv_file = os.path.abspath('mask_' + tmp_file + '.csv')
+    out_list = [oneD_file]
+
+    cordinates = nib.affines.apply_affine(datafile.header.get_qform(),
+                                          np.argwhere(mask))
 
-    x, y, z = unit_data.shape
+    if output_type[1]:
+        np.save(coords_file, cordinates)
+        timeseries = np.lib.format.open_memmap(
+            npy_file, mode='w+', dtype=np.float32,
+            shape=(vol, len(cordinates)))
+        out_list += [npy_file, coords_file]
+
+    if output_type[0]:
+        out_list.append(csv_file)
 
-    node_array = img_data[unit_data != 0]
-    node_array = node_array.T
-    time_points = node_array.shape[0]
-    for t in range(0, time_points):
-        string = 'vol {0}'.format(t)
-        vol_dict[string] = node_array[t]
-        f.write(str(np.round(np.mean(node_array[t]), 6)))
-        f.write('\n')
-        val = node_array[t].tolist()
-        val.insert(0, t)
-        sorted_list.append(val)
+    with open(oneD_file, 'wt') as f, (open(csv_file, 'wt') if output_type[0]
+                                      else nullcontext()) as csv_out:
+        if output_type[0]:
+            csv_out.write(','.join(['volume/xyz'] +
+                                   ['"{0}"'.format(tuple(xyz)) for
+                                    xyz in cordinates.tolist()]) + '\n')
+        for start in range(0, vol, chunk_size):
+            stop = min(start + chunk_size, vol)
+            node_array = np.asarray(datafile.dataobj[..., start:stop],
+                                    dtype=np.float32)[mask].T
+            for mean in node_array.mean(axis=1, dtype=np.float64):
+                f.write(str(np.round(mean, 6)))
+                f.write('\n')
+            if output_type[1]:
+                timeseries[start:stop] = node_array
+            if output_type[0]:
+                np.savetxt(csv_out, np.column_stack(
+                    [np.arange(start, stop), node_array]),
+                    fmt=['%d'] + ['%.9g'] * node_array.shape[1],
+                    delimiter=',')
 
-    f.close()
+    if output_type[1]:
+        timeseries.flush()
+        del timeseries
 
-    csv_file = os.path.abspath('mask_' + tmp_file + '.csv')
-    f = open(csv_file, 'wt')
-    writer = csv.writer(f, delimiter=str(','),
-                        quoting=csv.QUOTE_MINIMAL)
-    one = np.array([1])
-    headers = ['volume/xyz']
-    cordinates = np.argwhere(unit_data != 0)
-    for val in range(len(cordinates)):
-        ijk_mat = np.concatenate([cordinates[val], one])
-        ijk_mat = ijk_mat.T
-        product = np.dot(qform, ijk_mat)
-        val = tuple(product.tolist()[0:3])
-        headers.append(val)
-    writer.writerow(headers)
-    writer.writerows(sorted_list)
-    f.close()
-
-    #if output_type[1]:
-    #    numpy_file = os.path.abspath('mask_' + tmp_file + '.npz')
-    #    np.savez(numpy_file, **dict(vol_dict))
-    #    out_list.append(numpy_file)
-
-    return oneD_file
+    return out_list if len(out_list) > 1 else oneD_file
 
 
 def gen_vertices_timeseries(rh_surface_file,
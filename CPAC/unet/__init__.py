@@ -17,7 +17,7 @@
 from ._torch import torch  # this import has to be first to install torch
 
 from .function import write_nifti, estimate_dice, extract_large_comp, \
-    predict_volumes, MyParser
+    predict_volumes, MyParser, UNetInference
 
 from .model import weigths_init, Conv3dBlock, UpConv3dBlock, Conv2dBlock, \
     UpConv2dBlock, UNet3d, UNet2d, MultiSliceBcUNet, MultiSliceSsUNet, \
@@ -31,6 +31,7 @@ __all__ = [
     'extract_large_comp',
     'predict_volumes',
     'MyParser',
+    'UNetInference',
     'weigths_init',
     'Conv3dBlock',
     'UpConv3dBlock',
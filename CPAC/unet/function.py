@@ -62,116 +62,281 @@ def erosion_dilation(prt_msk, iterations=1):
 
     return prt_msk_dilated
 
+BATCH_SIZE = 8
+"""Slices per forward pass of the U-Net"""
+
+
+class UNetInference:
+    """A U-Net skull-stripping model, loaded once per process, that
+    predicts brain masks for several volumes at once
+
+    Overlapping blocks of ``num_slice`` slices in all three directions of
+    every volume are passed through the model ``batch_size`` blocks at a
+    time.
+
+    The model has always been run in training mode on one block at a
+    time, so each batch normalization layer normalized a block by its own
+    statistics. Those layers are replaced with instance normalization
+    using the same weights, which normalizes each block of a batch the
+    same way, so batching does not change the predictions.
+
+    Parameters
+    ----------
+    model_path : str
+        path to a checkpoint of a ``UNet2d(dim_in=3, num_conv_block=5,
+        kernel_root=16)``
+
+    batch_size : int, optional
+
+    device : str, optional
+        default: 'cuda' if available, else 'cpu'
+    """
+    _loaded = {}
+
+    def __init__(self, model_path, batch_size=BATCH_SIZE, device=None):
+        import torch
+        from torch import nn
+        from CPAC.unet.model import UNet2d
+
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        train_model = UNet2d(dim_in=3, num_conv_block=5, kernel_root=16)
+        checkpoint = torch.load(model_path, map_location={'cuda:0': 'cpu'})
+        train_model.load_state_dict(checkpoint['state_dict'])
+        self._per_block_norm(train_model)
+        self.model = nn.Sequential(train_model, nn.Softmax2d()).to(
+            device).eval()
+        self.batch_size = batch_size
+        self.device = device
+
+    @classmethod
+    def get(cls, model_path, batch_size=BATCH_SIZE, device=None,
+            num_threads=None):
+        """The model loaded from ``model_path`` in this process, loading it
+        if it hasn't been loaded or has changed
+
+        Parameters
+        ----------
+        model_path : str
+
+        batch_size : int, optional
+
+        device : str, optional
+
+        num_threads : int, optional
+            threads for operations within each layer (torch's intra-op
+            threads); default: torch's default
+
+        Returns
+        -------
+        UNetInference
+        """
+        import os
+        import torch
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model_path = os.path.realpath(model_path)
+        key = (model_path, os.stat(model_path).st_mtime_ns, device)
+        if key not in cls._loaded:
+            cls._loaded = {key: cls(model_path, device=device)}
+        inference = cls._loaded[key]
+        inference.batch_size = batch_size
+        return inference
+
+    @staticmethod
+    def _per_block_norm(module):
+        from torch import nn
+
+        class InstanceNorm(nn.Module):
+            """BatchNorm2d as applied in training mode to a batch of one
+            block, applied to each block of a batch"""
+            def __init__(self, batch_norm):
+                super().__init__()
+                self.weight = batch_norm.weight
+                self.bias = batch_norm.bias
+                self.eps = batch_norm.eps
+
+            def forward(self, x):
+                return nn.functional.instance_norm(
+                    x, weight=self.weight, bias=self.bias, eps=self.eps)
+
+        for name, child in module.named_children():
+            if isinstance(child, nn.BatchNorm2d):
+                setattr(module, name, InstanceNorm(child))
+            else:
+                UNetInference._per_block_norm(child)
+
+    def predict(self, volumes, num_slice=3, rescale_dim=256):
+        """Brain probability maps of volumes
+
+        Parameters
+        ----------
+        volumes : iterable of torch.Tensor
+            each 1 × x × y × z, normalized to [0, 1]
+
+        num_slice : int, optional
+
+        rescale_dim : int, optional
+
+        Yields
+        ------
+        torch.Tensor
+            x × y × z probability of each voxel being brain, averaged over
+            the three slice directions, in the order of ``volumes``
+        """
+        import torch
+
+        pending = []
+        unfinished = []
+        with torch.inference_mode():
+            for volume in volumes:
+                prediction = _VolumePrediction(volume, num_slice,
+                                               rescale_dim)
+                unfinished.append(prediction)
+                for block in prediction.blocks():
+                    pending.append(block)
+                    if len(pending) == self.batch_size:
+                        self._run(pending, num_slice, rescale_dim)
+                        pending = []
+                        while unfinished and unfinished[0].finished:
+                            yield unfinished.pop(0).probability()
+            if pending:
+                self._run(pending, num_slice, rescale_dim)
+            for prediction in unfinished:
+                yield prediction.probability()
+
+    def _run(self, blocks, num_slice, rescale_dim):
+        import torch
+
+        batch = torch.zeros([len(blocks), num_slice, rescale_dim,
+                             rescale_dim], dtype=torch.float32)
+        for i, (_, _, _, block) in enumerate(blocks):
+            batch[i, :, :block.shape[1], :block.shape[2]] = block
+        probability = self.model(batch.to(self.device))[:, 1].cpu()
+        for i, (prediction, axis, index, block) in enumerate(blocks):
+            prediction.set(axis, index, probability[
+                i, :block.shape[1], :block.shape[2]])
+
+
+class _VolumePrediction:
+    """Blocks of one volume in each direction and the predictions for
+    their center slices, as in one pass of
+    :py:class:`~CPAC.unet.dataset.BlockDataset`"""
+    def __init__(self, volume, num_slice, rescale_dim):
+        import torch
+        from CPAC.unet.dataset import BlockDataset
+
+        block_dataset = BlockDataset(rimg=volume, bfld=None, bmsk=None,
+                                     num_slice=num_slice,
+                                     rescale_dim=rescale_dim)
+        self.raw_shape = block_dataset.get_raw_shape()
+        self.rescale_shape = block_dataset.get_rescale_shape()
+        rescaled = block_dataset.rimg.data[0]
+        # slices along each direction first, as BlockDataset permutes them
+        self.slices = [rescaled, rescaled.permute(1, 0, 2),
+                       rescaled.permute(2, 0, 1)]
+        self.num_slice = num_slice
+        self.predictions = [torch.zeros(slices.shape) for
+                            slices in self.slices]
+        self.remaining = sum(len(slices) - num_slice + 1 for
+                             slices in self.slices)
+
+    @property
+    def finished(self):
+        """Whether every block has been predicted"""
+        return self.remaining == 0
+
+    def blocks(self):
+        """(prediction, axis, index, block) for each block of
+        ``num_slice`` slices"""
+        for axis, slices in enumerate(self.slices):
+            for index in range(len(slices) - self.num_slice + 1):
+                yield self, axis, index, slices[index:index + self.num_slice]
+
+    def set(self, axis, index, probability):
+        """Record the prediction for the center slice of a block"""
+        self.predictions[axis][index + 1] = probability
+        self.remaining -= 1
+
+    def probability(self):
+        """Probability map at the original resolution"""
+        import numpy as np
+        import torch
+        from torch import nn
+
+        probabilities = []
+        for axis, prediction in enumerate(self.predictions):
+            backward_ind = np.insert(np.delete(np.arange(3), 0), axis, 0)
+            prediction = prediction.permute(*backward_ind)[
+                :self.rescale_shape[0], :self.rescale_shape[1],
+                :self.rescale_shape[2]]
+            prediction = nn.functional.interpolate(
+                prediction[None, None], size=self.raw_shape,
+                mode="trilinear", align_corners=False)
+            probabilities.append(torch.squeeze(prediction))
+        return torch.stack(probabilities, dim=3).mean(dim=3)
+
+
 def predict_volumes(model_path, rimg_in=None, cimg_in=None, bmsk_in=None, suffix="unet_pre_mask", 
         ed_iter=0, save_dice=False, save_nii=True, nii_outdir=None, verbose=False, 
-        rescale_dim=256, num_slice=3):
-
+        rescale_dim=256, num_slice=3, num_threads=None, batch_size=BATCH_SIZE):
+    """Predict brain masks with a U-Net
+
+    ``cimg_in`` can be an image, a directory of images or a list of
+    images. The model is loaded once per process and the slices of all
+    of the images are batched through it, see
+    :py:class:`~CPAC.unet.function.UNetInference`.
+
+    Returns
+    -------
+    str or list of str or dict
+        path to the mask, a list of paths to the masks if ``cimg_in`` is
+        a list, or each image's Dice coefficient if ``save_dice``
+    """
     import torch
-    import torch.nn as nn
     import numpy as np
-    from torch.autograd import Variable
-    from CPAC.unet.function import extract_large_comp, estimate_dice, write_nifti, fill_holes, erosion_dilation
-    from CPAC.unet.model import UNet2d
-    from CPAC.unet.dataset import VolumeDataset, BlockDataset
+    from CPAC.unet.function import extract_large_comp, estimate_dice, write_nifti, fill_holes, erosion_dilation, UNetInference
+    from CPAC.unet.dataset import VolumeDataset
     from torch.utils.data import DataLoader
     import os, sys
-    import nibabel as nib
-    import pickle
-
-    train_model = UNet2d(dim_in=3, num_conv_block=5, kernel_root=16)
-    checkpoint = torch.load(model_path, map_location={'cuda:0':'cpu'})
-    train_model.load_state_dict(checkpoint['state_dict'])
-    model = nn.Sequential(train_model, nn.Softmax2d())
-
-    use_gpu=torch.cuda.is_available()
-    model_on_gpu=next(model.parameters()).is_cuda
-    use_bn=True
-    if use_gpu:
-        if not model_on_gpu:
-            model.cuda()
-    else:
-        if model_on_gpu:
-            model.cpu()
+    from collections import deque
 
     NoneType=type(None)
     if isinstance(rimg_in, NoneType) and isinstance(cimg_in, NoneType):
         print("Input rimg_in or cimg_in")
         sys.exit(1)
 
+    inference = UNetInference.get(model_path, batch_size=batch_size,
+                                  num_threads=num_threads)
+
     if save_dice:
         dice_dict=dict()
-    
-    volume_dataset=VolumeDataset(rimg_in=rimg_in, cimg_in=cimg_in, bmsk_in=bmsk_in)
-    volume_loader=DataLoader(dataset=volume_dataset, batch_size=1)
-    
-    for idx, vol in enumerate(volume_loader):
-        if len(vol)==1: # just img
-            ptype=1 # Predict
-            cimg=vol
-            bmsk=None
-            block_dataset=BlockDataset(rimg=cimg, bfld=None, bmsk=None, num_slice=num_slice, rescale_dim=rescale_dim)
-        elif len(vol)==2: # img & msk
-            ptype=2 # image test
-            cimg=vol[0]
-            bmsk=vol[1]
-            block_dataset=BlockDataset(rimg=cimg, bfld=None, bmsk=bmsk, num_slice=num_slice, rescale_dim=rescale_dim)
-        elif len(vol==3): # img bias_field & msk
-            ptype=3 # image bias correction test
-            cimg=vol[0]
-            bfld=vol[1]
-            bmsk=vol[2]
-            block_dataset=BlockDataset(rimg=cimg, bfld=bfld, bmsk=bmsk, num_slice=num_slice, rescale_dim=rescale_dim)
-        else:
-            print("Invalid Volume Dataset!")
-            sys.exit(2)
-        
-        rescale_shape=block_dataset.get_rescale_shape()
-        raw_shape=block_dataset.get_raw_shape()
-        
-        for od in range(3):
-            backard_ind=np.arange(3)
-            backard_ind=np.insert(np.delete(backard_ind, 0), od, 0)
-
-            block_data, slice_list, slice_weight=block_dataset.get_one_directory(axis=od)
-            pr_bmsk=torch.zeros([len(slice_weight), rescale_dim, rescale_dim])
-            if use_gpu:
-                pr_bmsk=pr_bmsk.cuda()
-            for (i, ind) in enumerate(slice_list):
-                if ptype==1:
-                    rimg_blk=block_data[i]
-                    if use_gpu:
-                        rimg_blk=rimg_blk.cuda()
-                elif ptype==2:
-                    rimg_blk, bmsk_blk=block_data[i]
-                    if use_gpu:
-                        rimg_blk=rimg_blk.cuda()
-                        bmsk_blk=bmsk_blk.cuda()
-                else:
-                    rimg_blk, bfld_blk, bmsk_blk=block_data[i]
-                    if use_gpu:
-                        rimg_blk=rimg_blk.cuda()
-                        bfld_blk=bfld_blk.cuda()
-                        bmsk_blk=bmsk_blk.cuda()
-                pr_bmsk_blk=model(torch.unsqueeze(Variable(rimg_blk), 0))
-                pr_bmsk[ind[1], :, :]=pr_bmsk_blk.data[0][1, :, :]
-            
-            if use_gpu:
-                pr_bmsk=pr_bmsk.cpu()
-            
-            pr_bmsk=pr_bmsk.permute(backard_ind[0], backard_ind[1], backard_ind[2])
-            pr_bmsk=pr_bmsk[:rescale_shape[0], :rescale_shape[1], :rescale_shape[2]]
-            uns_pr_bmsk=torch.unsqueeze(pr_bmsk, 0)
-            uns_pr_bmsk=torch.unsqueeze(uns_pr_bmsk, 0)
-            uns_pr_bmsk=nn.functional.interpolate(uns_pr_bmsk, size=raw_shape, mode="trilinear", align_corners=False)
-            pr_bmsk=torch.squeeze(uns_pr_bmsk)
-
-            if od==0:
-                pr_3_bmsk=torch.unsqueeze(pr_bmsk, 3)
-            else:
-                pr_3_bmsk=torch.cat((pr_3_bmsk, torch.unsqueeze(pr_bmsk, 3)), dim=3)
-        
-        pr_bmsk=pr_3_bmsk.mean(dim=3)
-        
+
+    if isinstance(cimg_in, (list, tuple)):
+        volume_datasets=[VolumeDataset(rimg_in=rimg_in, cimg_in=cimg, bmsk_in=bmsk_in) for cimg in cimg_in]
+    else:
+        volume_datasets=[VolumeDataset(rimg_in=rimg_in, cimg_in=cimg_in, bmsk_in=bmsk_in)]
+
+    # masks and images of the volumes loaded but not yet predicted
+    loaded=deque()
+
+    def load_volumes():
+        for volume_dataset in volume_datasets:
+            for vol in DataLoader(dataset=volume_dataset, batch_size=1):
+                if isinstance(vol, torch.Tensor): # just img
+                    cimg=vol
+                    bmsk=None
+                else: # img & msk, or img, bias_field & msk
+                    cimg=vol[0]
+                    bmsk=vol[-1]
+                loaded.append((bmsk, volume_dataset.getCurCimgNii()))
+                yield cimg
+
+    out_paths=[]
+    for pr_bmsk in inference.predict(load_volumes(), num_slice=num_slice, rescale_dim=rescale_dim):
+        bmsk, t1w_nii=loaded.popleft()
+
         pr_bmsk=pr_bmsk.numpy()
         pr_bmsk_final=extract_large_comp(pr_bmsk>0.5)
         pr_bmsk_final=fill_holes(pr_bmsk_final)
@@ -184,7 +349,6 @@ def predict_volumes(model_path, rimg_in=None, cimg_in=None, bmsk_in=None, suffix
             if verbose:
                 print(dice)
 
-        t1w_nii=volume_dataset.getCurCimgNii()
         t1w_path=t1w_nii.get_filename()
         t1w_dir, t1w_file=os.path.split(t1w_path)
         t1w_name=os.path.splitext(t1w_file)[0]
@@ -199,13 +363,15 @@ def predict_volumes(model_path, rimg_in=None, cimg_in=None, bmsk_in=None, suffix
 
             out_path=os.path.join(nii_outdir, t1w_name+"_"+suffix+".nii.gz")
             write_nifti(np.array(pr_bmsk_final, dtype=np.float32), t1w_aff, t1w_shape, out_path)
+            out_paths.append(out_path)
 
         if save_dice:
             dice_dict[t1w_name]=dice
 
     if save_dice:
         return dice_dict
-    
-    # return output mask
-    return out_path
 
+    # return output mask(s)
+    if isinstance(cimg_in, (list, tuple)):
+        return out_paths
+    return out_path
@@ -0,0 +1,105 @@
+# Copyright (C) 2023  C-PAC Developers
+
+# This file is part of C-PAC.
+
+# C-PAC is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# C-PAC is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public
+# License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
+"""Test batched U-Net inference"""
+import nibabel as nib
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+# pylint: disable=wrong-import-position
+from CPAC.unet.dataset import BlockDataset
+from CPAC.unet.function import predict_volumes, UNetInference
+from CPAC.unet.model import UNet2d
+
+RESCALE_DIM = 32
+
+
+def _one_block_at_a_time(model_path, volume):
+    """Probability map predicted one block at a time, as before batching"""
+    train_model = UNet2d(dim_in=3, num_conv_block=5, kernel_root=16)
+    train_model.load_state_dict(torch.load(model_path)['state_dict'])
+    model = torch.nn.Sequential(train_model, torch.nn.Softmax2d())
+    block_dataset = BlockDataset(rimg=volume, rescale_dim=RESCALE_DIM)
+    rescale_shape = block_dataset.get_rescale_shape()
+    probabilities = []
+    with torch.no_grad():
+        for axis in range(3):
+            block_data, slice_list, slice_weight = \
+                block_dataset.get_one_directory(axis=axis)
+            prediction = torch.zeros([len(slice_weight), RESCALE_DIM,
+                                      RESCALE_DIM])
+            for i, ind in enumerate(slice_list):
+                prediction[ind[1]] = model(block_data[i][None])[0][1]
+            backward_ind = np.insert(np.delete(np.arange(3), 0), axis, 0)
+            prediction = prediction.permute(*backward_ind)[
+                :rescale_shape[0], :rescale_shape[1], :rescale_shape[2]]
+            probabilities.append(torch.squeeze(torch.nn.functional.interpolate(
+                prediction[None, None], size=block_dataset.get_raw_shape(),
+                mode='trilinear', align_corners=False)))
+    return torch.stack(probabilities, dim=3).mean(dim=3)
+
+
+@pytest.fixture(name='model_path')
+def fixture_model_path(tmp_path):
+    """A randomly initialized U-Net checkpoint"""
+    torch.manual_seed(0)
+    model_path = str(tmp_path / 'model.pth.tar')
+    torch.save({'state_dict': UNet2d(dim_in=3, num_conv_block=5,
+                                     kernel_root=16).state_dict()},
+               model_path)
+    return model_path
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 64])
+def test_batched_prediction(batch_size, model_path):
+    """Batching blocks across directions and volumes doesn't change the
+    predictions"""
+    rng = np.random.default_rng(0)
+    volumes = [torch.from_numpy(rng.random(shape, dtype=np.float32))[None]
+               for shape in [(10, 12, 8), (9, 9, 11)]]
+    inference = UNetInference.get(model_path, batch_size=batch_size)
+    assert UNetInference.get(model_path) is inference
+    predictions = list(inference.predict(volumes, rescale_dim=RESCALE_DIM))
+    assert len(predictions) == len(volumes)
+    for volume, prediction in zip(volumes, predictions):
+        np.testing.assert_allclose(
+            prediction.numpy(), _one_block_at_a_time(model_path,
+                                                     volume).numpy(),
+            atol=1e-5)
+
+
+def test_predict_volume_list(model_path, tmp_path):
+    """A list of images gives the masks of each image"""
+    rng = np.random.default_rng(1)
+    images = []
+    for i in range(3):
+        images.append(str(tmp_path / f'sub-{i}_T1w.nii.gz'))
+        nib.Nifti1Image(rng.random((10, 11, 9)), np.eye(4)).to_filename(
+            images[-1])
+    out_paths = predict_volumes(model_path, cimg_in=images,
+                                nii_outdir=str(tmp_path),
+                                rescale_dim=RESCALE_DIM, num_threads=1)
+    assert out_paths == [str(tmp_path / f'sub-{i}_T1w_unet_pre_mask.nii.gz')
+                         for i in range(3)]
+    single_dir = tmp_path / 'single'
+    single_dir.mkdir()
+    for image, out_path in zip(images, out_paths):
+        single_path = predict_volumes(model_path, cimg_in=image,
+                                      nii_outdir=str(single_dir),
+                                      rescale_dim=RESCALE_DIM)
+        np.testing.assert_array_equal(nib.load(out_path).get_fdata(),
+                                      nib.load(single_path).get_fdata())
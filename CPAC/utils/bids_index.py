@@ -0,0 +1,340 @@
+# Copyright (C) 2023  C-PAC Developers
+
+# This file is part of C-PAC.
+
+# C-PAC is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# C-PAC is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public
+# License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
+"""Persistent index of the images and JSON sidecars of a BIDS dataset
+
+The index is an SQLite database of every file in the dataset that C-PAC
+builds data configurations from, with each sidecar's parsed content. Local
+datasets are crawled with ``os.scandir`` across a pool of threads and S3
+datasets are listed one top-level prefix per thread. Each refresh only
+reads sidecars that are new or whose modification time and size (or, on
+S3, ETag) changed since they were indexed.
+
+The index is kept outside the dataset, in ``$CPAC_BIDS_INDEX`` if set,
+else in ``~/.cache/cpac/bids_index`` (or a temporary directory if that
+isn't writable), one database per dataset.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+
+from CPAC.utils.monitoring.custom_logging import getLogger
+
+INDEX_ENV = 'CPAC_BIDS_INDEX'
+SCHEMA_VERSION = 1
+SUFFIXES = ('T1w', 'T2w', 'bold', 'epi', 'phasediff', 'phase1', 'phase2',
+            'magnitude', 'magnitude1', 'magnitude2')
+"""Files are indexed if their names contain one of these"""
+logger = getLogger('nipype.workflow')
+
+
+def indexed_kind(filename):
+    """Whether a file is indexed as an image ('nii') or a sidecar ('json')
+
+    Parameters
+    ----------
+    filename : str
+
+    Returns
+    -------
+    str or None
+
+    Examples
+    --------
+    >>> indexed_kind('sub-1_task-rest_bold.nii.gz')
+    'nii'
+    >>> indexed_kind('task-rest_bold.json')
+    'json'
+    >>> indexed_kind('sub-1_dir-AP_epi.nii.gz') is None
+    True
+    >>> indexed_kind('sub-1_acq-fMRI_dir-AP_epi.json')
+    'json'
+    >>> indexed_kind('participants.tsv') is None
+    True
+    """
+    for suffix in SUFFIXES:
+        if suffix == 'epi' and 'acq-fMRI' not in filename:
+            continue
+        if suffix in filename:
+            if filename.endswith('json'):
+                return 'json'
+            if 'nii' in filename:
+                return 'nii'
+    return None
+
+
+def _default_get_bucket(creds_path, bucket_name):
+    # pylint: disable=import-outside-toplevel
+    from indi_aws import fetch_creds
+    return fetch_creds.return_bucket(creds_path, bucket_name)
+
+
+def _scan_dir(path):
+    """Indexed files and subdirectories of a local directory"""
+    files = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            else:
+                kind = indexed_kind(entry.name)
+                if kind:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        # e.g., an image not yet fetched by git-annex
+                        stat = entry.stat(follow_symlinks=False)
+                    files.append((entry.path, kind,
+                                  f'{stat.st_mtime_ns}:{stat.st_size}'))
+    return files, subdirs
+
+
+def _load_json(path):
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except UnicodeDecodeError:
+        raise Exception(f"Could not decode {path}")
+
+
+class BIDSIndex:
+    """Index of the images and sidecars of a local or S3 BIDS dataset
+
+    Parameters
+    ----------
+    bids_dir : str
+        local path or S3 URI
+
+    creds_path : str, optional
+        AWS credentials for an S3 dataset
+
+    index_path : str, optional
+        SQLite database to keep the index in
+
+    num_threads : int, optional
+        threads to crawl and read sidecars with
+
+    get_bucket : callable, optional
+        ``get_bucket(creds_path, bucket_name)`` returning a boto3 Bucket
+
+    Examples
+    --------
+    >>> bids_dir = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(bids_dir, 'sub-1', 'anat'))
+    >>> open(os.path.join(bids_dir, 'sub-1', 'anat', 'sub-1_T1w.nii.gz'),
+    ...      'w').close()
+    >>> with open(os.path.join(bids_dir, 'T1w.json'), 'w') as sidecar:
+    ...     _ = sidecar.write('{"RepetitionTime": 2}')
+    >>> with BIDSIndex(bids_dir, index_path=os.path.join(
+    ...         tempfile.mkdtemp(), 'index.sqlite')) as index:
+    ...     index.refresh()
+    ...     index.files_and_sidecars()
+    (2, 1)
+    (['sub-1/anat/sub-1_T1w.nii.gz'], {'T1w.json': {'RepetitionTime': 2}})
+    """
+    def __init__(self, bids_dir, creds_path=None, index_path=None,
+                 num_threads=None, get_bucket=_default_get_bucket):
+        self.bids_dir = bids_dir.rstrip('/')
+        self.is_s3 = bids_dir.lower().startswith('s3://')
+        if not self.is_s3:
+            self.bids_dir = os.path.abspath(self.bids_dir)
+        self.creds_path = creds_path
+        self.num_threads = num_threads
+        self._get_bucket = get_bucket
+        self.index_path = index_path or self._default_index_path()
+        self._connection = sqlite3.connect(self.index_path, timeout=60)
+        self._create_tables()
+
+    def _default_index_path(self):
+        filename = hashlib.sha1(self.bids_dir.encode()).hexdigest() + \
+            '.sqlite'
+        index_dir = os.environ.get(INDEX_ENV, os.path.join(
+            os.path.expanduser('~'), '.cache', 'cpac', 'bids_index'))
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            if not os.access(index_dir, os.W_OK):
+                raise PermissionError(index_dir)
+        except OSError:
+            index_dir = os.path.join(tempfile.gettempdir(), 'cpac',
+                                     'bids_index')
+            os.makedirs(index_dir, exist_ok=True)
+        return os.path.join(index_dir, filename)
+
+    def _create_tables(self):
+        with self._connection as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                conn.execute('DROP TABLE IF EXISTS files')
+            conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY '
+                         'KEY, kind TEXT, stamp TEXT, sidecar TEXT)')
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        """Close the connection to the index"""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def refresh(self):
+        """Bring the index up to date with the dataset, only reading
+        sidecars that changed since they were indexed
+
+        Returns
+        -------
+        num_files : int
+            indexed files in the dataset
+
+        num_read : int
+            sidecars read in this refresh
+        """
+        with ThreadPoolExecutor(self.num_threads) as pool:
+            if self.is_s3:
+                found, read_sidecar = self._crawl_s3(pool)
+            else:
+                found, read_sidecar = self._crawl_local(pool), _load_json
+            with self._connection as conn:
+                indexed = dict(conn.execute('SELECT path, stamp FROM files'))
+                changed = {path: (kind, stamp, location) for
+                           path, (kind, stamp, location) in found.items() if
+                           indexed.get(path) != stamp}
+                sidecars = [path for path, (kind, _, _) in changed.items() if
+                            kind == 'json']
+                contents = dict(zip(sidecars, pool.map(
+                    read_sidecar, [changed[path][2] for path in sidecars])))
+                conn.executemany('DELETE FROM files WHERE path = ?',
+                                 [(path,) for path in indexed if
+                                  path not in found])
+                conn.executemany(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                    [(path, kind, stamp, json.dumps(contents[path]) if
+                      path in contents else None) for
+                     path, (kind, stamp, _) in changed.items()])
+        logger.info('Indexed %s: %d files, read %d sidecars', self.bids_dir,
+                    len(found), len(sidecars))
+        return len(found), len(sidecars)
+
+    def _crawl_local(self, pool):
+        """``{relative path: (kind, stamp, path)}`` of the indexed files,
+        listing directories concurrently and following links to
+        directories as :py:func:`os.walk` with ``followlinks=True`` does"""
+        found = {}
+        visited = {os.path.realpath(self.bids_dir)}
+        pending = {pool.submit(_scan_dir, self.bids_dir)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for path, kind, stamp in files:
+                    found[path[len(self.bids_dir):].lstrip('/')] = (
+                        kind, stamp, path)
+                for subdir in subdirs:
+                    realpath = os.path.realpath(subdir)
+                    if realpath not in visited:
+                        visited.add(realpath)
+                        pending.add(pool.submit(_scan_dir, subdir))
+        return found
+
+    def _crawl_s3(self, pool):
+        """``{relative key: (kind, ETag, key)}`` of the indexed objects,
+        listing each top-level prefix concurrently, and a function to read
+        a sidecar by its key"""
+        bucket_name = self.bids_dir.split('/')[2]
+        prefix = self.bids_dir.split('/', 3)[3] if \
+            self.bids_dir.count('/') > 2 else ''
+        if self.creds_path and not os.path.isfile(self.creds_path):
+            raise IOError("Could not find aws_input_creds (%s)" %
+                          (self.creds_path))
+        bucket = self._get_bucket(self.creds_path, bucket_name)
+        client = bucket.meta.client
+        paginator = client.get_paginator('list_objects_v2')
+        logger.info('gathering files from S3 bucket (%s) for %s',
+                    bucket_name, prefix)
+
+        def list_objects(list_prefix, delimiter=None):
+            kwargs = {'Bucket': bucket_name, 'Prefix': list_prefix}
+            if delimiter:
+                kwargs['Delimiter'] = delimiter
+            objects = []
+            prefixes = []
+            for page in paginator.paginate(**kwargs):
+                objects.extend(page.get('Contents', []))
+                prefixes.extend(common['Prefix'] for common in
+                                page.get('CommonPrefixes', []))
+            return objects, prefixes
+
+        # list the dataset's top level, then each of its subdirectories
+        # (e.g., each participant) in its own task
+        objects, prefixes = list_objects(
+            prefix.rstrip('/') + '/' if prefix else '', '/')
+        for prefix_objects, _ in pool.map(list_objects, prefixes):
+            objects.extend(prefix_objects)
+        found = {}
+        for s3_object in objects:
+            key = s3_object['Key']
+            kind = indexed_kind(os.path.basename(key))
+            if kind:
+                found[key[len(prefix):].lstrip('/')] = (
+                    kind, s3_object['ETag'], key)
+
+        def read_sidecar(key):
+            return json.loads(client.get_object(
+                Bucket=bucket_name, Key=key)['Body'].read())
+
+        return found, read_sidecar
+
+    def files_and_sidecars(self, participant_labels=None):
+        """Indexed images and sidecars, as
+        :py:func:`~CPAC.utils.bids_utils.collect_bids_files_configs`
+        returns them
+
+        Parameters
+        ----------
+        participant_labels : list of str, optional
+            only include images whose paths contain one of these, and
+            sidecars that apply to them, i.e., those outside any
+            participant's directory and those whose paths contain one
+
+        Returns
+        -------
+        file_paths : list of str
+            sorted image paths relative to the dataset
+
+        config_dict : dict
+            parsed sidecars keyed by path relative to the dataset
+        """
+        def selected(path):
+            return not participant_labels or any(
+                label in path for label in participant_labels)
+
+        file_paths = []
+        config_dict = {}
+        for path, kind, sidecar in self._connection.execute(
+                'SELECT path, kind, sidecar FROM files ORDER BY path'):
+            if kind == 'nii':
+                if selected(path):
+                    file_paths.append(path)
+            elif selected(path) or not any(
+                    part.startswith('sub-') for part in path.split('/')[:-1]):
+                config_dict[path] = json.loads(sidecar)
+        return file_paths, config_dict
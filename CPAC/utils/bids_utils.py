@@ -14,7 +14,6 @@
 
 # You should have received a copy of the GNU Lesser General Public
 # License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
-import json
 import os
 import re
 import sys
@@ -732,77 +731,26 @@ def bids_gen_cpac_sublist(bids_dir, paths_list, config_dict, creds_path,
     return sublist
 
 
-def collect_bids_files_configs(bids_dir, aws_input_creds=''):
+def collect_bids_files_configs(bids_dir, aws_input_creds='',
+                               participant_labels=None):
     """
-    :param bids_dir:
+    Collect the images and parsed JSON sidecars of a BIDS dataset from its
+    persistent index, see :py:class:`~CPAC.utils.bids_index.BIDSIndex`
+
+    :param bids_dir: local path or S3 URI
     :param aws_input_creds:
-    :return:
+    :param participant_labels: only collect images whose paths contain one
+        of these, and the sidecars that apply to them
+    :return: image paths and parsed sidecars, relative to ``bids_dir``
     """
+    from CPAC.utils.bids_index import BIDSIndex
 
-    file_paths = []
-    config_dict = {}
-
-    suffixes = ['T1w', 'T2w', 'bold', 'epi', 'phasediff', 'phase1',
-                'phase2', 'magnitude', 'magnitude1', 'magnitude2']
-
-    if bids_dir.lower().startswith("s3://"):
-        # s3 paths begin with s3://bucket/
-        bucket_name = bids_dir.split('/')[2]
-        s3_prefix = '/'.join(bids_dir.split('/')[:3])
-        prefix = bids_dir.replace(s3_prefix, '').lstrip('/')
+    with BIDSIndex(bids_dir, aws_input_creds) as index:
+        num_files, _ = index.refresh()
+        file_paths, config_dict = index.files_and_sidecars(
+            participant_labels)
 
-        if aws_input_creds:
-            if not os.path.isfile(aws_input_creds):
-                raise IOError("Could not find aws_input_creds (%s)" %
-                              (aws_input_creds))
-
-        from indi_aws import fetch_creds
-        bucket = fetch_creds.return_bucket(aws_input_creds, bucket_name)
-
-        print(f"gathering files from S3 bucket ({bucket}) for {prefix}")
-
-        for s3_obj in bucket.objects.filter(Prefix=prefix):
-            for suf in suffixes:
-                if suf in str(s3_obj.key):
-                    if suf == 'epi' and 'acq-fMRI' not in s3_obj.key:
-                        continue
-                    if str(s3_obj.key).endswith("json"):
-                        try:
-                            config_dict[s3_obj.key.replace(prefix, "")
-                                        .lstrip('/')] = json.loads(
-                                            s3_obj.get()["Body"].read())
-                        except Exception as e:
-                            print("Error retrieving %s (%s)" %
-                                  (s3_obj.key.replace(prefix, ""),
-                                  e.message))
-                            raise
-                    elif 'nii' in str(s3_obj.key):
-                        file_paths.append(str(s3_obj.key)
-                                          .replace(prefix,'').lstrip('/'))
-
-    else:
-        for root, dirs, files in os.walk(bids_dir, topdown=False, followlinks=True):
-            if files:
-                for f in files:
-                    for suf in suffixes:
-                        if suf == 'epi' and 'acq-fMRI' not in f:
-                            continue
-                        if 'nii' in f and suf in f:
-                            file_paths += [os.path.join(root, f)
-                                           .replace(bids_dir, '').lstrip('/')]
-                        if f.endswith('json') and suf in f:
-                            try:
-                                config_dict.update(
-                                    {os.path.join(root.replace(bids_dir, '')
-                                     .lstrip('/'), f):
-                                         json.load(
-                                             open(os.path.join(root, f), 'r')
-                                         )})
-                            except UnicodeDecodeError:
-                                raise Exception("Could not decode {0}".format(
-                                    os.path.join(root, f)))
-
-    if not file_paths and not config_dict:
+    if not num_files:
         raise IOError("Didn't find any files in {0}. Please verify that the "
                       "path is typed correctly, that you have read access to "
                       "the directory, and that it is not "
@@ -1006,15 +954,8 @@ def create_cpac_data_config(bids_dir, participant_labels=None,
     print("Parsing {0}..".format(bids_dir))
 
     (file_paths, config) = collect_bids_files_configs(bids_dir,
-                                                      aws_input_creds)
-
-    if participant_labels and file_paths:
-        file_paths = [
-            file_path for file_path in file_paths if any(
-                participant_label in file_path
-                for participant_label in participant_labels
-            )
-        ]
+                                                      aws_input_creds,
+                                                      participant_labels)
 
     if not file_paths:
         print("Did not find data for {0}".format(
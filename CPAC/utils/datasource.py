@@ -742,6 +742,7 @@ def check_for_s3(file_path, creds_path=None, dl_dir=None, img_type='other',
     import nibabel as nib
     import botocore.exceptions
     from indi_aws import fetch_creds
+    from CPAC.utils.s3_staging import S3Cache
 
     # Init variables
     s3_str = 's3://'
@@ -773,14 +774,19 @@ def check_for_s3(file_path, creds_path=None, dl_dir=None, img_type='other',
         # Extract relative key path from bucket and local path
         s3_prefix = s3_str + bucket_name
         s3_key = file_path[len(s3_prefix) + 1:]
-        local_path = os.path.join(dl_dir, bucket_name, s3_key)
 
-        # Get local directory and create folders if they dont exist
-        local_dir = os.path.dirname(local_path)
-        if not os.path.exists(local_dir):
-            os.makedirs(local_dir, exist_ok=True)
+        # Resolve against the input cache the run was staged into, if any,
+        # which checks the object's ETag and only downloads a changed object
+        cache = S3Cache.from_environment()
+        if cache is None:
+            local_path = os.path.join(dl_dir, bucket_name, s3_key)
 
-        if os.path.exists(local_path):
+            # Get local directory and create folders if they dont exist
+            local_dir = os.path.dirname(local_path)
+            if not os.path.exists(local_dir):
+                os.makedirs(local_dir, exist_ok=True)
+
+        if cache is None and os.path.exists(local_path):
             print("{0} already exists- skipping download.".format(local_path))
         else:
             # Download file
@@ -788,7 +794,15 @@ def check_for_s3(file_path, creds_path=None, dl_dir=None, img_type='other',
                 bucket = fetch_creds.return_bucket(creds_path, bucket_name)
                 print("Attempting to download from AWS S3: {0}".format(
                     file_path))
-                bucket.download_file(Key=s3_key, Filename=local_path)
+                if cache is None:
+                    bucket.download_file(Key=s3_key, Filename=local_path)
+                else:
+                    # keep every input staged for this run
+                    local_path, downloaded = cache.fetch(bucket, s3_key,
+                                                         evict=False)
+                    if not downloaded:
+                        print("{0} already exists- skipping download."
+                              .format(local_path))
             except botocore.exceptions.ClientError as exc:
                 error_code = int(exc.response['Error']['Code'])
 
@@ -5,12 +5,15 @@ import glob
 import fnmatch
 import string
 import json
+import hashlib
 import os
 import os.path as op
 import shutil
 import re
 import copy
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from os.path import join, dirname
 from shutil import SameFileError
 from warnings import warn
@@ -33,6 +36,161 @@ iflogger = logging.getLogger('nipype.interface')
 
 RETRY = 5
 RETRY_WAIT = 5
+# Files at least this large are uploaded in parts of MULTIPART_CHUNKSIZE
+MULTIPART_THRESHOLD = 64 * 1024 ** 2
+MULTIPART_CHUNKSIZE = 16 * 1024 ** 2
+# Concurrent part uploads per file
+MULTIPART_CONCURRENCY = 4
+# Concurrent file uploads, shared by every DataSink in a process
+UPLOAD_THREADS = int(os.environ.get('CPAC_S3_UPLOAD_THREADS', 8))
+
+# Thread pool per process ID, since a forked process inherits the pool
+# but not its threads
+_upload_pools = {}
+_upload_lock = threading.Lock()
+# Each DataSink that uploads to S3 appends its totals to this file in the
+# run's log directory as a line of JSON, since a participant's sinks can run
+# in several processes
+UPLOAD_LOG = 's3_uploads.jsonl'
+
+
+def _get_upload_pool():
+    """The thread pool S3 uploads are queued in"""
+    with _upload_lock:
+        if os.getpid() not in _upload_pools:
+            _upload_pools[os.getpid()] = ThreadPoolExecutor(
+                max_workers=UPLOAD_THREADS, thread_name_prefix='s3_upload')
+    return _upload_pools[os.getpid()]
+
+
+def _record_uploads(container, totals):
+    """Append one DataSink's upload totals to the run's upload log"""
+    log_path = join(config.get('logging', 'log_directory'), UPLOAD_LOG)
+    try:
+        with open(log_path, 'a') as upload_log:
+            upload_log.write(json.dumps({'container': container,
+                                         **totals}) + '\n')
+    except OSError as os_error:
+        iflogger.warning('Could not record S3 uploads in %s: %s', log_path,
+                         os_error)
+
+
+def upload_totals(log_dir):
+    """Total S3 uploads of every DataSink in a run, per container (e.g.,
+    participant and session)
+
+    Parameters
+    ----------
+    log_dir : str
+        log directory of the run
+
+    Returns
+    -------
+    dict
+        ``{container: {'files': int, 'skipped': int, 'bytes': int,
+        'seconds': float}}``
+    """
+    totals = {}
+    log_path = join(log_dir, UPLOAD_LOG)
+    if not op.exists(log_path):
+        return totals
+    with open(log_path, 'r') as upload_log:
+        for line in upload_log:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a sink that was killed while writing
+                continue
+            container_totals = totals.setdefault(
+                record.pop('container'), {'files': 0, 'skipped': 0,
+                                          'bytes': 0, 'seconds': 0.})
+            for key, value in record.items():
+                container_totals[key] += value
+    return totals
+
+
+def _multipart_chunksize(size):
+    """Part size boto3 uses to upload a file of a given size"""
+    try:
+        from s3transfer.utils import ChunksizeAdjuster
+    except ImportError:
+        return MULTIPART_CHUNKSIZE
+    return ChunksizeAdjuster().adjust_chunksize(MULTIPART_CHUNKSIZE, size)
+
+
+def s3_etag(path):
+    """ETag S3 gives a file uploaded by DataSink, without server-side
+    encryption or with SSE-S3 (AES256)
+
+    Files smaller than ``MULTIPART_THRESHOLD`` are tagged with their MD5;
+    larger files are uploaded in parts and tagged with the MD5 of the
+    concatenated MD5s of their parts and the number of parts.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    str
+    """
+    size = os.path.getsize(path)
+    if size < MULTIPART_THRESHOLD:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as src:
+            for block in iter(lambda: src.read(1024 ** 2), b''):
+                md5.update(block)
+        return md5.hexdigest()
+    chunksize = _multipart_chunksize(size)
+    part_md5s = []
+    with open(path, 'rb') as src:
+        for part in iter(lambda: src.read(chunksize), b''):
+            part_md5s.append(hashlib.md5(part).digest())
+    return '%s-%d' % (hashlib.md5(b''.join(part_md5s)).hexdigest(),
+                      len(part_md5s))
+
+
+def _upload_file(client, bucket_name, src_f, dst_k, extra_args):
+    """Upload a file to S3 unless the same file is already there
+
+    Returns
+    -------
+    int
+        bytes uploaded, or ``None`` if the file was skipped
+    """
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+
+    dst_f = 's3://%s/%s' % (bucket_name, dst_k)
+    # See if same file is already up there
+    try:
+        dst_etag = client.head_object(Bucket=bucket_name,
+                                      Key=dst_k)['ETag'].strip('"')
+        if dst_etag == s3_etag(src_f):
+            iflogger.info('File %s already exists on S3, skipping...', dst_f)
+            return None
+        iflogger.info('Overwriting previous S3 file...')
+    except ClientError:
+        iflogger.info('New file to S3')
+
+    iflogger.info('Uploading %s to S3 bucket, %s, as %s...', src_f,
+                  bucket_name, dst_f)
+    transfer_config = TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=MULTIPART_CONCURRENCY)
+    retry_exc = None
+    for _ in range(RETRY):
+        try:
+            client.upload_file(src_f, bucket_name, dst_k,
+                               ExtraArgs=extra_args,
+                               Callback=ProgressPercentage(src_f),
+                               Config=transfer_config)
+            return os.path.getsize(src_f)
+        except Exception as exc:
+            time.sleep(RETRY_WAIT)
+            retry_exc = exc
+    raise retry_exc
 
 
 def _get_head_bucket(s3_resource, bucket_name):
@@ -374,15 +532,19 @@ class DataSink(IOBase):
 
     def _upload_to_s3(self, bucket, src, dst):
         '''
-        Method to upload outputs to S3 bucket instead of on local disk
+        Method to queue outputs for upload to S3 bucket instead of on
+        local disk
+
+        Returns
+        -------
+        list of concurrent.futures.Future
+            one per file, resolving to the bytes uploaded or ``None`` if
+            the file was already on S3
         '''
 
         # Import packages
-        import hashlib
         import os
 
-        from botocore.exceptions import ClientError
-
         # Init variables
         s3_str = 's3://'
         s3_prefix = s3_str + bucket.name
@@ -405,55 +567,43 @@ class DataSink(IOBase):
             src_files = [src]
             dst_files = [dst]
 
-        # Iterate over src and copy to dst
-        for src_idx, src_f in enumerate(src_files):
-            # Get destination filename/keyname
-            dst_f = dst_files[src_idx]
-            dst_k = dst_f.replace(s3_prefix, '').lstrip('/')
-
-            # See if same file is already up there
-            try:
-                dst_obj = bucket.Object(key=dst_k)
-                dst_md5 = dst_obj.e_tag.strip('"')
-
-                # See if same file is already there
-                src_read = open(src_f, 'rb').read()
-                src_md5 = hashlib.md5(src_read).hexdigest()
-                # Move to next loop iteration
-                if dst_md5 == src_md5:
-                    iflogger.info('File %s already exists on S3, skipping...',
-                                  dst_f)
-                    continue
-                else:
-                    iflogger.info('Overwriting previous S3 file...')
-
-            except ClientError:
-                iflogger.info('New file to S3')
-
-            # Copy file up to S3 (either encrypted or not)
-            iflogger.info('Uploading %s to S3 bucket, %s, as %s...', src_f,
-                          bucket.name, dst_f)
-            if self.inputs.encrypt_bucket_keys:
-                extra_args = {'ServerSideEncryption': 'AES256'}
-            else:
-                extra_args = {}
+        # Upload either encrypted or not
+        if self.inputs.encrypt_bucket_keys:
+            extra_args = {'ServerSideEncryption': 'AES256'}
+        else:
+            extra_args = {}
 
-            retry_exc = None
-            for _ in range(RETRY):
-                try:
-                    bucket.upload_file(
-                        src_f,
-                        dst_k,
-                        ExtraArgs=extra_args,
-                        Callback=ProgressPercentage(src_f)
-                    )
-                    break
-                except Exception as exc:
-                    time.sleep(RETRY_WAIT)
-                    retry_exc = exc
+        # Queue each src to copy to dst; boto3 clients, unlike buckets,
+        # are thread-safe
+        pool = _get_upload_pool()
+        return [pool.submit(_upload_file, bucket.meta.client, bucket.name,
+                            src_f, dst_f.replace(s3_prefix, '').lstrip('/'),
+                            extra_args)
+                for src_f, dst_f in zip(src_files, dst_files)]
 
-            if retry_exc is not None:
-                raise retry_exc
+    def _wait_for_uploads(self, uploads, start):
+        '''
+        Method to wait for queued uploads to finish and report their
+        throughput
+        '''
+        wait(uploads)
+        uploaded = [upload.result() for upload in uploads
+                    if upload.exception() is None]
+        sizes = [size for size in uploaded if size is not None]
+        seconds = time.time() - start
+        megabytes = sum(sizes) / 1024 ** 2
+        container = (self.inputs.container if
+                     isdefined(self.inputs.container) else '')
+        iflogger.info('Uploaded %d files (%.1f MB) to S3 in %.1f s '
+                      '(%.1f MB/s); skipped %d unchanged files', len(sizes),
+                      megabytes, seconds, megabytes / max(seconds, 1e-6),
+                      len(uploaded) - len(sizes))
+        _record_uploads(container, {'files': len(sizes),
+                                    'skipped': len(uploaded) - len(sizes),
+                                    'bytes': sum(sizes), 'seconds': seconds})
+        for upload in uploads:
+            if upload.exception() is not None:
+                raise upload.exception()
 
     # List outputs, main run routine
     def _list_outputs(self):
@@ -463,6 +613,8 @@ class DataSink(IOBase):
         # Init variables
         outputs = self.output_spec().get()
         out_files = []
+        uploads = []
+        start = time.time()
         # Use hardlink
         use_hardlink = str2bool(
             config.get('execution', 'try_hard_link_datasink'))
@@ -558,7 +710,7 @@ class DataSink(IOBase):
 
                 # If we're uploading to S3
                 if s3_flag:
-                    self._upload_to_s3(bucket, src, s3dst)
+                    uploads += self._upload_to_s3(bucket, src, s3dst)
                     out_files.append(s3dst)
                 # Otherwise, copy locally src -> dst
                 if not s3_flag or isdefined(self.inputs.local_copy):
@@ -600,6 +752,10 @@ class DataSink(IOBase):
                     except SameFileError:
                         iflogger.debug(f'copyfile (same file): {src} {dst}')
 
+        # Wait for S3 uploads, which run alongside any local copying
+        if uploads:
+            self._wait_for_uploads(uploads, start)
+
         # Return outputs dictionary
         outputs['out_file'] = out_files
 
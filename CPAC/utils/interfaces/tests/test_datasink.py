@@ -0,0 +1,82 @@
+"""Tests for uploading DataSink outputs to S3"""
+import os
+
+import boto3
+from moto import mock_s3
+import pytest
+
+from nipype import config
+
+from CPAC.utils.interfaces import datasink
+from CPAC.utils.interfaces.datasink import DataSink, s3_etag, upload_totals
+
+BUCKET = 'cpac-test-outputs'
+
+
+@pytest.fixture(name='bucket')
+def fixture_bucket(monkeypatch):
+    """A mocked, empty bucket"""
+    for var in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(var, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_s3():
+        s3 = boto3.resource('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3.Bucket(BUCKET)
+
+
+@pytest.fixture(name='log_dir')
+def fixture_log_dir(tmp_path):
+    """A log directory for the run"""
+    log_dir = config.get('logging', 'log_directory')
+    config.set('logging', 'log_directory', str(tmp_path / 'log'))
+    os.makedirs(tmp_path / 'log')
+    yield str(tmp_path / 'log')
+    config.set('logging', 'log_directory', log_dir)
+
+
+def _sink(bucket, outputs):
+    sink = DataSink()
+    sink.inputs.base_directory = f's3://{BUCKET}/output'
+    sink.inputs.container = 'pipeline_test/sub-1_ses-1'
+    sink.inputs.bucket = bucket
+    for key, path in outputs.items():
+        setattr(sink.inputs, key, path)
+    return sink.run().outputs.out_file
+
+
+@pytest.mark.parametrize('encrypt', [False, True])
+def test_s3_upload(bucket, encrypt, log_dir, monkeypatch, tmp_path):
+    """Small and multipart files upload concurrently, with ETags matching
+    s3_etag, and unchanged files are skipped"""
+    monkeypatch.setattr(datasink, 'MULTIPART_THRESHOLD', 5 * 1024 ** 2)
+    monkeypatch.setattr(datasink, 'MULTIPART_CHUNKSIZE', 5 * 1024 ** 2)
+    monkeypatch.chdir(tmp_path)
+    sizes = {'anat.@small': 1024, 'func.@large': 12 * 1024 ** 2 + 1}
+    outputs = {}
+    for key, size in sizes.items():
+        outputs[key] = str(tmp_path / f'{key.split(".")[0]}.nii.gz')
+        with open(outputs[key], 'wb') as out_file:
+            out_file.write(os.urandom(size))
+
+    out_files = _sink(bucket, outputs)
+    assert sorted(out_files) == [
+        f's3://{BUCKET}/output/pipeline_test/sub-1_ses-1/anat/anat.nii.gz',
+        f's3://{BUCKET}/output/pipeline_test/sub-1_ses-1/func/func.nii.gz']
+    for key, path in outputs.items():
+        s3_object = bucket.Object(
+            f'output/pipeline_test/sub-1_ses-1/{key.split(".")[0]}/'
+            f'{os.path.basename(path)}')
+        assert s3_object.content_length == sizes[key]
+        assert s3_object.e_tag.strip('"') == s3_etag(path)
+    assert s3_etag(outputs['func.@large']).endswith('-3')
+    totals = upload_totals(log_dir)['pipeline_test/sub-1_ses-1']
+    assert totals['files'] == 2
+    assert totals['bytes'] == sum(sizes.values())
+
+    # each sink's totals are added up from the run's upload log
+    _sink(bucket, outputs)
+    totals = upload_totals(log_dir)['pipeline_test/sub-1_ses-1']
+    assert totals['files'] == 2
+    assert totals['skipped'] == 2
+    assert totals['bytes'] == sum(sizes.values())
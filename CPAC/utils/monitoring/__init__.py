@@ -7,8 +7,11 @@ from .custom_logging import failed_to_start, getLogger, set_up_logger
 from .monitoring import LoggingHTTPServer, LoggingRequestHandler, \
                         log_nodes_cb, log_nodes_initial, monitor_server, \
                         recurse_nodes
+from .usage_model import input_data_features, MemoryModel, node_type, \
+                         RuntimeModel
 
 __all__ = ['failed_to_start', 'getLogger', 'LoggingHTTPServer',
            'LoggingRequestHandler', 'log_nodes_cb', 'log_nodes_initial',
-           'LOGTAIL', 'monitor_server', 'recurse_nodes', 'set_up_logger',
+           'input_data_features', 'LOGTAIL', 'MemoryModel', 'monitor_server',
+           'node_type', 'recurse_nodes', 'RuntimeModel', 'set_up_logger',
            'WARNING_FREESURFER_OFF_WITH_DATA']
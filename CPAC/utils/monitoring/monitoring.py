@@ -10,6 +10,7 @@ from traits.trait_base import Undefined
 
 from CPAC.pipeline import nipype_pipeline_engine as pe
 from .custom_logging import getLogger
+from .usage_model import input_data_features
 
 
 # Log initial information from all the nodes
@@ -61,8 +62,10 @@ def log_nodes_cb(node, status):
         return
 
     try:
-        runtime = node.result.runtime
+        result = node.result
+        runtime = result.runtime
     except FileNotFoundError:
+        result = None
         runtime = {}
     runtime_threads = getattr(runtime, 'cpu_percent', 'N/A')
     if runtime_threads != 'N/A':
@@ -84,6 +87,12 @@ def log_nodes_cb(node, status):
         node.input_data_shape is not Undefined
     ):
         status_dict['input_data_shape'] = node.input_data_shape
+    # record the size of the input data to model usage in future runs
+    features = input_data_features(getattr(result, 'inputs', None))
+    if features is not None:
+        status_dict.setdefault('input_data_shape',
+                               features['input_data_shape'])
+        status_dict['num_image_inputs'] = features['num_image_inputs']
 
     if status_dict['start'] is None or status_dict['finish'] is None:
         status_dict['error'] = True
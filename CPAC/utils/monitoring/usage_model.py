@@ -0,0 +1,313 @@
+# Copyright (C) 2023  C-PAC Developers
+
+# This file is part of C-PAC.
+
+# C-PAC is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# C-PAC is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public
+# License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
+"""Models of node resource usage learned from callback logs of prior runs
+
+Each node in a ``callback.log`` is keyed by its node type (its name
+without any trailing pipe or strategy numbers), so observations from
+different participants, sessions and pipelines are pooled, and usage is
+modeled against the size of the node's input data.
+"""
+from datetime import datetime
+import glob
+import json
+import os
+import re
+
+import numpy as np
+from scipy.optimize import nnls
+
+from .custom_logging import getLogger
+
+IMAGE_EXTENSIONS = ('.nii', '.nii.gz', '.mgz', '.mgh')
+logger = getLogger('nipype.workflow')
+
+
+def callback_log_paths(usage):
+    """Expand one or more callback log paths or glob patterns
+
+    Parameters
+    ----------
+    usage : str or list of str
+
+    Returns
+    -------
+    list of str
+    """
+    if isinstance(usage, str):
+        usage = [usage]
+    paths = []
+    for pattern in usage:
+        paths += sorted(glob.glob(pattern)) or [pattern]
+    return paths
+
+
+def input_data_features(inputs):
+    """Summarize the image inputs of a node as the features the usage
+    models are fit on
+
+    Parameters
+    ----------
+    inputs : dict
+        a node's inputs, e.g. ``node.inputs.get()`` or
+        ``node.result.inputs``
+
+    Returns
+    -------
+    dict or None
+        ``{'input_data_shape': [x, y, z, t], 'num_image_inputs': n}``
+        where the shape is the largest of the node's image inputs, or
+        ``None`` if the node has no image inputs
+
+    Examples
+    --------
+    >>> input_data_features({'in_file': 'not_a_file.nii.gz'}) is None
+    True
+    """
+    # pylint: disable=import-outside-toplevel
+    import nibabel as nib
+
+    def image_paths(value):
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                yield from image_paths(item)
+        elif (isinstance(value, str) and value.endswith(IMAGE_EXTENSIONS)
+              and os.path.isfile(value)):
+            yield value
+
+    shapes = []
+    for value in (inputs or {}).values():
+        for path in image_paths(value):
+            try:
+                shape = nib.load(path).shape
+            except Exception:  # pylint: disable=broad-except
+                continue
+            shapes.append((list(shape[:4]) + [1] * 4)[:4])
+    if not shapes:
+        return None
+    return {'input_data_shape': max(shapes, key=np.prod),
+            'num_image_inputs': len(shapes)}
+
+
+def node_type(node_id):
+    """Get the type of a node from its ID
+
+    Parameters
+    ----------
+    node_id : str
+        e.g., ``node.fullname`` or the ``id`` of a callback log entry
+
+    Returns
+    -------
+    str
+
+    Examples
+    --------
+    >>> node_type('cpac_sub-1.func_preproc_0.func_reorient_12')
+    'func_reorient'
+    >>> node_type('anat_skullstrip')
+    'anat_skullstrip'
+    """
+    return re.sub(r'(_\d+)+$', '', node_id.rsplit('.', 1)[-1])
+
+
+class UsageModel:
+    """Per-node-type model of one resource recorded in callback logs
+
+    For each node type, usage is fit as a non-negative linear combination
+    of a constant, the number of input voxel-timepoints (``x*y*z*t``),
+    the number of input voxels (``x*y*z``) and the number of image inputs.
+    The fit is then shifted up by its largest underestimate so that it
+    bounds every observation, and scaled by ``1 + buffer / 100``. Without
+    input data features, or with fewer than ``min_observations`` of a
+    node type, the largest observation of that node type is used.
+    """
+    key = None  # callback log field modeled
+
+    def __init__(self, buffer=0, min_observations=3):
+        self.buffer = buffer
+        self.min_observations = min_observations
+        self._observations = {}
+        self._fits = {}
+
+    @classmethod
+    def from_callback_logs(cls, usage, buffer=0, min_observations=3):
+        """Build a model from one or more callback logs
+
+        Parameters
+        ----------
+        usage : str or list of str
+            paths or glob patterns of callback logs
+
+        buffer : int or float
+            percent
+
+        min_observations : int
+
+        Returns
+        -------
+        UsageModel
+        """
+        model = cls(buffer, min_observations)
+        for path in callback_log_paths(usage):
+            try:
+                with open(path, 'r', encoding='utf-8') as cbl:
+                    for line in cbl:
+                        try:
+                            model.add_log_entry(json.loads(line))
+                        except ValueError:
+                            continue
+            except OSError as os_error:
+                logger.warning('Could not read callback log %s: %s', path,
+                               os_error)
+        return model
+
+    @staticmethod
+    def _features(features):
+        """Feature vector for a dict from :py:func:`input_data_features`"""
+        if not features or 'input_data_shape' not in features:
+            return None
+        shape = (list(features['input_data_shape'][:4]) + [1] * 4)[:4]
+        xyz = float(np.prod(shape[:3]))
+        return [1., xyz * shape[3] / 1e9, xyz / 1e6,
+                float(features.get('num_image_inputs', 1))]
+
+    def _observation(self, entry):
+        """Observed usage in a callback log entry, or ``None``"""
+        value = entry.get(self.key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        return float(value)
+
+    def add_log_entry(self, entry):
+        """Add an observation from a parsed line of a callback log
+
+        Parameters
+        ----------
+        entry : dict
+        """
+        if not isinstance(entry, dict) or 'id' not in entry or entry.get(
+                'error'):
+            return
+        value = self._observation(entry)
+        if value is None:
+            return
+        self.add(entry['id'], value, entry)
+
+    def add(self, node_id, value, features=None):
+        """Add an observation
+
+        Parameters
+        ----------
+        node_id : str
+
+        value : float
+
+        features : dict or None
+            see :py:func:`input_data_features`
+        """
+        self._observations.setdefault(node_type(node_id), []).append(
+            (self._features(features), value))
+        self._fits.pop(node_type(node_id), None)
+
+    def __contains__(self, node_id):
+        return node_type(node_id) in self._observations
+
+    def __len__(self):
+        return len(self._observations)
+
+    def _fit(self, ntype):
+        if ntype not in self._fits:
+            observations = self._observations[ntype]
+            featured = [(x, y) for x, y in observations if x is not None]
+            coefficients = None
+            if len(featured) >= self.min_observations:
+                X = np.array([x for x, _ in featured])
+                y = np.array([y for _, y in featured])
+                coefficients, _ = nnls(X, y)
+                coefficients[0] += max(0., np.max(y - X @ coefficients))
+            self._fits[ntype] = (
+                coefficients, max(y for _, y in observations))
+        return self._fits[ntype]
+
+    def predict(self, node_id, features=None):
+        """Predict the usage of a node
+
+        Parameters
+        ----------
+        node_id : str
+
+        features : dict or None
+            see :py:func:`input_data_features`
+
+        Returns
+        -------
+        float or None
+            ``None`` if no node of this type has been observed
+        """
+        ntype = node_type(node_id)
+        if ntype not in self._observations:
+            return None
+        coefficients, observed_max = self._fit(ntype)
+        x = self._features(features)
+        if coefficients is None or x is None:
+            estimate = observed_max
+        else:
+            estimate = float(np.dot(coefficients, x))
+        return estimate * (1 + self.buffer / 100)
+
+
+class MemoryModel(UsageModel):
+    """Model of peak memory usage (GB) per node type
+
+    Examples
+    --------
+    >>> model = MemoryModel(buffer=10)
+    >>> for t in (100, 200, 300):
+    ...     model.add('cpac_sub-1.func_preproc_0.func_reorient_0',
+    ...               0.5 + t / 100, {'input_data_shape': [10, 10, 10, t]})
+    >>> round(model.predict('func_reorient_3', {
+    ...     'input_data_shape': [10, 10, 10, 400]}), 3)
+    4.95
+    >>> round(model.predict('func_reorient_3'), 3)
+    3.85
+    >>> model.predict('anat_skullstrip') is None
+    True
+    """
+    key = 'runtime_memory_gb'
+
+
+class RuntimeModel(UsageModel):
+    """Model of runtime (seconds) per node type, from the ``start`` and
+    ``finish`` of each node in the callback logs
+
+    Examples
+    --------
+    >>> model = RuntimeModel()
+    >>> model.add_log_entry({'id': 'cpac_sub-1.wf_0.register_0',
+    ...                      'start': '2023-01-01T00:00:00',
+    ...                      'finish': '2023-01-01T00:10:30'})
+    >>> model.predict('register_1')
+    630.0
+    """
+    key = 'runtime_seconds'
+
+    def _observation(self, entry):
+        try:
+            return (datetime.fromisoformat(entry['finish']) -
+                    datetime.fromisoformat(entry['start'])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            return None
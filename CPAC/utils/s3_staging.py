@@ -0,0 +1,458 @@
+# Copyright (C) 2023  C-PAC Developers
+
+# This file is part of C-PAC.
+
+# C-PAC is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# C-PAC is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public
+# License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with C-PAC. If not, see <https://www.gnu.org/licenses/>.
+"""Staging of S3 inputs into a shared local cache before a run starts
+
+Objects are cached under ``<cache>/objects/<hash of bucket/key>/<ETag>/``
+with their original filenames, so a cached copy is only reused while the
+object in the bucket is unchanged. The cache is capped in size, evicting
+the least recently used objects first, and downloads land in temporary
+files that are only moved into place once complete, so an interrupted
+prefetch resumes from the objects it had not finished.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from CPAC.utils.monitoring.custom_logging import getLogger
+
+CACHE_ENV = 'CPAC_S3_CACHE'
+CACHE_SIZE_ENV = 'CPAC_S3_CACHE_MAX_GB'
+S3_PREFIX = 's3://'
+logger = getLogger('nipype.workflow')
+
+
+def split_s3_path(s3_path):
+    """Split an S3 URI into its bucket name and key
+
+    Parameters
+    ----------
+    s3_path : str
+
+    Returns
+    -------
+    bucket_name : str
+
+    key : str
+
+    Examples
+    --------
+    >>> split_s3_path('S3://fcp-indi/resources/cpac/rois_2mm.nii.gz')
+    ('fcp-indi', 'resources/cpac/rois_2mm.nii.gz')
+    """
+    bucket_name, _, key = s3_path[len(S3_PREFIX):].partition('/')
+    return bucket_name, key
+
+
+def s3_paths(config):
+    """Find every S3 URI in a data or pipeline configuration
+
+    Parameters
+    ----------
+    config : dict, list or str
+        e.g., a participant's entry in a data configuration
+
+    Returns
+    -------
+    list of str
+        unique S3 URIs, in the order they are first found
+
+    Examples
+    --------
+    >>> s3_paths({'anat': 's3://bucket/sub-1/anat/T1w.nii.gz',
+    ...           'func': {'rest': {'scan': 's3://bucket/sub-1/bold.nii.gz',
+    ...                             'scan_parameters': None}},
+    ...           'site': 'site-1',
+    ...           'templates': ['/local.nii.gz',
+    ...                         's3://bucket/sub-1/anat/T1w.nii.gz']})
+    ['s3://bucket/sub-1/anat/T1w.nii.gz', 's3://bucket/sub-1/bold.nii.gz']
+    """
+    found = {}
+
+    def walk(value):
+        if isinstance(value, dict):
+            for item in value.values():
+                walk(item)
+        elif isinstance(value, (list, tuple, set)):
+            for item in value:
+                walk(item)
+        elif isinstance(value, str) and value.lower().startswith(S3_PREFIX):
+            found.setdefault(S3_PREFIX + value[len(S3_PREFIX):], None)
+
+    walk(config)
+    return list(found)
+
+
+def _default_get_bucket(creds_path, bucket_name):
+    # pylint: disable=import-outside-toplevel
+    from indi_aws import fetch_creds
+    return fetch_creds.return_bucket(creds_path, bucket_name)
+
+
+def _client_error_code(exc):
+    """HTTP status code of a botocore ``ClientError``, else ``None``"""
+    try:
+        return int(exc.response['Error']['Code'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class S3Cache:
+    """Size-capped local cache of S3 objects keyed by bucket, key and ETag
+
+    Parameters
+    ----------
+    path : str
+        cache directory, which can be shared between runs and participants
+
+    max_size_gb : float or None
+        evict the least recently used objects to keep the cache under this
+        size; ``None`` for no limit
+    """
+    def __init__(self, path, max_size_gb=None):
+        self.path = os.path.abspath(path)
+        self.max_size_gb = max_size_gb
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        """The cache configured for this run in the environment, if any
+
+        Returns
+        -------
+        S3Cache or None
+        """
+        path = os.environ.get(CACHE_ENV)
+        if not path:
+            return None
+        max_size_gb = os.environ.get(CACHE_SIZE_ENV)
+        return cls(path, float(max_size_gb) if max_size_gb else None)
+
+    def to_environment(self):
+        """Make this the cache :py:meth:`from_environment` returns for
+        this process and any it starts"""
+        os.environ[CACHE_ENV] = self.path
+        if self.max_size_gb is None:
+            os.environ.pop(CACHE_SIZE_ENV, None)
+        else:
+            os.environ[CACHE_SIZE_ENV] = str(self.max_size_gb)
+
+    def object_dir(self, bucket_name, key):
+        """Directory holding every cached version of an object"""
+        digest = hashlib.sha1(f'{bucket_name}/{key}'.encode()).hexdigest()
+        return os.path.join(self.path, 'objects', digest)
+
+    def cached_path(self, bucket_name, key, etag):
+        """Path of a version of an object in the cache, whether or not it
+        has been downloaded"""
+        return os.path.join(self.object_dir(bucket_name, key),
+                            etag.strip('"'), os.path.basename(key))
+
+    def lookup(self, bucket_name, key):
+        """Most recently used cached version of an object, without
+        checking the bucket
+
+        Returns
+        -------
+        str or None
+        """
+        object_dir = self.object_dir(bucket_name, key)
+        versions = []
+        if os.path.isdir(object_dir):
+            for entry in os.scandir(object_dir):
+                path = os.path.join(entry.path, os.path.basename(key))
+                if entry.is_dir() and os.path.isfile(path):
+                    versions.append((entry.stat().st_mtime, path))
+        if not versions:
+            return None
+        path = max(versions)[1]
+        self._touch(path)
+        return path
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(os.path.dirname(path))
+        except OSError:
+            pass
+
+    def fetch(self, bucket, key, retries=3, retry_wait=1., evict=True):
+        """Get the current version of an object, downloading it into the
+        cache only if it is not already there
+
+        Parameters
+        ----------
+        bucket : boto3.resources.factory.s3.Bucket
+
+        key : str
+
+        retries : int
+            number of times to retry a failed download; missing objects
+            and denied access are not retried
+
+        retry_wait : float
+            seconds to wait before the first retry, doubling for each
+            subsequent retry
+
+        evict : bool
+            evict other objects to fit a download in ``max_size_gb``;
+            during a run, nothing is evicted after its inputs are staged,
+            so no path already handed out is removed while it is needed
+
+        Returns
+        -------
+        local_path : str
+
+        downloaded : int
+            bytes downloaded, 0 if the cached copy was current
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._fetch(bucket, key, evict)
+            except Exception as exc:  # pylint: disable=broad-except
+                if (_client_error_code(exc) in (403, 404) or
+                        attempt >= retries):
+                    raise
+                logger.warning('Retrying download of s3://%s/%s (%s)',
+                               bucket.name, key, exc)
+                time.sleep(retry_wait * 2 ** attempt)
+                attempt += 1
+
+    def _fetch(self, bucket, key, evict=True):
+        s3_object = bucket.Object(key)
+        local_path = self.cached_path(bucket.name, key, s3_object.e_tag)
+        if os.path.isfile(local_path):
+            self._touch(local_path)
+            return local_path, 0
+        version_dir = os.path.dirname(local_path)
+        os.makedirs(version_dir, exist_ok=True)
+        partial = os.path.join(
+            os.path.dirname(version_dir),
+            f'.{os.path.basename(key)}.{uuid.uuid4().hex}.partial')
+        try:
+            s3_object.download_file(partial)
+            size = os.path.getsize(partial)
+            if size != s3_object.content_length:
+                raise IOError(f'Downloaded {size} of '
+                              f'{s3_object.content_length} bytes of '
+                              f's3://{bucket.name}/{key}')
+            os.replace(partial, local_path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self._remove_other_versions(local_path)
+        if evict:
+            self.evict(keep={local_path})
+        return local_path, size
+
+    @staticmethod
+    def _remove_other_versions(local_path):
+        version_dir = os.path.dirname(local_path)
+        object_dir = os.path.dirname(version_dir)
+        for entry in os.scandir(object_dir):
+            if entry.is_dir() and entry.path != version_dir:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _versions(self):
+        """Every cached version, as ``(last used, bytes, directory)``"""
+        objects_dir = os.path.join(self.path, 'objects')
+        if not os.path.isdir(objects_dir):
+            return []
+        versions = []
+        for object_dir in os.scandir(objects_dir):
+            if not object_dir.is_dir():
+                continue
+            for version in os.scandir(object_dir.path):
+                if not version.is_dir():
+                    continue
+                size = sum(entry.stat().st_size for entry in
+                           os.scandir(version.path) if entry.is_file())
+                versions.append((version.stat().st_mtime, size,
+                                 version.path))
+        return versions
+
+    def size(self):
+        """Total bytes cached"""
+        return sum(size for _, size, _ in self._versions())
+
+    def evict(self, keep=None):
+        """Remove least recently used objects until the cache fits in
+        ``max_size_gb``
+
+        Parameters
+        ----------
+        keep : iterable of str, optional
+            cached paths not to evict, e.g. the inputs of the current run
+
+        Returns
+        -------
+        int
+            bytes evicted
+        """
+        if self.max_size_gb is None:
+            return 0
+        keep = {os.path.dirname(path) for path in keep or ()}
+        limit = self.max_size_gb * 1024 ** 3
+        evicted = 0
+        with self._lock:
+            versions = sorted(self._versions())
+            total = sum(size for _, size, _ in versions)
+            for _, size, version_dir in versions:
+                if total <= limit:
+                    break
+                if version_dir in keep:
+                    continue
+                shutil.rmtree(version_dir, ignore_errors=True)
+                total -= size
+                evicted += size
+        if total > limit:
+            logger.warning('S3 input cache %s holds %.2f GB, more than its '
+                           '%s GB limit, because the current run needs it',
+                           self.path, total / 1024 ** 3, self.max_size_gb)
+        return evicted
+
+
+def prefetch_s3_inputs(paths, cache, creds_path=None, num_threads=8,
+                       retries=3, retry_wait=1., get_bucket=None):
+    """Download S3 objects into a cache concurrently
+
+    The cache is only evicted once every object is staged, keeping all of
+    them, even if together they are larger than ``cache.max_size_gb``.
+
+    Parameters
+    ----------
+    paths : list of str or dict
+        S3 URIs, or a mapping of S3 URIs to the credentials to access each
+
+    cache : S3Cache
+
+    creds_path : str or None
+        credentials for any URI not in a mapping
+
+    num_threads : int
+        maximum number of concurrent downloads
+
+    retries : int
+
+    retry_wait : float
+        see :py:meth:`S3Cache.fetch`
+
+    get_bucket : function, optional
+        ``get_bucket(creds_path, bucket_name)`` returns a boto3 bucket;
+        defaults to ``indi_aws.fetch_creds.return_bucket``
+
+    Returns
+    -------
+    dict
+        local path of each S3 URI
+
+    Raises
+    ------
+    Exception
+        if any object could not be downloaded, after every other download
+        has finished
+    """
+    if not isinstance(paths, dict):
+        paths = {path: creds_path for path in paths}
+    if get_bucket is None:
+        get_bucket = _default_get_bucket
+    # boto3 resources are not thread-safe, so each thread gets its own
+    local = threading.local()
+
+    def thread_bucket(creds, bucket_name):
+        buckets = local.__dict__.setdefault('buckets', {})
+        if (creds, bucket_name) not in buckets:
+            buckets[(creds, bucket_name)] = get_bucket(creds, bucket_name)
+        return buckets[(creds, bucket_name)]
+
+    def fetch(path, creds):
+        bucket_name, key = split_s3_path(path)
+        # evicting per download could remove inputs already staged
+        return cache.fetch(thread_bucket(creds, bucket_name), key,
+                           retries=retries, retry_wait=retry_wait,
+                           evict=False)
+
+    local_paths = {}
+    failures = {}
+    downloaded = 0
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        futures = {pool.submit(fetch, path, creds): path for
+                   path, creds in paths.items()}
+        for future in as_completed(futures):
+            try:
+                local_paths[futures[future]], size = future.result()
+                downloaded += size
+            except Exception as exc:  # pylint: disable=broad-except
+                failures[futures[future]] = exc
+    logger.info('Staged %d S3 inputs in %s (%.1f MB downloaded in %.1f s)',
+                len(local_paths), cache.path, downloaded / 1024 ** 2,
+                time.time() - start)
+    cache.evict(keep=local_paths.values())
+    if failures:
+        raise Exception('Unable to download from S3:\n' + '\n'.join(
+            f'{path}: {exc}' for path, exc in failures.items()))
+    return {path: local_paths[path] for path in paths}
+
+
+def stage_inputs(sublist, cfg, get_bucket=None):
+    """Prefetch every S3 input in a data configuration into the configured
+    cache, and make that cache the one
+    :py:func:`CPAC.utils.datasource.check_for_s3` resolves S3 paths against
+
+    S3 paths in the pipeline configuration (e.g., templates) are not
+    prefetched, since many are only used by options that are off, but are
+    still fetched into the shared cache the first time a node needs them.
+
+    Parameters
+    ----------
+    sublist : list of dict
+        data configuration
+
+    cfg : CPAC.utils.configuration.Configuration
+
+    get_bucket : function, optional
+        see :py:func:`prefetch_s3_inputs`
+
+    Returns
+    -------
+    dict or None
+        local path of each S3 URI, or ``None`` if no cache is configured
+    """
+    cache_cfg = cfg['pipeline_setup', 'Amazon-AWS', 'input_cache']
+    if not cache_cfg['path']:
+        return None
+    cache = S3Cache(cache_cfg['path'], cache_cfg['max_size_gb'])
+    cache.to_environment()
+    paths = {}
+    for sub_dict in sublist:
+        creds_path = sub_dict.get('creds_path')
+        if not creds_path or 'none' in str(creds_path).lower():
+            creds_path = None
+        for path in s3_paths({key: value for key, value in sub_dict.items()
+                              if key != 'creds_path'}):
+            paths[path] = creds_path
+    if not paths:
+        return {}
+    return prefetch_s3_inputs(paths, cache,
+                              num_threads=cache_cfg['num_threads'],
+                              retries=cache_cfg['retries'],
+                              get_bucket=get_bucket)
@@ -0,0 +1,118 @@
+"""Tests for the persistent BIDS index"""
+import json
+import os
+
+import boto3
+from botocore.paginate import Paginator
+from moto import mock_s3
+import pytest
+
+from CPAC.utils.bids_index import BIDSIndex
+
+BUCKET = 'cpac-test-bids'
+FILES = {
+    'task-rest_bold.json': {'RepetitionTime': 2.0},
+    'participants.tsv': None,
+    'sub-1/anat/sub-1_T1w.nii.gz': None,
+    'sub-1/func/sub-1_task-rest_bold.nii.gz': None,
+    'sub-1/func/sub-1_task-rest_bold.json': {'SliceTiming': [0, 1]},
+    'sub-1/fmap/sub-1_dir-AP_epi.nii.gz': None,
+    'sub-1/fmap/sub-1_acq-fMRI_dir-AP_epi.nii.gz': None,
+    'sub-2/anat/sub-2_T1w.nii.gz': None,
+    'sub-2/anat/sub-2_T1w.json': {'EchoTime': 0.003}}
+
+
+def _content(path):
+    return b'' if FILES[path] is None else json.dumps(FILES[path]).encode()
+
+
+def _expected(participant_labels=None):
+    def selected(path):
+        return not participant_labels or any(
+            label in path for label in participant_labels)
+    return ([path for path in sorted(FILES) if 'nii' in path and
+             path != 'sub-1/fmap/sub-1_dir-AP_epi.nii.gz' and
+             selected(path)],
+            {path: FILES[path] for path in FILES if path.endswith('json') and
+             (selected(path) or '/' not in path)})
+
+
+def test_local_index(tmp_path):
+    """A local dataset is indexed, only changed sidecars are read again,
+    and removed files leave the index"""
+    bids_dir = tmp_path / 'bids'
+    for path in FILES:
+        (bids_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (bids_dir / path).write_bytes(_content(path))
+    # a dangling link, as to an image not yet fetched by git-annex
+    annexed = 'sub-3/anat/sub-3_T1w.nii.gz'
+    (bids_dir / annexed).parent.mkdir(parents=True)
+    os.symlink(tmp_path / 'nonexistent', bids_dir / annexed)
+    index_path = str(tmp_path / 'index.sqlite')
+    with BIDSIndex(str(bids_dir), index_path=index_path,
+                   num_threads=3) as index:
+        assert index.refresh() == (8, 3)
+        file_paths, config_dict = index.files_and_sidecars()
+        assert file_paths == sorted(_expected()[0] + [annexed])
+        assert config_dict == _expected()[1]
+        os.remove(bids_dir / annexed)
+        assert index.refresh() == (7, 0)
+        assert index.files_and_sidecars() == _expected()
+        assert index.files_and_sidecars(['sub-2']) == _expected(['sub-2'])
+        assert index.refresh() == (7, 0)
+
+    sidecar = bids_dir / 'sub-2/anat/sub-2_T1w.json'
+    sidecar.write_text(json.dumps({'EchoTime': 0.004}))
+    os.utime(sidecar, ns=(1, 1))
+    os.remove(bids_dir / 'sub-1/anat/sub-1_T1w.nii.gz')
+    # a new connection picks up where the last left off
+    with BIDSIndex(str(bids_dir), index_path=index_path) as index:
+        assert index.refresh() == (6, 1)
+        file_paths, config_dict = index.files_and_sidecars()
+    assert 'sub-1/anat/sub-1_T1w.nii.gz' not in file_paths
+    assert config_dict['sub-2/anat/sub-2_T1w.json'] == {'EchoTime': 0.004}
+
+
+@pytest.fixture(name='bucket')
+def fixture_bucket(monkeypatch):
+    """A mocked bucket with a BIDS dataset in it"""
+    for var in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(var, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_s3():
+        s3 = boto3.resource('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        for path in FILES:
+            s3.Object(BUCKET, f'data/bids/{path}').put(Body=_content(path))
+        yield s3.Bucket(BUCKET)
+
+
+def _get_bucket(creds_path, bucket_name):
+    # pylint: disable=unused-argument
+    return boto3.resource('s3').Bucket(bucket_name)
+
+
+def test_s3_index(bucket, monkeypatch, tmp_path):
+    """An S3 dataset is indexed one participant per task, and only
+    sidecars whose ETags changed are read again"""
+    listed = []
+    paginate = Paginator.paginate
+
+    def record_paginate(self, **kwargs):
+        listed.append(kwargs['Prefix'])
+        return paginate(self, **kwargs)
+
+    monkeypatch.setattr(Paginator, 'paginate', record_paginate)
+    index_path = str(tmp_path / 'index.sqlite')
+    with BIDSIndex(f's3://{BUCKET}/data/bids', index_path=index_path,
+                   num_threads=3, get_bucket=_get_bucket) as index:
+        assert index.refresh() == (7, 3)
+        assert sorted(listed) == ['data/bids/', 'data/bids/sub-1/',
+                                  'data/bids/sub-2/']
+        assert index.files_and_sidecars() == _expected()
+        assert index.refresh() == (7, 0)
+        bucket.Object('data/bids/task-rest_bold.json').put(
+            Body=json.dumps({'RepetitionTime': 0.8}).encode())
+        assert index.refresh() == (7, 1)
+        assert index.files_and_sidecars(['sub-1'])[1][
+            'task-rest_bold.json'] == {'RepetitionTime': 0.8}
@@ -0,0 +1,119 @@
+"""Tests for staging S3 inputs into a local cache"""
+import os
+
+import boto3
+from moto import mock_s3
+import pytest
+
+from CPAC.utils.configuration import Preconfiguration
+from CPAC.utils.s3_staging import CACHE_ENV, CACHE_SIZE_ENV, \
+                                  prefetch_s3_inputs, S3Cache, stage_inputs
+
+BUCKET = 'cpac-test-inputs'
+
+
+@pytest.fixture(name='bucket')
+def fixture_bucket(monkeypatch):
+    """A mocked bucket with a few inputs in it"""
+    for var in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(var, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_s3():
+        s3 = boto3.resource('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        for key in ('sub-1/anat/sub-1_T1w.nii.gz', 'sub-1/func/bold.nii.gz',
+                    'templates/rois_2mm.nii.gz'):
+            s3.Object(BUCKET, key).put(Body=key.encode() * 100)
+        yield s3.Bucket(BUCKET)
+
+
+def _get_bucket(creds_path, bucket_name):
+    # pylint: disable=unused-argument
+    return boto3.resource('s3').Bucket(bucket_name)
+
+
+def test_prefetch_caches_by_etag(bucket, tmp_path):
+    """Objects are downloaded once, and again only when they change"""
+    cache = S3Cache(tmp_path / 'cache')
+    paths = [f's3://{BUCKET}/{obj.key}' for obj in bucket.objects.all()]
+    local_paths = prefetch_s3_inputs(paths, cache, num_threads=3,
+                                     get_bucket=_get_bucket)
+    assert list(local_paths) == paths
+    for path, local_path in local_paths.items():
+        key = path.split('/', 3)[-1]
+        assert os.path.basename(local_path) == os.path.basename(key)
+        with open(local_path, 'rb') as local_file:
+            assert local_file.read() == key.encode() * 100
+        assert cache.lookup(BUCKET, key) == local_path
+
+    key = 'templates/rois_2mm.nii.gz'
+    assert cache.fetch(bucket, key) == (local_paths[f's3://{BUCKET}/{key}'],
+                                        0)
+    bucket.Object(key).put(Body=b'updated')
+    local_path, downloaded = cache.fetch(bucket, key)
+    assert downloaded == len(b'updated')
+    assert local_path != local_paths[f's3://{BUCKET}/{key}']
+    assert not os.path.exists(local_paths[f's3://{BUCKET}/{key}'])
+    assert cache.lookup(BUCKET, key) == local_path
+
+
+def test_prefetch_reports_missing(bucket, tmp_path):
+    """Every other object is fetched before a missing object is reported"""
+    cache = S3Cache(tmp_path / 'cache')
+    with pytest.raises(Exception, match='not_there.nii.gz'):
+        prefetch_s3_inputs([f's3://{BUCKET}/not_there.nii.gz',
+                            f's3://{BUCKET}/sub-1/func/bold.nii.gz'],
+                           cache, retries=2, get_bucket=_get_bucket)
+    assert cache.lookup(BUCKET, 'sub-1/func/bold.nii.gz')
+    assert cache.lookup(BUCKET, 'not_there.nii.gz') is None
+
+
+def test_eviction(bucket, tmp_path):
+    """The least recently used objects are evicted first"""
+    size = bucket.Object('sub-1/func/bold.nii.gz').content_length
+    cache = S3Cache(tmp_path / 'cache', max_size_gb=2.5 * size / 1024 ** 3)
+    for key in ('sub-1/anat/sub-1_T1w.nii.gz', 'sub-1/func/bold.nii.gz'):
+        cache.fetch(bucket, key)
+    os.utime(os.path.dirname(cache.lookup(BUCKET, 'sub-1/func/bold.nii.gz')),
+             (0, 0))
+    cache.fetch(bucket, 'templates/rois_2mm.nii.gz')
+    assert cache.lookup(BUCKET, 'sub-1/func/bold.nii.gz') is None
+    assert cache.lookup(BUCKET, 'sub-1/anat/sub-1_T1w.nii.gz')
+    assert cache.lookup(BUCKET, 'templates/rois_2mm.nii.gz')
+    assert cache.size() <= cache.max_size_gb * 1024 ** 3
+
+
+def test_prefetch_over_limit(bucket, tmp_path):
+    """Every staged object is kept, even beyond the cache's limit"""
+    keys = [f'sub-{i}/anat/T1w.nii.gz' for i in range(4)]
+    for key in keys:
+        bucket.put_object(Key=key, Body=b'x' * 1000)
+    cache = S3Cache(tmp_path / 'cache', max_size_gb=2500 / 1024 ** 3)
+    local_paths = prefetch_s3_inputs([f's3://{BUCKET}/{key}' for key in keys],
+                                     cache, num_threads=1,
+                                     get_bucket=_get_bucket)
+    assert len(local_paths) == len(keys)
+    assert all(os.path.isfile(path) for path in local_paths.values())
+    assert cache.size() == 4000
+
+
+def test_stage_inputs(bucket, monkeypatch, tmp_path):
+    """Every S3 path in a data configuration is staged"""
+    # pylint: disable=unused-argument
+    # stage_inputs sets these for the run; restore them after the test
+    for var in (CACHE_ENV, CACHE_SIZE_ENV):
+        monkeypatch.setenv(var, '')
+    cfg = Preconfiguration('blank')
+    cfg['pipeline_setup', 'Amazon-AWS', 'input_cache', 'path'] = str(
+        tmp_path / 'cache')
+    sublist = [{'subject_id': '1', 'unique_id': '1', 'creds_path': None,
+                'anat': f's3://{BUCKET}/sub-1/anat/sub-1_T1w.nii.gz',
+                'func': {'rest': {
+                    'scan': f's3://{BUCKET}/sub-1/func/bold.nii.gz',
+                    'scan_parameters': None}}}]
+    local_paths = stage_inputs(sublist, cfg, get_bucket=_get_bucket)
+    assert sorted(local_paths) == [
+        f's3://{BUCKET}/sub-1/anat/sub-1_T1w.nii.gz',
+        f's3://{BUCKET}/sub-1/func/bold.nii.gz']
+    assert all(os.path.isfile(path) for path in local_paths.values())
+    assert S3Cache.from_environment().path == str(tmp_path / 'cache')
@@ -217,13 +217,15 @@ def run_main():
                              'maximum_memory_per_participant in the pipeline '
                              'configuration file.')
     parser.add_argument('--runtime-usage', '--runtime_usage', type=str,
-                        help='Path to a callback.log from a prior run of the '
-                             'same pipeline configuration (including any '
+                        help='Path (or glob pattern) to callback.log files '
+                             'from prior runs of the same pipeline '
+                             'configuration (including any '
                              'resource-management parameters that will be '
                              "applied in this run, like 'n_cpus' and "
-                             "'num_ants_threads'). This log will be used to "
+                             "'num_ants_threads'). These logs will be used to "
                              'override per-node memory estimates with '
-                             'observed values plus a buffer.')
+                             'observed values, or a model of observed values '
+                             'over input data size, plus a buffer.')
     parser.add_argument('--runtime-buffer', '--runtime_buffer', type=float,
                         help='Buffer to add to per-node memory estimates if '
                              '--runtime_usage is specified. This number is a '